@@ -1,25 +1,20 @@
-from base64 import b64encode
-import json
 import re
 import sys
-from socketserver import ForkingTCPServer, StreamRequestHandler
-from traceback import format_exception
-from typing import Any
 from compiler.tokenizer import tokenize
 from compiler.parser import parse
 from compiler.type_checker import typecheck
 from compiler.ir_generator import generate_ir
 from compiler.assembly_generator import generate_assembly
-from compiler.assembler import assemble_and_get_executable
+from compiler.pipeline import CompileOptions, call_compiler
+from compiler import peephole
+from compiler.constant_propagation import propagate_constants
+from compiler.dead_code import eliminate_dead_code
+from compiler.ssa import from_ssa, to_ssa
+from compiler.server import run_server
+from compiler.async_server import run_async_server
 
-
-def call_compiler(source_code: str, input_file_name: str) -> bytes:
-    tokens = tokenize(source_code)
-    ast_node = parse(tokens)
-    typecheck(ast_node)
-    ir = generate_ir(ast_node)
-    asm_code = generate_assembly(ir)
-    return assemble_and_get_executable(asm_code)
+# The register allocator used at each `-O` level.
+optimization_levels = ["stack", "linear-scan", "graph-coloring"]
 
 
 def main() -> int:
@@ -29,6 +24,20 @@ def main() -> int:
     output_file: str | None = None
     host = "127.0.0.1"
     port = 3000
+    server = "prefork"
+    workers: int | None = None
+    max_requests = 0
+    request_queue_size = 32
+    cache_entries = 1024
+    cache_dir: str | None = None
+    max_concurrency: int | None = None
+    max_queue = 64
+    deadline: float | None = 60
+    assembler = "native"
+    register_allocator = "linear-scan"
+    use_peephole = True
+    use_constant_propagation = False
+    use_dead_code_elimination = False
     for arg in sys.argv[1:]:
         if (m := re.fullmatch(r"--output=(.+)", arg)) is not None:
             output_file = m[1]
@@ -36,6 +45,43 @@ def main() -> int:
             host = m[1]
         elif (m := re.fullmatch(r"--port=(.+)", arg)) is not None:
             port = int(m[1])
+        elif (m := re.fullmatch(r"--server=(prefork|async)", arg)) is not None:
+            server = m[1]
+        elif (m := re.fullmatch(r"--workers=(.+)", arg)) is not None:
+            workers = int(m[1])
+        elif (m := re.fullmatch(r"--max-requests=(.+)", arg)) is not None:
+            max_requests = int(m[1])
+        elif (m := re.fullmatch(r"--request-queue-size=(.+)", arg)) is not None:
+            request_queue_size = int(m[1])
+        elif (m := re.fullmatch(r"--cache-entries=(.+)", arg)) is not None:
+            cache_entries = int(m[1])
+        elif (m := re.fullmatch(r"--cache-dir=(.+)", arg)) is not None:
+            cache_dir = m[1]
+        elif (m := re.fullmatch(r"--max-concurrency=(.+)", arg)) is not None:
+            max_concurrency = int(m[1])
+        elif (m := re.fullmatch(r"--max-queue=(.+)", arg)) is not None:
+            max_queue = int(m[1])
+        elif (m := re.fullmatch(r"--deadline=(.+)", arg)) is not None:
+            deadline = float(m[1]) or None
+        elif (m := re.fullmatch(r"--assembler=(native|gnu)", arg)) is not None:
+            assembler = m[1]
+        elif (
+            m := re.fullmatch(
+                r"--register-allocator=(linear-scan|graph-coloring|stack)", arg
+            )
+        ) is not None:
+            register_allocator = m[1]
+        elif (m := re.fullmatch(r"-O([012])", arg)) is not None:
+            register_allocator = optimization_levels[int(m[1])]
+            # They pay off too rarely to slow down every compile.
+            use_constant_propagation = int(m[1]) == 2
+            use_dead_code_elimination = int(m[1]) == 2
+        elif (m := re.fullmatch(r"--peephole=(on|off)", arg)) is not None:
+            use_peephole = m[1] == "on"
+        elif (m := re.fullmatch(r"--constant-propagation=(on|off)", arg)) is not None:
+            use_constant_propagation = m[1] == "on"
+        elif (m := re.fullmatch(r"--dead-code-elimination=(on|off)", arg)) is not None:
+            use_dead_code_elimination = m[1] == "on"
         elif arg.startswith("-"):
             raise Exception(f"Unknown argument: {arg}")
         elif command is None:
@@ -56,13 +102,23 @@ def main() -> int:
         else:
             return sys.stdin.read()
 
+    options = CompileOptions(
+        assembler=assembler,
+        register_allocator=register_allocator,
+        peephole=use_peephole,
+        constant_propagation=use_constant_propagation,
+        dead_code_elimination=use_dead_code_elimination,
+    )
+
     # === Command implementations ===
 
     if command == "compile":
         source_code = read_source_code()
         if output_file is None:
             raise Exception("Output file flag --output=... required")
-        executable = call_compiler(source_code, input_file or "(source code)")
+        executable = call_compiler(
+            source_code, input_file or "(source code)", options=options
+        )
         with open(output_file, "wb") as f:
             f.write(executable)
     elif command == "ast":
@@ -76,20 +132,41 @@ def main() -> int:
         ast_node = parse(tokens)
         typecheck(ast_node)
         ir = generate_ir(ast_node)
-        for i in ir.values():
-            for j in i:
-                print(j)
+        for fun in ir.values():
+            for insn in fun.instructions:
+                print(insn)
     elif command == "asm":
         source_code = read_source_code()
         tokens = tokenize(source_code)
         ast_node = parse(tokens)
         typecheck(ast_node)
         ir = generate_ir(ast_node)
-        asm_code = generate_assembly(ir)
+        if options.constant_propagation:
+            ir = {
+                name: from_ssa(propagate_constants(to_ssa(fun)))
+                for name, fun in ir.items()
+            }
+        if options.dead_code_elimination:
+            ir = {name: eliminate_dead_code(fun) for name, fun in ir.items()}
+        asm_code = generate_assembly(ir, options.register_allocator)
+        if options.peephole:
+            asm_code = peephole.optimize(asm_code)
         print(asm_code)
     elif command == "serve":
         try:
-            run_server(host, port)
+            (run_async_server if server == "async" else run_server)(
+                host,
+                port,
+                workers=workers,
+                max_requests=max_requests,
+                request_queue_size=request_queue_size,
+                cache_entries=cache_entries,
+                cache_dir=cache_dir,
+                max_concurrency=max_concurrency,
+                max_queue=max_queue,
+                deadline=deadline,
+                options=options,
+            )
         except KeyboardInterrupt:
             pass
     else:
@@ -98,34 +175,5 @@ def main() -> int:
     return 0
 
 
-def run_server(host: str, port: int) -> None:
-    class Server(ForkingTCPServer):
-        allow_reuse_address = True
-        request_queue_size = 32
-
-    class Handler(StreamRequestHandler):
-        def handle(self) -> None:
-            result: dict[str, Any] = {}
-            try:
-                input_str = self.rfile.read().decode()
-                input = json.loads(input_str)
-                if input["command"] == "compile":
-                    source_code = input["code"]
-                    executable = call_compiler(source_code, "(source code)")
-                    result["program"] = b64encode(executable).decode()
-                elif input["command"] == "ping":
-                    pass
-                else:
-                    result["error"] = "Unknown command: " + input["command"]
-            except Exception as e:
-                result["error"] = "".join(format_exception(e))
-            result_str = json.dumps(result)
-            self.request.sendall(str.encode(result_str))
-
-    print(f"Starting TCP server at {host}:{port}")
-    with Server((host, port), Handler) as server:
-        server.serve_forever()
-
-
 if __name__ == "__main__":
     sys.exit(main())
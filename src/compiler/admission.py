@@ -0,0 +1,70 @@
+import multiprocessing
+import time
+from contextlib import contextmanager
+from multiprocessing.context import BaseContext
+from typing import Iterator
+
+
+class OverloadedError(Exception):
+    """Raised when a request is rejected because the server is busy."""
+
+
+def remaining_time(deadline: float | None) -> float | None:
+    """Seconds left until a `time.monotonic()` deadline, or None if there is none."""
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def check_deadline(deadline: float | None) -> None:
+    if deadline is not None and time.monotonic() >= deadline:
+        raise Exception("Compile deadline exceeded")
+
+
+class AdmissionControl:
+    """Limits the load on a server whose work is spread over many processes.
+
+    At most `max_concurrency` compilations run at once,
+    and at most `max_queue` further requests may wait for their turn.
+    Requests beyond that are rejected right away with `OverloadedError`
+    so that clients can retry elsewhere.
+
+    The counters are kept in shared memory, so every process forked from
+    the creating process (or given the object when started) shares them.
+    """
+
+    def __init__(
+        self, max_concurrency: int, max_queue: int, context: BaseContext | None = None
+    ) -> None:
+        if max_concurrency < 1:
+            raise Exception(f"Invalid maximum concurrency: {max_concurrency}")
+        if context is None:
+            context = multiprocessing.get_context()
+        self.max_concurrency = max_concurrency
+        self._max_requests = max_concurrency + max_queue
+        self._requests = context.Value("i", 0)
+        self._slots = context.BoundedSemaphore(max_concurrency)
+
+    @contextmanager
+    def request(self) -> Iterator[None]:
+        """Admits a request for the duration of the `with` block."""
+        with self._requests.get_lock():
+            if self._requests.value >= self._max_requests:
+                raise OverloadedError("Server overloaded, try again later")
+            self._requests.value += 1
+        try:
+            yield
+        finally:
+            with self._requests.get_lock():
+                self._requests.value -= 1
+
+    @contextmanager
+    def compilation(self, deadline: float | None) -> Iterator[None]:
+        """Waits until a compilation may run, but not past the deadline,
+        and holds its place for the duration of the `with` block."""
+        if not self._slots.acquire(timeout=remaining_time(deadline)):
+            raise Exception("Compile deadline exceeded while waiting for a worker")
+        try:
+            yield
+        finally:
+            self._slots.release()
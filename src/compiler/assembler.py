@@ -1,9 +1,16 @@
+import atexit
+import hashlib
+import os
 import subprocess
 import tempfile
+from contextlib import AbstractContextManager, nullcontext
+from functools import cache
 from os import path
 from typing import Callable, TypeVar
 import shutil
 from pathlib import Path
+from compiler.admission import remaining_time
+from compiler.compile_stats import CompileStats
 
 T = TypeVar("T")
 
@@ -15,6 +22,8 @@ def assemble(
     tempfile_basename: str = "program",
     link_with_c: bool = False,
     extra_libraries: list[str] = [],
+    stats: CompileStats | None = None,
+    deadline: float | None = None,
 ) -> None:
     """Invokes 'as' and 'ld' to generate an executable file from Assembly code.
 
@@ -26,7 +35,10 @@ def assemble(
         tempfile_basename=tempfile_basename,
         link_with_c=link_with_c,
         extra_libraries=extra_libraries,
-        take_output=lambda f: shutil.move(f, output_file),
+        stats=stats,
+        deadline=deadline,
+        output_file=path.abspath(output_file),
+        take_output=lambda f: None,
     )
 
 
@@ -36,6 +48,8 @@ def assemble_and_get_executable(
     tempfile_basename: str = "program",
     link_with_c: bool = False,
     extra_libraries: list[str] = [],
+    stats: CompileStats | None = None,
+    deadline: float | None = None,
 ) -> bytes:
     """Invokes 'as' and 'ld' to generate an executable file from Assembly code.
 
@@ -47,6 +61,9 @@ def assemble_and_get_executable(
         tempfile_basename=tempfile_basename,
         link_with_c=link_with_c,
         extra_libraries=extra_libraries,
+        stats=stats,
+        deadline=deadline,
+        output_file=None,
         take_output=lambda f: Path(f).read_bytes(),
     )
 
@@ -57,6 +74,9 @@ def _assemble(
     tempfile_basename: str,
     link_with_c: bool,
     extra_libraries: list[str],
+    stats: CompileStats | None,
+    deadline: float | None,
+    output_file: str | None,
     take_output: Callable[[str], T],
 ) -> T:
     if workdir is not None:
@@ -67,17 +87,27 @@ def _assemble(
             tempfile_basename,
             link_with_c,
             extra_libraries,
+            stats,
+            deadline,
+            output_file,
             take_output,
+            keep_source=True,
         )
     else:
-        with tempfile.TemporaryDirectory(prefix="compiler_") as wd:
+        with tempfile.TemporaryDirectory(
+            prefix="compiler_", dir=_default_workdir_parent()
+        ) as wd:
             return _assemble_impl(
                 assembly_code,
                 wd,
                 tempfile_basename,
                 link_with_c,
                 extra_libraries,
+                stats,
+                deadline,
+                output_file,
                 take_output,
+                keep_source=False,
             )
 
 
@@ -87,43 +117,156 @@ def _assemble_impl(
     tempfile_basename: str,
     link_with_c: bool,
     extra_libraries: list[str],
+    stats: CompileStats | None,
+    deadline: float | None,
+    output_file: str | None,
     take_output: Callable[[str], T],
+    keep_source: bool,
 ) -> T:
-    stdlib_asm = path.join(workdir, "stdlib.s")
-    stdlib_obj = path.join(workdir, "stdlib.o")
     program_asm = path.join(workdir, f"{tempfile_basename}.s")
     program_obj = path.join(workdir, f"{tempfile_basename}.o")
-    output_file = path.join(workdir, "a.out")
-
-    if link_with_c:
-        final_stdlib_asm_code = drop_start_symbol(stdlib_asm_code)
-    else:
-        final_stdlib_asm_code = stdlib_asm_code
-
-    with open(stdlib_asm, "w") as f:
-        f.write(final_stdlib_asm_code)
-    with open(program_asm, "w") as f:
-        f.write(assembly_code)
-    subprocess.run(["as", "-g", "-o" + stdlib_obj, stdlib_asm], check=True)
-    subprocess.run(["as", "-g", "-o" + program_obj, program_asm], check=True)
+    if output_file is None:
+        output_file = path.join(workdir, "a.out")
+
+    with _stage(stats, "as"):
+        # The stdlib, if not yet cached, is assembled while the program is.
+        stdlib = _StdlibBuild(link_with_c)
+        try:
+            if keep_source:
+                # Write the code out so that debuggers can find it.
+                with open(program_asm, "w") as f:
+                    f.write(assembly_code)
+                subprocess.run(
+                    ["as", "-g", "-o" + program_obj, program_asm],
+                    check=True,
+                    timeout=remaining_time(deadline),
+                )
+            else:
+                subprocess.run(
+                    ["as", "-o" + program_obj],
+                    input=assembly_code.encode(),
+                    check=True,
+                    timeout=remaining_time(deadline),
+                )
+            stdlib_obj = stdlib.wait(remaining_time(deadline))
+        finally:
+            stdlib.kill()
     linker_flags = ["-static", *[f"-l{lib}" for lib in extra_libraries]]
-    if link_with_c:
-        # Linking with the C standard library correctly is complicated,
-        # as evidenced by the complicated linker command shown by `cc -v something.c`.
-        # Instead of trying to build the right `ld` command ourselves, we use the C compiler
-        # to do the linking.
-        subprocess.run(
-            ["cc", "-o" + output_file, *linker_flags, stdlib_obj, program_obj],
-            check=True,
-        )
-    else:
-        subprocess.run(
-            ["ld", "-o" + output_file, *linker_flags, stdlib_obj, program_obj],
-            check=True,
-        )
+    with _stage(stats, "ld"):
+        if link_with_c:
+            # Linking with the C standard library correctly is complicated,
+            # as evidenced by the complicated linker command shown by `cc -v something.c`.
+            # Instead of trying to build the right `ld` command ourselves, we use the C compiler
+            # to do the linking.
+            subprocess.run(
+                ["cc", "-o" + output_file, *linker_flags, stdlib_obj, program_obj],
+                check=True,
+                timeout=remaining_time(deadline),
+            )
+        else:
+            subprocess.run(
+                ["ld", "-o" + output_file, *linker_flags, stdlib_obj, program_obj],
+                check=True,
+                timeout=remaining_time(deadline),
+            )
     return take_output(output_file)
 
 
+def _stage(stats: CompileStats | None, name: str) -> AbstractContextManager[None]:
+    return stats.stage(name) if stats is not None else nullcontext()
+
+
+@cache
+def _default_workdir_parent() -> str | None:
+    """Returns a RAM-backed directory for temporary files if there is one,
+    unless TMPDIR asks for a specific place."""
+    if os.environ.get("TMPDIR"):
+        return None
+    if path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK | os.X_OK):
+        return "/dev/shm"
+    return None
+
+
+def stdlib_object(link_with_c: bool) -> str:
+    """Returns the path of an object file assembled from the stdlib.
+
+    The object file is kept in a cache directory under a name derived from
+    the stdlib code, so it is only assembled once and then shared by every
+    compilation, process and run of the compiler.
+    """
+    return _StdlibBuild(link_with_c).wait(None)
+
+
+class _StdlibBuild:
+    """Starts assembling the stdlib object file in the background,
+    unless it's already in the cache."""
+
+    def __init__(self, link_with_c: bool) -> None:
+        code, name = _stdlib_variant(link_with_c)
+        self.cached = _stdlib_cache_dir() / name
+        self.process: subprocess.Popen[bytes] | None = None
+        if self.cached.exists():
+            return
+        # Assemble into a private file and then rename it into place,
+        # so that concurrent compilations never see a partially written
+        # object file.
+        fd, self.tmp_obj = tempfile.mkstemp(dir=self.cached.parent, prefix=".tmp")
+        os.close(fd)
+        try:
+            self.process = subprocess.Popen(
+                ["as", "-o" + self.tmp_obj], stdin=subprocess.PIPE
+            )
+        except BaseException:
+            os.unlink(self.tmp_obj)
+            raise
+        assert self.process.stdin is not None
+        try:
+            # The stdlib is small enough to fit in the pipe buffer.
+            self.process.stdin.write(code.encode())
+            self.process.stdin.close()
+        except BrokenPipeError:
+            # `as` has already exited, and `wait` reports how.
+            pass
+
+    def wait(self, timeout: float | None) -> str:
+        if self.process is not None:
+            returncode = self.process.wait(timeout)
+            self.process = None
+            if returncode != 0:
+                os.unlink(self.tmp_obj)
+                raise subprocess.CalledProcessError(returncode, "as")
+            os.replace(self.tmp_obj, self.cached)
+        return str(self.cached)
+
+    def kill(self) -> None:
+        """Stops the build if it hasn't been waited for."""
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+            os.unlink(self.tmp_obj)
+
+
+@cache
+def _stdlib_variant(link_with_c: bool) -> tuple[str, str]:
+    """Returns the stdlib code to use and the name of its object file."""
+    code = drop_start_symbol(stdlib_asm_code) if link_with_c else stdlib_asm_code
+    return code, f"stdlib-{hashlib.sha256(code.encode()).hexdigest()[:16]}.o"
+
+
+@cache
+def _stdlib_cache_dir() -> Path:
+    base = os.environ.get("XDG_CACHE_HOME") or path.join(path.expanduser("~"), ".cache")
+    directory = Path(base) / "compiler"
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        # Fall back to a directory that only lives as long as this process.
+        directory = Path(tempfile.mkdtemp(prefix="compiler_stdlib_"))
+        atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    return directory
+
+
 def drop_start_symbol(code: str) -> str:
     return code.split("# BEGIN START")[0] + code.split("# END START")[1]
 
@@ -363,7 +506,7 @@ read_int:
     neg %r10
 .Lfinal_negation_done:
     # Restore stack registers and return the result
-    popq %r12
+    movq -8(%rbp), %r12  # The input slot is on top of the saved r12
     movq %rbp, %rsp
     popq %rbp
     movq %r10, %rax
@@ -1,129 +1,395 @@
-import re
-import ast
 from compiler import ir
 from dataclasses import fields
-from compiler.intrinsics import all_intrinsics, IntrinsicArgs
+from collections import Counter
+from compiler.intrinsics import (
+    all_intrinsics,
+    comparison_conditions,
+    immediate_args,
+    operand_kind,
+    IntrinsicArgs,
+)
+from compiler.dataflow import defs, uses
+from compiler.register_allocator import (
+    Allocation,
+    all_stack_allocation,
+    graph_coloring_allocation,
+    is_function_call,
+    linear_scan_allocation,
+    undefined_location,
+)
 
 regs = ["%rdi", "%rsi", "%rdx", "%rcx", "%r8", "%r9"]
 
+negated_conditions = {
+    "e": "ne",
+    "ne": "e",
+    "l": "ge",
+    "ge": "l",
+    "le": "g",
+    "g": "le",
+}
 
-def generate_assembly(instructions: dict[str, list[ir.Instruction]]) -> str:
+# The conditions that hold when the operands of a comparison are swapped.
+swapped_conditions = {
+    "e": "e",
+    "ne": "ne",
+    "l": "g",
+    "g": "l",
+    "le": "ge",
+    "ge": "le",
+}
+
+
+def stack_allocation(
+    instructions: list[ir.Instruction], params: list[ir.IRVar]
+) -> Allocation:
+    """Gives every assigned variable and parameter its own stack slot."""
+    variables = get_all_ir_variables(instructions)
+    defined = set(params) | {v for insn in instructions for v in defs(insn)}
+    allocation = all_stack_allocation([v for v in variables if v in defined])
+    for v in variables:
+        allocation.locations.setdefault(v, undefined_location)
+    return allocation
+
+
+register_allocators = {
+    "stack": stack_allocation,
+    "linear-scan": linear_scan_allocation,
+    "graph-coloring": graph_coloring_allocation,
+}
+
+
+def generate_assembly(
+    functions: dict[str, ir.Function],
+    register_allocator: str = "linear-scan",
+) -> str:
+    """Generates assembly for the functions of a program.
+
+    `register_allocator` is "linear-scan" to keep variables in registers
+    where possible, "graph-coloring" to also remove copies between variables
+    at the cost of slower compilation, or "stack" to give every variable
+    its own stack slot."""
     assembly_code_lines = []
 
     def emit(line: str) -> None:
         assembly_code_lines.append(line)
 
+    def move(src: str, dest: str) -> None:
+        if src == dest:
+            return
+        if src.startswith(("%", "$")) or dest.startswith("%"):
+            emit(f"movq {src}, {dest}")
+        else:
+            emit(f"movq {src}, %rax")
+            emit(f"movq %rax, {dest}")
+
+    def parallel_move(moves: list[tuple[str, str]]) -> None:
+        """Moves values into registers as if all moves happened at once."""
+        pending = [(src, dest) for src, dest in moves if src != dest]
+        # Cycles are broken through %rdx unless the moves involve it, since
+        # moves between memory go through %rax. Register cycles never do.
+        taken = {location for move in moves for location in move}
+        temp = "%rdx" if "%rdx" not in taken else "%rax"
+        while pending:
+            for i, (src, dest) in enumerate(pending):
+                if all(dest != other for j, (other, _) in enumerate(pending) if j != i):
+                    move(src, dest)
+                    del pending[i]
+                    break
+            else:
+                # The remaining moves form cycles. Break one by moving
+                # a destination's current value out of the way.
+                blocked = pending[0][1]
+                emit(f"movq {blocked}, {temp}")
+                pending = [
+                    (temp if src == blocked else src, dest) for src, dest in pending
+                ]
+
+    def emit_branch(
+        condition: str, jump: ir.CondJump, next: ir.Instruction | None
+    ) -> None:
+        """Jumps to the then label if the condition holds and to the else
+        label otherwise, falling through when either one comes next."""
+        then_label = f".{func_name}_{jump.then_label.name}"
+        else_label = f".{func_name}_{jump.else_label.name}"
+        if isinstance(next, ir.Label) and next.name == jump.then_label.name:
+            emit(f"j{negated_conditions[condition]} {else_label}")
+        else:
+            emit(f"j{condition} {then_label}")
+            if not (isinstance(next, ir.Label) and next.name == jump.else_label.name):
+                emit(f"jmp {else_label}")
+
+    def emit_call(fun_name: str, arg_refs: list[str]) -> None:
+        """Calls a function with the System V calling convention: the first
+        six arguments in registers and the rest on the stack. %rsp is kept
+        16-byte aligned at every call."""
+        stack_args = arg_refs[len(regs) :]
+        padding = 8 * (len(stack_args) % 2)
+        if padding:
+            emit(f"subq ${padding}, %rsp")
+        for ref in reversed(stack_args):
+            emit(f"pushq {ref}")
+        parallel_move(list(zip(arg_refs, regs)))
+        emit(f"callq {fun_name}")
+        if stack_args:
+            emit(f"addq ${8 * len(stack_args) + padding}, %rsp")
+
+    def emit_tail_call(call: ir.Call) -> None:
+        """Calls a function whose result is returned right away by jumping
+        to it, so that the stack doesn't grow."""
+        arg_refs = [locals.get_ref(arg) for arg in call.args]
+        if call.fun.name == func_name:
+            # Start over with the arguments as the new parameters.
+            parallel_move(
+                [
+                    (ref, locals.get_ref(param))
+                    for ref, param in zip(arg_refs, params)
+                    if locals.receives_param(param)
+                ]
+            )
+            emit(f"jmp .{func_name}_start")
+        else:
+            # The callee returns straight to our caller.
+            parallel_move(list(zip(arg_refs, regs)))
+            emit_epilogue(locals)
+            emit(f"jmp {call.fun.name}")
+
+    def emit_return(locals: Locals) -> None:
+        emit_epilogue(locals)
+        emit("ret")
+
+    def emit_epilogue(locals: Locals) -> None:
+        """Restores callee-saved registers and the caller's %rsp."""
+        if needs_frame:
+            for register, slot in locals.saved_registers.items():
+                emit(f"movq {slot}, {register}")
+            emit("movq %rbp, %rsp")
+            emit("popq %rbp")
+        else:
+            if alignment_padding:
+                emit("addq $8, %rsp")
+            for register in reversed(locals.saved_registers):
+                emit(f"popq {register}")
+
     emit(".extern print_int")
     emit(".section .text")
 
-    for name, fun in instructions.items():
-        locals = Locals(get_all_ir_variables(fun))
+    for function in functions.values():
+        fun = function.instructions
+        params = function.params
+        immediates = immediate_constants(fun, params)
+        # Constants used only as immediate operands need no location.
+        allocation = register_allocators[register_allocator](
+            [
+                isn
+                for isn in fun
+                if not (
+                    isinstance(isn, (ir.LoadIntConst, ir.LoadBoolConst))
+                    and isn.dest in immediates
+                )
+            ],
+            params,
+        )
+        for var, value in immediates.items():
+            allocation.locations[var] = f"${value}"
+        locals = Locals(get_all_ir_variables(fun), allocation)
 
-        func_name = name.split("(", 1)[0]
+        func_name = function.name
 
         emit(f".global {func_name}")
         emit(f".type {func_name}, @function")
 
         emit(f"{func_name}:")
 
-        emit("pushq %rbp")
-        emit("movq %rsp, %rbp")
+        # Without spilled variables %rbp isn't needed, and callee-saved
+        # registers can simply be pushed.
+        needs_frame = locals.has_stack_slots() or len(params) > len(regs)
+        alignment_padding = False
+        if needs_frame:
+            emit("pushq %rbp")
+            emit("movq %rsp, %rbp")
+            if locals.stack_used() > 0:
+                emit(f"subq ${locals.stack_used()}, %rsp")
+            for register, slot in locals.saved_registers.items():
+                emit(f"movq {register}, {slot}")
+        else:
+            for register in locals.saved_registers:
+                emit(f"pushq {register}")
+            # Keep %rsp aligned the same way as with a frame for calls,
+            # which a leaf function doesn't make.
+            alignment_padding = len(locals.saved_registers) % 2 == 0 and any(
+                is_function_call(isn) for isn in fun
+            )
+            if alignment_padding:
+                emit("subq $8, %rsp")
+        parallel_move(
+            [
+                (param_location(i), locals.get_ref(param))
+                for i, param in enumerate(params)
+                if locals.receives_param(param)
+            ]
+        )
 
-        if name != "main":
-            match = re.search(r"\[(.*?)\]", name)
-            if match:
-                args_list_str = match.group(1)
-                if args_list_str != "":
-                    args_list = ast.literal_eval(args_list_str)
-                    i = 0
-                    for v in locals._var_to_location:
-                        if v.name in args_list:
-                            emit(f"movq {regs[i]}, {locals.get_ref(v)}")
-                            i += 1
+        use_counts = Counter(v for isn in fun for v in uses(isn))
+        # Indices of CondJumps already emitted together with their comparison.
+        fused_jumps: set[int] = set()
+        # Indices of Returns already emitted as tail calls.
+        tail_calls: set[int] = set()
 
-        emit(f"subq ${locals.stack_used()}, %rsp")
-
-        for isn in fun:
+        for i, isn in enumerate(fun):
+            next_isn = fun[i + 1] if i + 1 < len(fun) else None
             match isn:
                 case ir.Label():
                     emit(f".{func_name}_{isn.name}:")
                 case ir.LoadIntConst():
+                    if isn.dest in immediates:
+                        continue
+                    dest = locals.get_ref(isn.dest)
                     if -(2**31) <= isn.value < 2**31:
-                        emit(f"movq ${isn.value}, {locals.get_ref(isn.dest)}")
+                        emit(f"movq ${isn.value}, {dest}")
+                    elif dest.startswith("%"):
+                        emit(f"movabsq ${isn.value}, {dest}")
                     else:
                         emit(f"movabsq ${isn.value}, %rax")
-                        emit(f"movq %rax, {locals.get_ref(isn.dest)}")
+                        emit(f"movq %rax, {dest}")
                 case ir.LoadBoolConst():
+                    if isn.dest in immediates:
+                        continue
                     emit(f"movq ${int(isn.value)}, {locals.get_ref(isn.dest)}")
                 case ir.Copy():
-                    emit(f"movq {locals.get_ref(isn.src)}, %rax")
-                    emit(f"movq %rax, {locals.get_ref(isn.dest)}")
+                    move(locals.get_ref(isn.src), locals.get_ref(isn.dest))
                 case ir.Jump():
                     emit(f"jmp .{func_name}_{isn.label.name}")
                 case ir.CondJump():
-                    emit(f"cmpq $0, {locals.get_ref(isn.cond)}")
-                    emit(f"jne .{func_name}_{isn.then_label.name}")
-                    emit(f"jmp .{func_name}_{isn.else_label.name}")
+                    cond = locals.get_ref(isn.cond)
+                    if i in fused_jumps:
+                        pass
+                    elif operand_kind(cond) == "immediate":
+                        # The condition is known, so only one label is reachable.
+                        target = isn.then_label if cond != "$0" else isn.else_label
+                        if not (
+                            isinstance(next_isn, ir.Label)
+                            and next_isn.name == target.name
+                        ):
+                            emit(f"jmp .{func_name}_{target.name}")
+                    else:
+                        emit(f"cmpq $0, {cond}")
+                        emit_branch("ne", isn, next_isn)
                 case ir.Call():
-                    if (intrinsic := all_intrinsics.get(isn.fun.name)) is not None:
+                    dest = locals.get_ref(isn.dest)
+                    if (
+                        isn.fun.name in comparison_conditions
+                        and isinstance(next_isn, ir.CondJump)
+                        and next_isn.cond == isn.dest
+                        and use_counts[isn.dest] == 1
+                    ):
+                        # The comparison only decides the branch right after
+                        # it, so its result needn't be stored anywhere.
+                        left, right = (locals.get_ref(arg) for arg in isn.args)
+                        condition = comparison_conditions[isn.fun.name]
+                        kinds = (operand_kind(left), operand_kind(right))
+                        if kinds[0] == "immediate" and kinds[1] != "immediate":
+                            left, right = right, left
+                            condition = swapped_conditions[condition]
+                        elif kinds[0] == "immediate" or kinds == ("memory", "memory"):
+                            emit(f"movq {left}, %rax")
+                            left = "%rax"
+                        emit(f"cmpq {right}, {left}")
+                        emit_branch(
+                            condition,
+                            next_isn,
+                            fun[i + 2] if i + 2 < len(fun) else None,
+                        )
+                        fused_jumps.add(i + 1)
+                    elif (intrinsic := all_intrinsics.get(isn.fun.name)) is not None:
+                        arg_refs = [locals.get_ref(arg) for arg in isn.args]
+                        # The result may go straight to its register, unless
+                        # the intrinsic still needs to read that register
+                        # after writing the result.
+                        if dest.startswith("%") and dest not in arg_refs[1:]:
+                            result_register = dest
+                        else:
+                            result_register = "%rax"
                         args = IntrinsicArgs(
-                            arg_refs=[locals.get_ref(arg) for arg in isn.args],
-                            result_register="%rax",
+                            arg_refs=arg_refs,
+                            result_register=result_register,
                             emit=emit,
+                            arg_kinds=[operand_kind(ref) for ref in arg_refs],
                         )
                         intrinsic(args)
-                        emit(f"movq %rax, {locals.get_ref(isn.dest)}")
+                        move(result_register, dest)
                     else:
                         match isn.fun.name:
-                            case "print_int":
-                                emit("subq $8, %rsp")
-                                if len(isn.args) != 1:
-                                    raise Exception(
-                                        f"Expected 1 argument for print_int, got {len(isn.args)}"
-                                    )
-                                emit(f"movq {locals.get_ref(isn.args[0])}, %rdi")
-                                emit("callq print_int")
-                                emit(f"movq %rax, {locals.get_ref(isn.dest)}")
-                                emit("addq $8, %rsp")
-                            case "print_bool":
+                            case "print_int" | "print_bool":
                                 if len(isn.args) != 1:
                                     raise Exception(
-                                        f"Expected 1 argument for print_int, got {len(isn.args)}"
+                                        f"Expected 1 argument for {isn.fun.name}, got {len(isn.args)}"
                                     )
-                                emit(f"movq {locals.get_ref(isn.args[0])}, %rdi")
-                                emit("callq print_bool")
-                                emit(f"movq %rax, {locals.get_ref(isn.dest)}")
                             case "read_int":
-                                emit("callq read_int")
-                                emit(f"movq %rax, {locals.get_ref(isn.dest)}")
+                                pass
                             case _:
-                                if any(
-                                    isn.fun.name == key.split("(", 1)[0]
-                                    for key in instructions
-                                ):
-                                    for i, arg in enumerate(isn.args):
-                                        emit(f"movq {locals.get_ref(arg)}, {regs[i]}")
-                                    emit(f"callq {isn.fun.name}")
-                                    emit(f"movq %rax, {locals.get_ref(isn.dest)}")
-                                else:
+                                if isn.fun.name not in functions:
                                     raise Exception(f"Unknown function: {isn.fun.name}")
+                                if (
+                                    isinstance(next_isn, ir.Return)
+                                    and next_isn.value == isn.dest
+                                    and (
+                                        isn.fun.name == func_name
+                                        or len(isn.args) <= len(regs)
+                                    )
+                                ):
+                                    emit_tail_call(isn)
+                                    tail_calls.add(i + 1)
+                                    continue
+                        emit_call(
+                            isn.fun.name, [locals.get_ref(arg) for arg in isn.args]
+                        )
+                        move("%rax", dest)
                 case ir.Return():
-                    emit(f"movq {locals.get_ref(isn.value)}, %rax")
-                    emit("movq %rbp, %rsp")
-                    emit("popq %rbp")
-                    emit("ret")
+                    if i not in tail_calls:
+                        move(locals.get_ref(isn.value), "%rax")
+                        emit_return(locals)
                 case _:
                     raise Exception(f"Unknown instruction: {type(isn)}")
 
-    emit("movq $0, %rax")
-    emit("movq %rbp, %rsp")
-    emit("popq %rbp")
-    emit("ret")
+        if func_name == "main":
+            emit("movq $0, %rax")
+            emit_return(locals)
     emit("")
 
     return "\n".join(assembly_code_lines)
 
 
+def param_location(index: int) -> str:
+    """Returns where a function receives the parameter with the given index:
+    a register for the first six and the caller's stack for the rest."""
+    if index < len(regs):
+        return regs[index]
+    return f"{16 + 8 * (index - len(regs))}(%rbp)"
+
+
+def immediate_constants(
+    instructions: list[ir.Instruction], params: list[ir.IRVar]
+) -> dict[ir.IRVar, int]:
+    """Returns the variables that only ever hold one constant which fits in
+    an immediate operand, and are never used where immediates aren't allowed."""
+    constants: dict[ir.IRVar, int] = {}
+    excluded: set[ir.IRVar] = set(params)
+    for insn in instructions:
+        if (
+            isinstance(insn, (ir.LoadIntConst, ir.LoadBoolConst))
+            and -(2**31) <= insn.value < 2**31
+            and insn.dest not in constants
+        ):
+            constants[insn.dest] = int(insn.value)
+        else:
+            excluded.update(defs(insn))
+        if isinstance(insn, ir.Call) and insn.fun.name in all_intrinsics:
+            allowed = immediate_args[insn.fun.name]
+            excluded.update(arg for i, arg in enumerate(insn.args) if i not in allowed)
+    return {v: value for v, value in constants.items() if v not in excluded}
+
+
 def get_all_ir_variables(instructions: list[ir.Instruction]) -> list[ir.IRVar]:
     result_list: list[ir.IRVar] = []
     result_set: set[ir.IRVar] = set()
@@ -146,24 +412,40 @@ def get_all_ir_variables(instructions: list[ir.Instruction]) -> list[ir.IRVar]:
 
 
 class Locals:
-    """Knows the memory location of every local variable."""
+    """Knows the location of every local variable:
+    either a register or a stack slot."""
 
     _var_to_location: dict[ir.IRVar, str]
     _stack_used: int
+    _unused_params: set[ir.IRVar]
+    # Callee-saved registers used by the function and where they are saved.
+    saved_registers: dict[str, str]
 
-    def __init__(self, variables: list[ir.IRVar]) -> None:
-        self._var_to_location = {}
-        self._stack_used = 8
-        for v in variables:
-            if v not in self._var_to_location:
-                self._var_to_location[v] = f"-{self._stack_used}(%rbp)"
-                self._stack_used += 8
+    def __init__(
+        self, variables: list[ir.IRVar], allocation: Allocation | None = None
+    ) -> None:
+        if allocation is None:
+            allocation = all_stack_allocation(variables)
+        self._var_to_location = allocation.locations
+        self._stack_used = allocation.stack_used
+        self.saved_registers = allocation.saved_registers
+        self._unused_params = allocation.unused_params
 
     def get_ref(self, v: ir.IRVar) -> str:
-        """Returns an Assembly reference like `-24(%rbp)`
-        for the memory location that stores the given variable"""
+        """Returns an Assembly reference like `-24(%rbp)` or `%rbx`
+        for the location that stores the given variable"""
         return self._var_to_location[v]
 
+    def receives_param(self, v: ir.IRVar) -> bool:
+        """Tells whether the incoming value of a parameter is needed."""
+        return v in self._var_to_location and v not in self._unused_params
+
     def stack_used(self) -> int:
         """Returns the number of bytes of stack space needed for the local variables."""
         return self._stack_used
+
+    def has_stack_slots(self) -> bool:
+        """Tells whether any variable is kept on the stack."""
+        return any(
+            location.endswith("(%rbp)") for location in self._var_to_location.values()
+        )
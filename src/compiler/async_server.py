@@ -0,0 +1,255 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import struct
+import time
+from contextlib import nullcontext
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from multiprocessing.context import BaseContext
+from traceback import format_exception
+from typing import Any, Callable, ParamSpec, TypeVar
+from compiler.admission import AdmissionControl, OverloadedError
+from compiler.compile_stats import StatsAggregator
+from compiler.pipeline import CompileOptions
+from compiler.server import (
+    compile_program,
+    configure_worker,
+    encode_response,
+    handle_decoded_request,
+    overloaded_response,
+)
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+# Every request and response is a 4-byte big-endian length followed by
+# that many bytes of JSON. Binary mode responses are followed by the raw
+# executable (see `encode_response`).
+_frame_header = struct.Struct("!I")
+
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+# How many requests of one connection may be in flight at once
+# before we stop reading more of them.
+MAX_PIPELINED_REQUESTS = 64
+
+
+async def read_frame(reader: asyncio.StreamReader) -> bytes | None:
+    """Reads one length-prefixed frame, or returns None at a clean end of stream."""
+    try:
+        header = await reader.readexactly(_frame_header.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise
+        return None
+    (size,) = _frame_header.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise Exception(f"Frame too large: {size} bytes")
+    return await reader.readexactly(size)
+
+
+def write_frame(writer: asyncio.StreamWriter, payload: bytes) -> None:
+    writer.write(_frame_header.pack(len(payload)))
+    writer.write(payload)
+
+
+async def serve_connection(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    executor: Executor,
+    admission: AdmissionControl | None = None,
+    deadline_seconds: float | None = None,
+) -> None:
+    """Serves requests from one persistent connection until the client closes it.
+
+    Requests are handed to the executor as soon as they are read,
+    so pipelined requests are compiled concurrently,
+    but responses are always sent in request order.
+    Requests that the admission control rejects are answered right away."""
+    loop = asyncio.get_running_loop()
+    pending: asyncio.Queue[asyncio.Future[list[bytes]] | None] = asyncio.Queue(
+        MAX_PIPELINED_REQUESTS
+    )
+
+    async def respond(payload: bytes) -> list[bytes]:
+        deadline = (
+            time.monotonic() + deadline_seconds
+            if deadline_seconds is not None
+            else None
+        )
+        try:
+            with admission.request() if admission is not None else nullcontext():
+                return await respond_admitted(payload, deadline)
+        except OverloadedError as e:
+            # A framed JSON error is also a valid binary mode response.
+            return encode_response(overloaded_response(e), binary=False, framed=True)
+
+    async def respond_admitted(payload: bytes, deadline: float | None) -> list[bytes]:
+        # Requests are decoded here so that the programs of a batch
+        # can be spread over all workers.
+        try:
+            input = json.loads(payload.decode())
+        except Exception as e:
+            result = {"error": "".join(format_exception(e))}
+            return encode_response(result, binary=False, framed=True)
+        if isinstance(input, dict) and input.get("command") == "compile_batch":
+            return await respond_to_batch(input, deadline)
+        return await loop.run_in_executor(
+            executor, handle_decoded_request, input, True, deadline, True
+        )
+
+    async def respond_to_batch(
+        input: dict[str, Any], deadline: float | None
+    ) -> list[bytes]:
+        binary = input.get("binary", False) is True
+        include_stats = input.get("stats", False) is True
+        try:
+            programs = input["programs"]
+            if not isinstance(programs, list):
+                raise Exception("Expected a list of programs")
+            results = await asyncio.gather(
+                *(
+                    loop.run_in_executor(
+                        executor, compile_program, program, include_stats, deadline
+                    )
+                    for program in programs
+                )
+            )
+            result: dict[str, Any] = {"results": list(results)}
+        except Exception as e:
+            result = {"error": "".join(format_exception(e))}
+        return encode_response(result, binary, framed=True)
+
+    async def send_responses() -> None:
+        while (response := await pending.get()) is not None:
+            writer.writelines(await response)
+            await writer.drain()
+
+    sender = asyncio.create_task(send_responses())
+    try:
+        while (payload := await read_frame(reader)) is not None:
+            await pending.put(asyncio.ensure_future(respond(payload)))
+        await pending.put(None)
+        await sender
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    except Exception as e:
+        # The stream can't be resynchronized after a framing error,
+        # so report it and drop the connection.
+        write_frame(writer, str.encode(json.dumps({"error": str(e)})))
+    finally:
+        sender.cancel()
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+class _RecyclingExecutor(Executor):
+    """A process pool that is replaced by a fresh one after it has been
+    given `max_tasks` tasks, so every worker process handles about
+    `max_requests` requests before it exits."""
+
+    def __init__(
+        self,
+        workers: int,
+        max_requests: int,
+        context: BaseContext,
+        initializer: Callable[..., object],
+        initargs: tuple,
+    ) -> None:
+        self._workers = workers
+        self._max_tasks = workers * max_requests
+        self._context = context
+        self._initializer = initializer
+        self._initargs = initargs
+        self._submitted = 0
+        self._pool = self._new_pool()
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self._workers,
+            mp_context=self._context,
+            initializer=self._initializer,
+            initargs=self._initargs,
+        )
+
+    def submit(
+        self, fn: Callable[P, T], /, *args: P.args, **kwargs: P.kwargs
+    ) -> Future[T]:
+        if self._max_tasks != 0 and self._submitted >= self._max_tasks:
+            # Tasks already given to the old pool still complete.
+            self._pool.shutdown(wait=False)
+            self._pool = self._new_pool()
+            self._submitted = 0
+        self._submitted += 1
+        return self._pool.submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        self._pool.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+
+def run_async_server(
+    host: str,
+    port: int,
+    workers: int | None = None,
+    max_requests: int = 0,
+    request_queue_size: int = 32,
+    cache_entries: int = 1024,
+    cache_dir: str | None = None,
+    max_concurrency: int | None = None,
+    max_queue: int = 64,
+    deadline: float | None = 60,
+    options: CompileOptions = CompileOptions(),
+) -> None:
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # Worker processes are forked from a server process that has already
+    # imported the compiler, so they start without re-importing it.
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["compiler.server"])
+
+    if max_concurrency is None:
+        max_concurrency = workers
+    admission = AdmissionControl(max_concurrency, max_queue, context)
+
+    async def serve() -> None:
+        with _RecyclingExecutor(
+            workers,
+            max_requests,
+            context,
+            initializer=configure_worker,
+            initargs=(
+                cache_entries,
+                cache_dir,
+                StatsAggregator(context),
+                admission,
+                deadline,
+                options,
+            ),
+        ) as executor:
+            server = await asyncio.start_server(
+                lambda reader, writer: serve_connection(
+                    reader, writer, executor, admission, deadline
+                ),
+                host,
+                port,
+                backlog=request_queue_size,
+                reuse_address=True,
+            )
+            async with server:
+                serving = asyncio.create_task(server.serve_forever())
+                asyncio.get_running_loop().add_signal_handler(
+                    signal.SIGTERM, serving.cancel
+                )
+                try:
+                    await serving
+                except asyncio.CancelledError:
+                    pass
+
+    print(f"Starting asyncio TCP server at {host}:{port} with {workers} workers")
+    asyncio.run(serve())
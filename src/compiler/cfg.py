@@ -0,0 +1,284 @@
+from dataclasses import dataclass, field
+from compiler import ir
+
+
+@dataclass
+class BasicBlock:
+    """A sequence of instructions that always run from the first one
+    to the last one. Only the first one may be a label and only the last
+    one may be a jump or a return."""
+
+    index: int
+    # The index of the first instruction in the function.
+    start: int
+    instructions: list[ir.Instruction]
+    preds: list[int] = field(default_factory=list)
+    succs: list[int] = field(default_factory=list)
+
+    @property
+    def label(self) -> str | None:
+        first = self.instructions[0] if self.instructions else None
+        return first.name if isinstance(first, ir.Label) else None
+
+
+@dataclass
+class Loop:
+    """A natural loop: the blocks that can reach one of the header's
+    predecessors without going through the header, which dominates them."""
+
+    header: int
+    blocks: set[int]
+    parent: "Loop | None" = None
+    # 1 for outermost loops.
+    depth: int = 1
+
+
+@dataclass
+class ControlFlowGraph:
+    """The basic blocks of a function. Block 0 is the entry."""
+
+    blocks: list[BasicBlock]
+    # The reachable blocks, each before its successors except along back edges.
+    reverse_postorder: list[int]
+    # The immediate dominator of each reachable block, None for the entry
+    # and for unreachable blocks.
+    idom: list[int | None]
+    dom_children: list[list[int]]
+    # Inner loops come before the loops containing them.
+    loops: list[Loop]
+    # The innermost loop of each block.
+    block_loops: list[Loop | None]
+    _dom_pre: list[int] = field(repr=False)
+    _dom_post: list[int] = field(repr=False)
+
+    def is_reachable(self, block: int) -> bool:
+        return self._dom_pre[block] != -1
+
+    def dominates(self, a: int, b: int) -> bool:
+        """Tells whether every path from the entry to block `b` goes through
+        block `a`. Every block dominates itself."""
+        if not self.is_reachable(a) or not self.is_reachable(b):
+            return False
+        return (
+            self._dom_pre[a] <= self._dom_pre[b]
+            and self._dom_post[b] <= self._dom_post[a]
+        )
+
+    def loop_depth(self, block: int) -> int:
+        loop = self.block_loops[block]
+        return loop.depth if loop is not None else 0
+
+
+def control_flow_graph(function: ir.Function) -> ControlFlowGraph:
+    """Returns the control-flow graph of a function, which is built only once
+    as long as the function's instructions stay the same."""
+    cached = function.cfg_cache
+    if cached is not None:
+        instructions, graph = cached
+        if len(instructions) == len(function.instructions) and all(
+            a is b for a, b in zip(instructions, function.instructions)
+        ):
+            return graph
+    graph = build_control_flow_graph(function.instructions)
+    function.cfg_cache = (list(function.instructions), graph)
+    return graph
+
+
+def build_control_flow_graph(instructions: list[ir.Instruction]) -> ControlFlowGraph:
+    blocks = _basic_blocks(instructions)
+    succs = [block.succs for block in blocks]
+    preds = [block.preds for block in blocks]
+    preorder, postorder, parent = _depth_first_search(succs)
+    idom = _immediate_dominators(preds, preorder, parent)
+
+    dom_children: list[list[int]] = [[] for _ in blocks]
+    for b in preorder[1:]:
+        dom = idom[b]
+        assert dom is not None
+        dom_children[dom].append(b)
+    dom_pre, dom_post = _tree_numbering(dom_children, len(blocks))
+
+    graph = ControlFlowGraph(
+        blocks=blocks,
+        reverse_postorder=postorder[::-1],
+        idom=idom,
+        dom_children=dom_children,
+        loops=[],
+        block_loops=[None for _ in blocks],
+        _dom_pre=dom_pre,
+        _dom_post=dom_post,
+    )
+    _find_loops(graph, preorder)
+    return graph
+
+
+def _basic_blocks(instructions: list[ir.Instruction]) -> list[BasicBlock]:
+    """Splits instructions into blocks and connects them."""
+    blocks: list[BasicBlock] = []
+    current: list[ir.Instruction] = []
+    start = 0
+    for i, insn in enumerate(instructions):
+        if isinstance(insn, ir.Label) and current:
+            blocks.append(BasicBlock(len(blocks), start, current))
+            current, start = [], i
+        current.append(insn)
+        if isinstance(insn, (ir.Jump, ir.CondJump, ir.Return)):
+            blocks.append(BasicBlock(len(blocks), start, current))
+            current, start = [], i + 1
+    if current or not blocks:
+        blocks.append(BasicBlock(len(blocks), start, current))
+
+    labels = {block.label: block.index for block in blocks if block.label is not None}
+    for block in blocks:
+        last = block.instructions[-1] if block.instructions else None
+        match last:
+            case ir.Jump():
+                targets = [labels[last.label.name]]
+            case ir.CondJump():
+                targets = [labels[last.then_label.name], labels[last.else_label.name]]
+            case ir.Return():
+                targets = []
+            case _:
+                targets = [block.index + 1] if block.index + 1 < len(blocks) else []
+        for target in targets:
+            if target not in block.succs:
+                block.succs.append(target)
+                blocks[target].preds.append(block.index)
+    return blocks
+
+
+def _depth_first_search(
+    succs: list[list[int]],
+) -> tuple[list[int], list[int], list[int]]:
+    """Returns the blocks reachable from the entry in preorder and postorder,
+    and the parent of each in the search tree (-1 for the rest).
+
+    Successors are explored last to first, so that in reverse postorder
+    the body of a loop comes right after its header rather than after
+    everything following the loop."""
+    parent = [-1] * len(succs)
+    visited = [False] * len(succs)
+    preorder, postorder = [0], []
+    visited[0] = True
+    stack = [(0, reversed(succs[0]))]
+    while stack:
+        v, it = stack[-1]
+        for w in it:
+            if not visited[w]:
+                visited[w] = True
+                parent[w] = v
+                preorder.append(w)
+                stack.append((w, reversed(succs[w])))
+                break
+        else:
+            stack.pop()
+            postorder.append(v)
+    return preorder, postorder, parent
+
+
+def _immediate_dominators(
+    preds: list[list[int]], preorder: list[int], parent: list[int]
+) -> list[int | None]:
+    """The Lengauer-Tarjan algorithm with path compression, which takes
+    O(E log V) time."""
+    n = len(preds)
+    number = [-1] * n
+    for i, v in enumerate(preorder):
+        number[v] = i
+    # Semidominators as preorder numbers.
+    semi = number.copy()
+    ancestor = [-1] * n
+    # The vertex with the smallest semidominator on the compressed path.
+    best = list(range(n))
+    bucket: list[list[int]] = [[] for _ in range(n)]
+    idom: list[int | None] = [None] * n
+
+    def evaluate(v: int) -> int:
+        if ancestor[v] == -1:
+            return v
+        path = []
+        u = v
+        while ancestor[ancestor[u]] != -1:
+            path.append(u)
+            u = ancestor[u]
+        for u in reversed(path):
+            a = ancestor[u]
+            if semi[best[a]] < semi[best[u]]:
+                best[u] = best[a]
+            ancestor[u] = ancestor[a]
+        return best[v]
+
+    for w in reversed(preorder[1:]):
+        for v in preds[w]:
+            if number[v] != -1:
+                semi[w] = min(semi[w], semi[evaluate(v)])
+        bucket[preorder[semi[w]]].append(w)
+        p = parent[w]
+        ancestor[w] = p
+        for v in bucket[p]:
+            u = evaluate(v)
+            idom[v] = u if semi[u] < semi[v] else p
+        bucket[p].clear()
+
+    for w in preorder[1:]:
+        if idom[w] != preorder[semi[w]]:
+            dom = idom[w]
+            assert dom is not None
+            idom[w] = idom[dom]
+    return idom
+
+
+def _tree_numbering(children: list[list[int]], n: int) -> tuple[list[int], list[int]]:
+    """Numbers the dominator tree in preorder and postorder,
+    so that ancestors can be recognized in constant time."""
+    pre, post = [-1] * n, [-1] * n
+    counter = 0
+    stack = [(0, False)]
+    while stack:
+        v, done = stack.pop()
+        if done:
+            post[v] = counter
+        else:
+            pre[v] = counter
+            stack.append((v, True))
+            stack.extend((c, False) for c in reversed(children[v]))
+        counter += 1
+    return pre, post
+
+
+def _find_loops(graph: ControlFlowGraph, preorder: list[int]) -> None:
+    """Finds the natural loops. Headers are visited in reverse preorder, so
+    inner loops are found first and the walk back from an outer loop's back
+    edges can skip over them. Loops that aren't natural, whose entries don't
+    dominate the rest of the loop, are ignored."""
+    blocks = graph.blocks
+    for header in reversed(preorder):
+        back_edges = [b for b in blocks[header].preds if graph.dominates(header, b)]
+        if not back_edges:
+            continue
+        loop = Loop(header, {header})
+        graph.block_loops[header] = loop
+        work = [b for b in back_edges if b != header]
+        while work:
+            b = work.pop()
+            inner = graph.block_loops[b]
+            if inner is None:
+                graph.block_loops[b] = loop
+                loop.blocks.add(b)
+                work.extend(p for p in blocks[b].preds if graph.is_reachable(p))
+                continue
+            while inner.parent is not None:
+                inner = inner.parent
+            if inner is not loop:
+                inner.parent = loop
+                loop.blocks |= inner.blocks
+                work.extend(
+                    p
+                    for p in blocks[inner.header].preds
+                    if p not in inner.blocks and graph.is_reachable(p)
+                )
+        graph.loops.append(loop)
+
+    for loop in reversed(graph.loops):
+        if loop.parent is not None:
+            loop.depth = loop.parent.depth + 1
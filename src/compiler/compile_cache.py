@@ -0,0 +1,80 @@
+import hashlib
+import json
+import os
+import tempfile
+from collections import OrderedDict
+from functools import cache
+from pathlib import Path
+from typing import Any
+
+
+@cache
+def compiler_fingerprint() -> str:
+    """Returns a hash of the compiler's own source code,
+    so that cached results are not reused across compiler changes."""
+    h = hashlib.sha256()
+    for file in sorted(Path(__file__).parent.glob("*.py")):
+        h.update(file.name.encode())
+        h.update(file.read_bytes())
+    return h.hexdigest()
+
+
+def cache_key(source_code: str, options: dict[str, Any]) -> str:
+    h = hashlib.sha256()
+    h.update(compiler_fingerprint().encode())
+    h.update(json.dumps(options, sort_keys=True).encode())
+    h.update(source_code.encode())
+    return h.hexdigest()
+
+
+class CompileCache:
+    """Maps cache keys to compiled executables.
+
+    Recently used executables are kept in memory, up to `max_entries`.
+    If a directory is given, executables are also stored there,
+    so that all processes using the same directory share them.
+    """
+
+    _entries: OrderedDict[str, bytes]
+
+    def __init__(self, max_entries: int = 1024, directory: str | None = None) -> None:
+        self.max_entries = max_entries
+        self.directory = Path(directory) if directory is not None else None
+        self._entries = OrderedDict()
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    def get(self, key: str) -> bytes | None:
+        executable = self._entries.get(key)
+        if executable is not None:
+            self._entries.move_to_end(key)
+            return executable
+        if self.directory is not None:
+            try:
+                executable = (self.directory / key).read_bytes()
+            except FileNotFoundError:
+                return None
+            self._remember(key, executable)
+        return executable
+
+    def put(self, key: str, executable: bytes) -> None:
+        self._remember(key, executable)
+        if self.directory is not None:
+            # Write to a temporary file and rename it into place so that
+            # other processes never see a partially written executable.
+            fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(executable)
+                os.replace(tmp, self.directory / key)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+
+    def _remember(self, key: str, executable: bytes) -> None:
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = executable
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -0,0 +1,151 @@
+import multiprocessing
+import resource
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from multiprocessing.context import BaseContext
+from typing import Any, Iterator
+
+# Stages whose times are aggregated by `StatsAggregator`.
+# "total" is the whole compile request, including the cache lookup.
+STAGES = [
+    "tokenize",
+    "parse",
+    "typecheck",
+    "generate_ir",
+    "constant_propagation",
+    "dead_code_elimination",
+    "generate_assembly",
+    "peephole",
+    "native_assemble",
+    "as",
+    "ld",
+    "total",
+]
+
+# Upper bounds in seconds of the wall time histogram buckets.
+# The last bucket counts everything slower than the last bound.
+HISTOGRAM_BOUNDS = [0.0001 * 2**i for i in range(16)]
+
+
+def _cpu_time() -> float:
+    """CPU time used by this process and its finished child processes."""
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+@dataclass
+class StageTime:
+    wall: float = 0.0
+    cpu: float = 0.0
+
+
+class CompileStats:
+    """Collects the time spent in each stage of one compilation,
+    the sizes of its intermediate results and how often each
+    optimization was applied."""
+
+    stages: dict[str, StageTime]
+    sizes: dict[str, int]
+    # Times each peephole rule was applied, by rule name.
+    peephole_hits: dict[str, int]
+    # IR instructions removed by dead code elimination, by function name.
+    dead_code_removed: dict[str, int]
+    cache: str | None
+
+    def __init__(self) -> None:
+        self.stages = {}
+        self.sizes = {}
+        self.peephole_hits = {}
+        self.dead_code_removed = {}
+        self.cache = None
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Adds the time spent in the `with` block to the given stage."""
+        wall = time.perf_counter()
+        cpu = _cpu_time()
+        try:
+            yield
+        finally:
+            t = self.stages.setdefault(name, StageTime())
+            t.wall += time.perf_counter() - wall
+            t.cpu += _cpu_time() - cpu
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "stages": {
+                name: {"wall": t.wall, "cpu": t.cpu} for name, t in self.stages.items()
+            },
+            "sizes": dict(self.sizes),
+            "peephole_hits": dict(self.peephole_hits),
+            "dead_code_removed": dict(self.dead_code_removed),
+            "cache": self.cache,
+        }
+
+
+_COUNTERS = ["requests", "errors", "cache_hits", "cache_misses"]
+
+# Per stage: count, total wall time, total CPU time and the histogram buckets.
+_STAGE_FIELDS = 3 + len(HISTOGRAM_BOUNDS) + 1
+
+
+class StatsAggregator:
+    """Totals and wall time histograms of all compilations since startup.
+
+    The numbers are kept in shared memory, so every worker process
+    forked from the process that created the aggregator (or given it
+    when started) adds to the same numbers.
+    """
+
+    def __init__(self, context: BaseContext | None = None) -> None:
+        if context is None:
+            context = multiprocessing.get_context()
+        self._values = context.Array("d", len(_COUNTERS) + len(STAGES) * _STAGE_FIELDS)
+
+    def record(self, stats: CompileStats, error: bool) -> None:
+        with self._values.get_lock():
+            values = self._values
+            values[0] += 1
+            if error:
+                values[1] += 1
+            if stats.cache == "hit":
+                values[2] += 1
+            elif stats.cache == "miss":
+                values[3] += 1
+            for i, name in enumerate(STAGES):
+                t = stats.stages.get(name)
+                if t is None:
+                    continue
+                base = len(_COUNTERS) + i * _STAGE_FIELDS
+                values[base] += 1
+                values[base + 1] += t.wall
+                values[base + 2] += t.cpu
+                bucket = 0
+                while (
+                    bucket < len(HISTOGRAM_BOUNDS) and t.wall > HISTOGRAM_BOUNDS[bucket]
+                ):
+                    bucket += 1
+                values[base + 3 + bucket] += 1
+
+    def to_json(self) -> dict[str, Any]:
+        with self._values.get_lock():
+            values = self._values[:]
+        result: dict[str, Any] = {
+            name: int(values[i]) for i, name in enumerate(_COUNTERS)
+        }
+        stages: dict[str, Any] = {}
+        for i, name in enumerate(STAGES):
+            base = len(_COUNTERS) + i * _STAGE_FIELDS
+            buckets = values[base + 3 : base + _STAGE_FIELDS]
+            stages[name] = {
+                "count": int(values[base]),
+                "wall_total": values[base + 1],
+                "cpu_total": values[base + 2],
+                "wall_histogram": [
+                    {"le": bound, "count": int(count)}
+                    for bound, count in zip([*HISTOGRAM_BOUNDS, None], buckets)
+                ],
+            }
+        result["stages"] = stages
+        return result
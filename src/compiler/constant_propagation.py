@@ -0,0 +1,209 @@
+from dataclasses import replace
+from typing import Callable
+from compiler import ir
+from compiler.cfg import control_flow_graph
+from compiler.dataflow import defs, uses
+from compiler.tokenizer import Location, L
+
+Value = int | bool
+
+int_min = -(2**63)
+
+
+def wrap(n: int) -> int:
+    """Wraps an integer around to 64 bits like the machine does."""
+    n &= 2**64 - 1
+    return n - 2**64 if n >= 2**63 else n
+
+
+def _divide(a: int, b: int) -> int | None:
+    # Division by zero and int_min / -1 trap at runtime, so they mustn't
+    # be folded away.
+    if b == 0 or (a == int_min and b == -1):
+        return None
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+def _remainder(a: int, b: int) -> int | None:
+    q = _divide(a, b)
+    return None if q is None else a - q * b
+
+
+# How to evaluate intrinsics on constants. None means the result
+# can only be found by running the instruction.
+foldable_intrinsics: dict[str, Callable[..., Value | None]] = {
+    "unary_-": lambda a: wrap(-a),
+    "unary_not": lambda a: not a,
+    "+": lambda a, b: wrap(a + b),
+    "-": lambda a, b: wrap(a - b),
+    "*": lambda a, b: wrap(a * b),
+    "/": _divide,
+    "%": _remainder,
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+}
+
+
+class _Overdefined:
+    """The lattice value of variables that aren't constant."""
+
+
+overdefined = _Overdefined()
+# Variables not in the lattice yet may still turn out to be constant.
+Lattice = Value | _Overdefined
+
+
+def _same(a: Lattice | None, b: Lattice | None) -> bool:
+    # True == 1 in Python, but not here.
+    return a is b or (type(a) is type(b) and a == b)
+
+
+def propagate_constants(function: ir.Function) -> ir.Function:
+    """Sparse conditional constant propagation on a function in SSA form.
+
+    Finds the variables that have the same value whenever they're
+    assigned, assuming that only branches that can be taken are, and
+    replaces their assignments with constant loads. Branches on constants
+    become jumps and blocks that can't be reached are removed.
+
+    Values wrap around to 64 bits and division truncates like in the
+    generated code. Divisions that would trap at runtime aren't folded."""
+    graph = control_flow_graph(function)
+    blocks = graph.blocks
+    block_of = {b.label: b.index for b in blocks if b.label is not None}
+
+    values: dict[ir.IRVar, Lattice] = {p: overdefined for p in function.params}
+    users: dict[ir.IRVar, list[tuple[int, ir.Instruction]]] = {}
+    assigned = {v for insn in function.instructions for v in defs(insn)}
+    for block in blocks:
+        for insn in block.instructions:
+            for v in uses(insn):
+                users.setdefault(v, []).append((block.index, insn))
+                if v not in assigned:
+                    # Unit values, which are never assigned.
+                    values.setdefault(v, overdefined)
+
+    reachable_blocks: set[int] = set()
+    reachable_edges: set[tuple[int, int]] = set()
+    edge_work: list[tuple[int, int]] = [(-1, 0)]
+    var_work: list[ir.IRVar] = []
+
+    def evaluate(b: int, insn: ir.Instruction) -> Lattice | None:
+        match insn:
+            case ir.LoadIntConst() | ir.LoadBoolConst():
+                return insn.value
+            case ir.Copy():
+                return values.get(insn.src)
+            case ir.Call():
+                fold = foldable_intrinsics.get(insn.fun.name)
+                if fold is None:
+                    return overdefined
+                args = [values.get(arg) for arg in insn.args]
+                if any(arg is overdefined for arg in args):
+                    return overdefined
+                if any(arg is None for arg in args):
+                    return None
+                result = fold(*args)
+                return overdefined if result is None else result
+            case ir.Phi():
+                # The meet of the values coming along edges that are taken.
+                meet: Lattice | None = None
+                for label, arg in zip(insn.labels, insn.args):
+                    if (block_of[label.name], b) not in reachable_edges:
+                        continue
+                    incoming = values.get(arg)
+                    if incoming is None or _same(meet, incoming):
+                        continue
+                    if meet is not None:
+                        return overdefined
+                    meet = incoming
+                return meet
+        return overdefined
+
+    def visit(b: int, insn: ir.Instruction) -> None:
+        if isinstance(insn, ir.CondJump):
+            cond = values.get(insn.cond)
+            if cond is None:
+                return
+            for label, taken in ((insn.then_label, True), (insn.else_label, False)):
+                if cond is overdefined or cond == taken:
+                    edge_work.append((b, block_of[label.name]))
+            return
+        for v in defs(insn):
+            value = evaluate(b, insn)
+            if value is not None and not _same(values.get(v), value):
+                values[v] = value
+                var_work.append(v)
+
+    while edge_work or var_work:
+        while edge_work:
+            edge = edge_work.pop()
+            if edge in reachable_edges:
+                continue
+            reachable_edges.add(edge)
+            b = edge[1]
+            block = blocks[b]
+            if b in reachable_blocks:
+                # Only the phis depend on which edges are taken.
+                for insn in block.instructions:
+                    if isinstance(insn, ir.Phi):
+                        visit(b, insn)
+                continue
+            reachable_blocks.add(b)
+            for insn in block.instructions:
+                visit(b, insn)
+            if not isinstance(block.instructions[-1], ir.CondJump):
+                edge_work.extend((b, s) for s in block.succs)
+        while var_work and not edge_work:
+            v = var_work.pop()
+            for b, insn in users.get(v, []):
+                if b in reachable_blocks:
+                    visit(b, insn)
+
+    new_instructions: list[ir.Instruction] = []
+    for block in blocks:
+        if block.index not in reachable_blocks:
+            continue
+        phis: list[ir.Instruction] = []
+        code: list[ir.Instruction] = []
+        for insn in block.instructions:
+            value = values.get(defs(insn)[0]) if defs(insn) else None
+            if isinstance(value, (int, bool)):
+                if not isinstance(insn, (ir.LoadIntConst, ir.LoadBoolConst)):
+                    insn = _load(insn.location, value, defs(insn)[0])
+                code.append(insn)
+            elif isinstance(insn, ir.Phi):
+                args = [
+                    (label, arg)
+                    for label, arg in zip(insn.labels, insn.args)
+                    if (block_of[label.name], block.index) in reachable_edges
+                ]
+                labels = [label for label, _ in args]
+                phis.append(
+                    ir.Phi(insn.location, labels, [a for _, a in args], insn.dest)
+                )
+            elif isinstance(insn, ir.CondJump):
+                cond = values.get(insn.cond)
+                if cond is overdefined:
+                    code.append(insn)
+                else:
+                    label = insn.then_label if cond else insn.else_label
+                    code.append(ir.Jump(insn.location, label))
+            else:
+                code.append(insn)
+        # Phis stay at the start of the block, after its label.
+        new_instructions.extend(code[:1] + phis + code[1:])
+    return replace(function, instructions=new_instructions, cfg_cache=None)
+
+
+def _load(
+    location: Location | L | None, value: Value, dest: ir.IRVar
+) -> ir.Instruction:
+    if isinstance(value, bool):
+        return ir.LoadBoolConst(location, value, dest)
+    return ir.LoadIntConst(location, value, dest)
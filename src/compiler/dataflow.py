@@ -0,0 +1,266 @@
+import heapq
+from dataclasses import dataclass
+from typing import Generic, Hashable, Iterable, Iterator, TypeVar
+from compiler import ir
+from compiler.cfg import ControlFlowGraph, build_control_flow_graph
+from compiler.intrinsics import all_intrinsics
+
+T = TypeVar("T", bound=Hashable)
+
+# An intrinsic applied to some variables, like ("+", (x, y)).
+Expression = tuple[str, tuple[ir.IRVar, ...]]
+# A definition is the index of the instruction that makes it,
+# or None for the incoming value of a parameter.
+Definition = tuple[int | None, ir.IRVar]
+
+
+def uses(insn: ir.Instruction) -> list[ir.IRVar]:
+    match insn:
+        case ir.Call() | ir.Phi():
+            return insn.args
+        case ir.Copy():
+            return [insn.src]
+        case ir.CondJump():
+            return [insn.cond]
+        case ir.Return():
+            return [insn.value]
+    return []
+
+
+def defs(insn: ir.Instruction) -> list[ir.IRVar]:
+    match insn:
+        case ir.Call() | ir.Copy() | ir.LoadIntConst() | ir.LoadBoolConst() | ir.Phi():
+            return [insn.dest]
+    return []
+
+
+@dataclass
+class Problem(Generic[T]):
+    """A dataflow problem whose facts are sets of elements of `universe`,
+    represented as ints with bit `i` set when `universe[i]` is in the set.
+
+    Each instruction maps the facts `x` on one side of it to
+    `gen | (x & ~kill)` on the other side."""
+
+    universe: list[T]
+    # Whether facts flow from the entry towards the exits or the other way.
+    forward: bool
+    # Whether the facts where paths join are the union of the facts
+    # along each path, or the intersection.
+    union: bool
+    # The facts at the entry, or at the exits when going backward.
+    boundary: int
+    # The gen and kill sets of each instruction.
+    transfer: list[tuple[int, int]]
+
+
+@dataclass
+class Solution(Generic[T]):
+    """The facts at the start and the end of each basic block."""
+
+    problem: Problem[T]
+    graph: ControlFlowGraph
+    block_in: list[int]
+    block_out: list[int]
+
+    def members(self, bits: int) -> set[T]:
+        result = set()
+        while bits:
+            low = bits & -bits
+            result.add(self.problem.universe[low.bit_length() - 1])
+            bits ^= low
+        return result
+
+    def instruction_facts(self) -> tuple[list[int], list[int]]:
+        """Returns the facts before and after each instruction."""
+        before = [0] * len(self.problem.transfer)
+        after = [0] * len(self.problem.transfer)
+        for i, facts_before, facts_after in self.each_instruction():
+            before[i], after[i] = facts_before, facts_after
+        return before, after
+
+    def instruction_sets(self) -> tuple[list[set[T]], list[set[T]]]:
+        """Like `instruction_facts`, but as sets, which take much less memory
+        when each holds few elements of a large universe."""
+        before: list[set[T]] = [set() for _ in self.problem.transfer]
+        after: list[set[T]] = [set() for _ in self.problem.transfer]
+        for i, facts_before, facts_after in self.each_instruction():
+            before[i] = self.members(facts_before)
+            after[i] = self.members(facts_after)
+        return before, after
+
+    def each_instruction(self) -> Iterator[tuple[int, int, int]]:
+        """Yields the index of each instruction with the facts before and
+        after it, without keeping them all in memory."""
+        transfer = self.problem.transfer
+        for block in self.graph.blocks:
+            indices = range(block.start, block.start + len(block.instructions))
+            if self.problem.forward:
+                facts = self.block_in[block.index]
+                for i in indices:
+                    gen, kill = transfer[i]
+                    new = gen | (facts & ~kill)
+                    yield i, facts, new
+                    facts = new
+            else:
+                facts = self.block_out[block.index]
+                for i in reversed(indices):
+                    gen, kill = transfer[i]
+                    new = gen | (facts & ~kill)
+                    yield i, new, facts
+                    facts = new
+
+
+def solve(graph: ControlFlowGraph, problem: Problem[T]) -> Solution[T]:
+    """Finds the facts at each block boundary with a worklist algorithm,
+    which revisits only the blocks whose neighbors' facts changed.
+    The worklist is ordered so that the facts of a loop settle before
+    they flow to the code after it."""
+    blocks = graph.blocks
+    everything = (1 << len(problem.universe)) - 1
+    initial = 0 if problem.union else everything
+
+    # Combine the transfers of each block's instructions into one.
+    block_gen, block_kill = [0] * len(blocks), [0] * len(blocks)
+    for block in blocks:
+        gen, kill = 0, 0
+        indices = range(block.start, block.start + len(block.instructions))
+        for i in indices if problem.forward else reversed(indices):
+            g, k = problem.transfer[i]
+            gen = g | (gen & ~k)
+            kill |= k
+        block_gen[block.index], block_kill[block.index] = gen, kill
+
+    # Visiting blocks in this order lets most facts settle in one pass.
+    reachable = set(graph.reverse_postorder)
+    order = graph.reverse_postorder + [
+        b for b in range(len(blocks)) if b not in reachable
+    ]
+    if not problem.forward:
+        order.reverse()
+
+    block_in = [initial] * len(blocks)
+    block_out = [initial] * len(blocks)
+    # Where facts come from and where they're computed.
+    sources, results = (
+        (block_out, block_in) if problem.forward else (block_in, block_out)
+    )
+    if problem.forward:
+        # Code that never runs can't affect the facts of code that does.
+        neighbors_of = [
+            (
+                [p for p in block.preds if p in reachable]
+                if block.index in reachable
+                else block.preds
+            )
+            for block in blocks
+        ]
+    else:
+        neighbors_of = [block.succs for block in blocks]
+    position = [0] * len(blocks)
+    for i, b in enumerate(order):
+        position[b] = i
+    worklist = list(range(len(order)))
+    queued = [True] * len(blocks)
+    while worklist:
+        b = order[heapq.heappop(worklist)]
+        queued[b] = False
+        block = blocks[b]
+        neighbors = neighbors_of[b]
+        dependents = block.succs if problem.forward else block.preds
+        is_boundary = b == 0 if problem.forward else not block.succs
+        facts = problem.boundary if is_boundary else initial
+        for n in neighbors:
+            facts = facts | sources[n] if problem.union else facts & sources[n]
+        results[b] = facts
+        new = block_gen[b] | (facts & ~block_kill[b])
+        if new != sources[b]:
+            sources[b] = new
+            for d in dependents:
+                if not queued[d]:
+                    queued[d] = True
+                    heapq.heappush(worklist, position[d])
+    return Solution(problem, graph, block_in, block_out)
+
+
+def live_variables(
+    instructions: list[ir.Instruction],
+    graph: ControlFlowGraph | None = None,
+    tracked: Iterable[ir.IRVar] | None = None,
+) -> Solution[ir.IRVar]:
+    """The variables whose current values may still be read.
+    If `tracked` is given, other variables are left out."""
+    variables: dict[ir.IRVar, int] = {}
+    if tracked is not None:
+        for v in tracked:
+            variables.setdefault(v, len(variables))
+    else:
+        for insn in instructions:
+            for v in uses(insn) + defs(insn):
+                variables.setdefault(v, len(variables))
+    transfer = [
+        (
+            _bits(variables[v] for v in uses(insn) if v in variables),
+            _bits(variables[v] for v in defs(insn) if v in variables),
+        )
+        for insn in instructions
+    ]
+    problem = Problem(list(variables), False, True, 0, transfer)
+    return solve(graph or build_control_flow_graph(instructions), problem)
+
+
+def reaching_definitions(
+    instructions: list[ir.Instruction],
+    params: list[ir.IRVar],
+    graph: ControlFlowGraph | None = None,
+) -> Solution[Definition]:
+    """The definitions whose values variables may still have."""
+    definitions: list[Definition] = [(None, p) for p in params]
+    for i, insn in enumerate(instructions):
+        definitions.extend((i, v) for v in defs(insn))
+    definitions_of: dict[ir.IRVar, int] = {}
+    for d, (_, v) in enumerate(definitions):
+        definitions_of[v] = definitions_of.get(v, 0) | 1 << d
+
+    transfer = [(0, 0)] * len(instructions)
+    for d, (site, v) in enumerate(definitions):
+        if site is not None:
+            transfer[site] = (1 << d, definitions_of[v])
+    problem = Problem(definitions, True, True, (1 << len(params)) - 1, transfer)
+    return solve(graph or build_control_flow_graph(instructions), problem)
+
+
+def available_expressions(
+    instructions: list[ir.Instruction], graph: ControlFlowGraph | None = None
+) -> Solution[Expression]:
+    """The expressions computed on every path to a point, with none of
+    their operands assigned to since."""
+    expressions: dict[Expression, int] = {}
+    for insn in instructions:
+        if isinstance(insn, ir.Call) and insn.fun.name in all_intrinsics:
+            expressions.setdefault((insn.fun.name, tuple(insn.args)), len(expressions))
+    using: dict[ir.IRVar, int] = {}
+    for (_, args), e in expressions.items():
+        for v in args:
+            using[v] = using.get(v, 0) | 1 << e
+
+    transfer = []
+    for insn in instructions:
+        kill = _union(using.get(v, 0) for v in defs(insn))
+        gen = 0
+        if isinstance(insn, ir.Call) and insn.fun.name in all_intrinsics:
+            gen = 1 << expressions[(insn.fun.name, tuple(insn.args))] & ~kill
+        transfer.append((gen, kill))
+    problem = Problem(list(expressions), True, False, 0, transfer)
+    return solve(graph or build_control_flow_graph(instructions), problem)
+
+
+def _bits(indices: Iterable[int]) -> int:
+    return _union(1 << i for i in indices)
+
+
+def _union(sets: Iterable[int]) -> int:
+    result = 0
+    for s in sets:
+        result |= s
+    return result
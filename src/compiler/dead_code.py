@@ -0,0 +1,76 @@
+from dataclasses import replace
+from compiler import ir
+from compiler.cfg import build_control_flow_graph
+from compiler.dataflow import defs, live_variables, uses
+from compiler.intrinsics import all_intrinsics
+
+# Division and remainder trap when dividing by zero, which has to happen
+# even if the result isn't used.
+trapping_intrinsics = {"/", "%"}
+
+
+def eliminate_dead_code(
+    function: ir.Function, removed: dict[str, int] | None = None
+) -> ir.Function:
+    """Removes the instructions that can't affect what a function does:
+    code that can't be reached, labels that nothing jumps to, copies of
+    a variable to itself, and assignments to variables that aren't read
+    afterwards unless the value comes from a call that has other effects.
+
+    If `removed` is given, the number of instructions removed is added
+    to it under the function's name."""
+    instructions = function.instructions
+    while True:
+        graph = build_control_flow_graph(instructions)
+        # Only assignments can be dead, and variables that are read without
+        # being assigned, like Unit values, would be live almost everywhere.
+        assigned = dict.fromkeys(v for insn in instructions for v in defs(insn))
+        liveness = live_variables(instructions, graph, tracked=assigned)
+        targets = {label.name for insn in instructions for label in _targets(insn)}
+        kept: list[ir.Instruction] = []
+        for block in graph.blocks:
+            if not graph.is_reachable(block.index):
+                continue
+            live = liveness.members(liveness.block_out[block.index])
+            code: list[ir.Instruction] = []
+            for insn in reversed(block.instructions):
+                if isinstance(insn, ir.Label):
+                    # Tail calls jump to the start of the function.
+                    if insn.name not in targets and block.start > 0:
+                        continue
+                elif _is_dead(insn, live):
+                    continue
+                live.difference_update(defs(insn))
+                live.update(uses(insn))
+                code.append(insn)
+            kept.extend(reversed(code))
+        # Removing an assignment can make the ones it read from dead,
+        # and removing a jump can make code unreachable.
+        if len(kept) == len(instructions):
+            break
+        instructions = kept
+    if removed is not None:
+        count = len(function.instructions) - len(instructions)
+        removed[function.name] = removed.get(function.name, 0) + count
+    return replace(function, instructions=instructions, cfg_cache=None)
+
+
+def _is_dead(insn: ir.Instruction, live: set[ir.IRVar]) -> bool:
+    match insn:
+        case ir.Copy() if insn.src == insn.dest:
+            return True
+        case ir.Call():
+            if insn.fun.name not in all_intrinsics:
+                return False
+            if insn.fun.name in trapping_intrinsics:
+                return False
+    return bool(defs(insn)) and not any(v in live for v in defs(insn))
+
+
+def _targets(insn: ir.Instruction) -> list[ir.Label]:
+    match insn:
+        case ir.Jump():
+            return [insn.label]
+        case ir.CondJump():
+            return [insn.then_label, insn.else_label]
+    return []
@@ -19,6 +19,16 @@ class ReturnException(Exception):
         self.value = value
 
 
+class TailCallException(Exception):
+    """Raised by `return f(...)` to make the caller of the returning
+    function call `f` instead, so that the Python stack doesn't grow."""
+
+    def __init__(self, function: ast.FunDef, args: list[Value], scope: SymTab) -> None:
+        self.function = function
+        self.arguments = args
+        self.scope = scope
+
+
 def top_level_symtab() -> SymTab:
     return SymTab(
         locals={
@@ -126,22 +136,9 @@ def interpret(node: ast.Module | ast.Expression, tbl: SymTab | None = None) -> V
                 case "read_int":
                     return int(input())
                 case _:
-                    current_scop: SymTab | None = table
-                    while current_scop:
-                        if node.name in current_scop.locals:
-                            function = current_scop.locals[node.name]
-                            new_table = SymTab(locals={}, parent=current_scop)
-                            for arg, param in zip(node.arguments, function.params):
-                                new_table.locals[param.name] = interpret(
-                                    node=arg, tbl=table
-                                )
-                            try:
-                                interpret(node=function.body, tbl=new_table)
-                                return None
-                            except ReturnException as e:
-                                return e.value
-                        current_scop = current_scop.parent
-                    raise Exception(f"Unknown function: {node.name}")
+                    function, scope = find_function(node.name, table)
+                    args = [interpret(node=arg, tbl=table) for arg in node.arguments]
+                    return call_function(function, args, scope)
 
         case ast.Identifier():
             current_scope: SymTab | None = table
@@ -192,6 +189,14 @@ def interpret(node: ast.Module | ast.Expression, tbl: SymTab | None = None) -> V
             raise ContinueExpection()
 
         case ast.ReturnExpression():
+            if isinstance(node.value, ast.Function) and node.value.name not in (
+                "print_int",
+                "print_bool",
+                "read_int",
+            ):
+                function, scope = find_function(node.value.name, table)
+                args = [interpret(node=arg, tbl=table) for arg in node.value.arguments]
+                raise TailCallException(function, args, scope)
             value = interpret(node=node.value, tbl=table)
             raise ReturnException(value)
 
@@ -202,3 +207,28 @@ def interpret(node: ast.Module | ast.Expression, tbl: SymTab | None = None) -> V
 
         case _:
             raise Exception(f"Unknown node type: {type(node)}")
+
+
+def find_function(name: str, table: SymTab) -> tuple[ast.FunDef, SymTab]:
+    """Returns the function with the given name and the scope it's defined in."""
+    scope: SymTab | None = table
+    while scope:
+        if name in scope.locals:
+            return scope.locals[name], scope
+        scope = scope.parent
+    raise Exception(f"Unknown function: {name}")
+
+
+def call_function(function: ast.FunDef, args: list[Value], scope: SymTab) -> Value:
+    # Tail calls are made here in a loop instead of recursively.
+    while True:
+        new_table = SymTab(locals={}, parent=scope)
+        for param, value in zip(function.params, args):
+            new_table.locals[param.name] = value
+        try:
+            interpret(node=function.body, tbl=new_table)
+            return None
+        except ReturnException as e:
+            return e.value
+        except TailCallException as e:
+            function, args, scope = e.function, e.arguments, e.scope
@@ -1,5 +1,16 @@
 from dataclasses import dataclass
-from typing import Callable
+from typing import Callable, Literal
+
+# "register" like `%rcx`, "memory" like `-8(%rbp)` or "immediate" like `$5`.
+OperandKind = Literal["register", "memory", "immediate"]
+
+
+def operand_kind(ref: str) -> OperandKind:
+    if ref.startswith("%"):
+        return "register"
+    if ref.startswith("$"):
+        return "immediate"
+    return "memory"
 
 
 @dataclass
@@ -7,19 +18,38 @@ class IntrinsicArgs:
     arg_refs: list[str]
     result_register: str
     emit: Callable[[str], None]
+    arg_kinds: list[OperandKind]
 
 
 Intrinsic = Callable[[IntrinsicArgs], None]
 
 all_intrinsics: dict[str, Intrinsic] = {}
+# The arguments of each intrinsic that may be immediate operands.
+immediate_args: dict[str, set[int]] = {}
+
+# The condition codes (as in `setcc` and `jcc`) of the comparison intrinsics.
+comparison_conditions = {
+    "==": "e",
+    "!=": "ne",
+    "<": "l",
+    "<=": "le",
+    ">": "g",
+    ">=": "ge",
+}
 
 
-def _intrinsic(name: str) -> Callable[[Intrinsic], Intrinsic]:
-    """Function decorator that registers that function as an intrinsic."""
+def _intrinsic(
+    name: str, immediates: set[int] | None = None
+) -> Callable[[Intrinsic], Intrinsic]:
+    """Function decorator that registers that function as an intrinsic.
+
+    `immediates` are the indices of the arguments that the intrinsic
+    accepts as immediate operands, by default all of them."""
 
     def wrapper(f: Intrinsic) -> Intrinsic:
         assert name not in all_intrinsics
         all_intrinsics[name] = f
+        immediate_args[name] = {0, 1} if immediates is None else immediates
         return f
 
     return wrapper
@@ -53,6 +83,12 @@ def minus(a: IntrinsicArgs) -> None:
 
 @_intrinsic("*")
 def multiply(a: IntrinsicArgs) -> None:
+    if a.arg_kinds.count("immediate") == 1:
+        factor, other = (
+            a.arg_refs if a.arg_kinds[0] == "immediate" else a.arg_refs[::-1]
+        )
+        _multiply_by_constant(a, other, int(factor[1:]))
+        return
     if a.result_register != a.arg_refs[0]:
         a.emit(f"movq {a.arg_refs[0]}, {a.result_register}")
     a.emit(f"imulq {a.arg_refs[1]}, {a.result_register}")
@@ -60,6 +96,9 @@ def multiply(a: IntrinsicArgs) -> None:
 
 @_intrinsic("/")
 def divide(a: IntrinsicArgs) -> None:
+    if a.arg_kinds[1] == "immediate":
+        _divide_by_constant(a, int(a.arg_refs[1][1:]), remainder=False)
+        return
     a.emit(f"movq {a.arg_refs[0]}, %rax")
     a.emit("cqto")  # TODO: explain
     a.emit(f"idivq {a.arg_refs[1]}")
@@ -69,6 +108,9 @@ def divide(a: IntrinsicArgs) -> None:
 
 @_intrinsic("%")
 def remainder(a: IntrinsicArgs) -> None:
+    if a.arg_kinds[1] == "immediate":
+        _divide_by_constant(a, int(a.arg_refs[1][1:]), remainder=True)
+        return
     # Same as division, but remainder is in register 'rdx'
     a.emit(f"movq {a.arg_refs[0]}, %rax")
     a.emit("cqto")
@@ -110,9 +152,141 @@ def ge(a: IntrinsicArgs) -> None:
 def _int_comparison(a: IntrinsicArgs, setcc_insn: str) -> None:
     # We use 'al' and 'eax' below, which means the lower bytes of 'rax'
     a.emit("xor %rax, %rax")  # Clear all bits of rax
-    a.emit(f"movq {a.arg_refs[0]}, %rdx")
-    a.emit(f"cmpq {a.arg_refs[1]}, %rdx")
+    left = a.arg_refs[0]
+    # `cmpq` can compare a register or memory to anything
+    # except memory to memory.
+    if a.arg_kinds[0] == "immediate" or a.arg_kinds == ["memory", "memory"]:
+        a.emit(f"movq {left}, %rdx")
+        left = "%rdx"
+    a.emit(f"cmpq {a.arg_refs[1]}, {left}")
     # Set lowest byte of 'rax' to comparison result
     a.emit(f"{setcc_insn} %al")
     if a.result_register != "%rax":
         a.emit(f"movq %rax, {a.result_register}")
+
+
+def _multiply_by_constant(a: IntrinsicArgs, x: str, c: int) -> None:
+    """Multiplies a register or memory operand by a constant,
+    with shifts and `leaq` where they are cheaper than `imulq`."""
+    r = a.result_register
+    # c = odd * 2**shift
+    shift = (c & -c).bit_length() - 1
+    odd = c >> shift if c > 0 else 0
+    if c == 0:
+        a.emit(f"movq $0, {r}")
+    elif c == -1:
+        if x != r:
+            a.emit(f"movq {x}, {r}")
+        a.emit(f"negq {r}")
+    elif odd in (1, 3, 5, 9):
+        if odd == 1 or not x.startswith("%"):
+            if x != r:
+                a.emit(f"movq {x}, {r}")
+            x = r
+        if odd != 1:
+            # x + x * 2, x + x * 4 or x + x * 8
+            a.emit(f"leaq ({x},{x},{odd - 1}), {r}")
+        if shift > 0:
+            a.emit(f"shlq ${shift}, {r}")
+    else:
+        # This form of `imulq` multiplies a register or memory by an immediate.
+        a.emit(f"imulq ${c}, {x}, {r}")
+
+
+def _divide_by_constant(a: IntrinsicArgs, d: int, remainder: bool) -> None:
+    """Divides like `idivq`, rounding towards zero, without dividing:
+    by shifting for powers of two and by multiplying with a "magic number"
+    approximating 2**64 / d otherwise (Hacker's Delight, chapter 10)."""
+    x = a.arg_refs[0]
+    if d == 0:
+        # Fail the same way as dividing by a variable that is zero.
+        a.emit(f"movq {x}, %rax")
+        a.emit("movq $0, %rdx")
+        a.emit("idivq %rdx")
+        return
+    if a.arg_kinds[0] == "immediate":
+        n = int(x[1:])
+        q = abs(n) // abs(d) * (1 if (n < 0) == (d < 0) else -1)
+        a.emit(f"movq ${n - q * d if remainder else q}, {a.result_register}")
+        return
+
+    if d == 1:
+        if remainder:
+            a.emit(f"movq $0, {a.result_register}")
+            return
+        a.emit(f"movq {x}, %rax")
+        result = "%rax"
+    elif d == -1:
+        # Negating would wrap around for the smallest number, which
+        # `idivq` traps on, so divide by a -1 on the stack instead.
+        a.emit(f"movq {x}, %rax")
+        a.emit("cqto")
+        a.emit("pushq $-1")
+        a.emit("idivq (%rsp)")
+        a.emit("addq $8, %rsp")
+        result = "%rdx" if remainder else "%rax"
+    elif abs(d) & (abs(d) - 1) == 0:
+        k = abs(d).bit_length() - 1
+        # Negative numbers are rounded towards zero by adding 2**k - 1
+        # before shifting.
+        a.emit(f"movq {x}, %rax")
+        a.emit("cqto")
+        a.emit(f"shrq ${64 - k}, %rdx")
+        a.emit("addq %rdx, %rax")
+        if remainder:
+            a.emit(f"andq ${2**k - 1}, %rax")
+            a.emit("subq %rdx, %rax")
+        else:
+            a.emit(f"sarq ${k}, %rax")
+            if d < 0:
+                a.emit("negq %rax")
+        result = "%rax"
+    else:
+        m, s = _magic_number(d)
+        # The high 64 bits of m * x, in rdx.
+        a.emit(f"movabsq ${m}, %rax")
+        a.emit(f"imulq {x}")
+        if d > 0 and m < 0:
+            a.emit(f"addq {x}, %rdx")
+        elif d < 0 and m > 0:
+            a.emit(f"subq {x}, %rdx")
+        if s > 0:
+            a.emit(f"sarq ${s}, %rdx")
+        # Round negative quotients towards zero.
+        a.emit("movq %rdx, %rax")
+        a.emit("shrq $63, %rax")
+        a.emit("addq %rax, %rdx")
+        if remainder:
+            a.emit(f"imulq ${d}, %rdx, %rax")
+            a.emit(f"movq {x}, %rdx")
+            a.emit("subq %rax, %rdx")
+        result = "%rdx"
+    if a.result_register != result:
+        a.emit(f"movq {result}, {a.result_register}")
+
+
+def _magic_number(d: int) -> tuple[int, int]:
+    """Returns the signed 64-bit multiplier and the shift amount
+    for dividing by `d`, where 2 <= |d| < 2**63."""
+    two63 = 2**63
+    ad = abs(d)
+    t = two63 + (1 if d < 0 else 0)
+    anc = t - 1 - t % ad
+    p = 63
+    q1, r1 = divmod(two63, anc)
+    q2, r2 = divmod(two63, ad)
+    while True:
+        p += 1
+        q1, r1 = 2 * q1, 2 * r1
+        if r1 >= anc:
+            q1, r1 = q1 + 1, r1 - anc
+        q2, r2 = 2 * q2, 2 * r2
+        if r2 >= ad:
+            q2, r2 = q2 + 1, r2 - ad
+        delta = ad - r2
+        if not (q1 < delta or (q1 == delta and r1 == 0)):
+            break
+    m = (q2 + 1) * (-1 if d < 0 else 1)
+    # Wrap into a signed 64-bit value.
+    m = (m + two63) % 2**64 - two63
+    return m, p - 64
@@ -1,6 +1,7 @@
-from dataclasses import dataclass, fields
+from dataclasses import dataclass, field, fields
 from typing import Any
 from compiler.tokenizer import Location, L
+from compiler.types import Type
 
 
 @dataclass(frozen=True)
@@ -75,3 +76,27 @@ class CondJump(Instruction):
 @dataclass(frozen=True)
 class Return(Instruction):
     value: IRVar
+
+
+@dataclass(frozen=True)
+class Phi(Instruction):
+    """Only in SSA form, at the start of a block: sets `dest` to the arg
+    whose label starts the block that control came from."""
+
+    labels: list[Label]
+    args: list[IRVar]
+    dest: IRVar
+
+
+@dataclass
+class Function:
+    """The IR of one function. The top-level code of a program is
+    the function "main", which takes no parameters."""
+
+    name: str
+    params: list[IRVar]
+    return_type: Type
+    instructions: list[Instruction]
+    # The control-flow graph built by cfg.control_flow_graph
+    # and the instructions it was built from.
+    cfg_cache: Any = field(default=None, repr=False, compare=False)
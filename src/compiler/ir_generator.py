@@ -5,7 +5,8 @@ from compiler.type_checker import functions
 from compiler.symtab import SymTab
 
 
-def generate_ir(root_node: ast.Module) -> dict[str, list[ir.Instruction]]:
+def generate_ir(root_node: ast.Module) -> dict[str, ir.Function]:
+    """Returns the functions of a program by name, "main" last."""
     root_types = {ir.IRVar(name): typ for name, typ in functions.items()}
 
     var_types: dict[ir.IRVar, Type] = dict(root_types)
@@ -31,7 +32,7 @@ def generate_ir(root_node: ast.Module) -> dict[str, list[ir.Instruction]]:
 
     instructions: list[ir.Instruction] = []
 
-    funcs: dict[str, list[ir.Instruction]] = {}
+    funcs: dict[str, ir.Function] = {}
 
     def visit(
         st: SymTab,
@@ -329,19 +330,20 @@ def generate_ir(root_node: ast.Module) -> dict[str, list[ir.Instruction]]:
         root_symtab.locals[v.name] = v
 
     for fun in root_node.funs:
-        args = []
-        for arg in fun.params:
-            args.append(arg.name)
         instructions.append(ir.Label(location=None, name="start"))
         fun_symtab = SymTab(locals={}, parent=root_symtab)
+        params = []
         for arg in fun.params:
             var = ir.IRVar(arg.name)
             var_types[var] = arg.type.type
             fun_symtab.locals[arg.name] = var
+            params.append(var)
         visit(fun_symtab, fun.body)
         if instructions[-1].__class__ != ir.Return:
             instructions.append(ir.Return(location=None, value=var_unit))
-        funcs[f"{fun.name}({str(args)})"] = instructions
+        funcs[fun.name] = ir.Function(
+            fun.name, params, functions[fun.name].return_type, instructions
+        )
         instructions = []
 
     instructions.append(ir.Label(location=None, name="start"))
@@ -367,6 +369,6 @@ def generate_ir(root_node: ast.Module) -> dict[str, list[ir.Instruction]]:
             )
         )
 
-    funcs["main"] = instructions
+    funcs["main"] = ir.Function("main", [], Unit, instructions)
 
     return funcs
@@ -0,0 +1,804 @@
+"""A small built-in assembler and linker for x86-64 Linux.
+
+It understands the subset of AT&T syntax that the code generator and the
+stdlib use, encodes it directly to machine code and writes a static ELF
+executable, so that compiling a program needs no `as` or `ld` process.
+
+Anything outside that subset raises `UnsupportedAssembly`,
+and callers are expected to fall back to the external tools.
+"""
+
+import re
+import struct
+from dataclasses import dataclass, field
+from functools import lru_cache
+from compiler.assembler import stdlib_asm_code
+
+
+class UnsupportedAssembly(Exception):
+    """Raised for assembly code that the built-in assembler can't handle."""
+
+
+# Virtual address where the executable is loaded.
+BASE_ADDRESS = 0x400000
+
+_REGS64 = [
+    "rax", "rcx", "rdx", "rbx", "rsp", "rbp", "rsi", "rdi",
+    "r8", "r9", "r10", "r11", "r12", "r13", "r14", "r15",
+]  # fmt: skip
+_REGS32 = [
+    "eax", "ecx", "edx", "ebx", "esp", "ebp", "esi", "edi",
+    "r8d", "r9d", "r10d", "r11d", "r12d", "r13d", "r14d", "r15d",
+]  # fmt: skip
+_REGS8 = [
+    "al", "cl", "dl", "bl", "spl", "bpl", "sil", "dil",
+    "r8b", "r9b", "r10b", "r11b", "r12b", "r13b", "r14b", "r15b",
+]  # fmt: skip
+
+_CONDITIONS = {
+    "o": 0x0, "no": 0x1, "b": 0x2, "c": 0x2, "nae": 0x2, "ae": 0x3, "nb": 0x3,
+    "nc": 0x3, "e": 0x4, "z": 0x4, "ne": 0x5, "nz": 0x5, "be": 0x6, "na": 0x6,
+    "a": 0x7, "nbe": 0x7, "s": 0x8, "ns": 0x9, "p": 0xA, "pe": 0xA, "np": 0xB,
+    "po": 0xB, "l": 0xC, "nge": 0xC, "ge": 0xD, "nl": 0xD, "le": 0xE, "ng": 0xE,
+    "g": 0xF, "nle": 0xF,
+}  # fmt: skip
+
+_SIZE_SUFFIXES = {"b": 8, "l": 32, "q": 64}
+
+# The /digit of the ALU instructions in the 0x80-0x83 opcode group.
+_ALU_OPS = {
+    "add": 0,
+    "or": 1,
+    "adc": 2,
+    "sbb": 3,
+    "and": 4,
+    "sub": 5,
+    "xor": 6,
+    "cmp": 7,
+}
+_UNARY_OPS = {"not": 2, "neg": 3, "mul": 4, "div": 6, "idiv": 7}
+_SHIFT_OPS = {"rol": 0, "ror": 1, "shl": 4, "sal": 4, "shr": 5, "sar": 7}
+_NO_OPERAND_OPS = {
+    "ret": b"\xc3",
+    "syscall": b"\x0f\x05",
+    "nop": b"\x90",
+    "leave": b"\xc9",
+    "cqto": b"\x48\x99",
+    "cqo": b"\x48\x99",
+    "cltq": b"\x48\x98",
+    "cdqe": b"\x48\x98",
+    "cltd": b"\x99",
+    "cdq": b"\x99",
+    "ud2": b"\x0f\x0b",
+}
+
+# An expression is a sum of signed terms,
+# each of which is a number, a symbol or "." (the current address).
+Expr = list[tuple[int, int | str]]
+
+
+@dataclass(frozen=True)
+class Reg:
+    num: int
+    size: int
+    # spl, bpl, sil and dil can only be encoded with a REX prefix.
+    needs_rex: bool = False
+
+
+@dataclass(frozen=True)
+class Imm:
+    expr: Expr
+
+
+@dataclass(frozen=True)
+class Mem:
+    disp: Expr
+    base: Reg | None = None
+    index: Reg | None = None
+    scale: int = 1
+    rip: bool = False
+
+
+Operand = Reg | Imm | Mem
+
+
+@dataclass
+class _Fixup:
+    """A field of an encoded instruction whose value depends on symbols."""
+
+    offset: int
+    size: int
+    expr: Expr
+    pc_relative: bool = False
+
+
+@dataclass(frozen=True)
+class _Code:
+    data: bytes
+    fixups: list[_Fixup] = field(default_factory=list)
+
+
+@dataclass(frozen=True)
+class _Branch:
+    """A jump whose encoding (8-bit or 32-bit offset) depends on the layout."""
+
+    cond: int | None
+    target: str
+
+    def size(self, long: bool) -> int:
+        if not long:
+            return 2
+        return 5 if self.cond is None else 6
+
+
+@dataclass(frozen=True)
+class _Assign:
+    name: str
+    expr: Expr
+
+
+@dataclass(frozen=True)
+class _Label:
+    name: str
+
+
+_Item = _Code | _Branch | _Assign | _Label
+
+
+def assemble_native(assembly_code: str, stdlib: str = stdlib_asm_code) -> bytes:
+    """Assembles and links the given code with the stdlib
+    into the bytes of a static ELF executable."""
+    items = _parse(stdlib) + _parse(assembly_code)
+    text, symbols = _layout(items, BASE_ADDRESS + _HEADERS_SIZE)
+    if "_start" not in symbols:
+        raise UnsupportedAssembly("No _start symbol")
+    return _elf_executable(text, symbols["_start"])
+
+
+# === Parsing ===
+
+
+def _parse(code: str) -> list[_Item]:
+    items: list[_Item] = []
+    for line_num, line in enumerate(code.splitlines(), start=1):
+        try:
+            items += _parse_line(line)
+        except UnsupportedAssembly as e:
+            raise UnsupportedAssembly(f"Line {line_num}: {e}: {line.strip()}")
+    return items
+
+
+# Generated code repeats the same lines a lot, and the items are immutable,
+# so each distinct line is only parsed and encoded once.
+@lru_cache(maxsize=16384)
+def _parse_line(line: str) -> tuple[_Item, ...]:
+    items: list[_Item] = []
+    _parse_statement(_strip_comment(line).strip(), items)
+    return tuple(items)
+
+
+def _strip_comment(line: str) -> str:
+    in_string = False
+    escaped = False
+    for i, c in enumerate(line):
+        if escaped:
+            escaped = False
+        elif c == "\\":
+            escaped = True
+        elif c == '"':
+            in_string = not in_string
+        elif c == "#" and not in_string:
+            return line[:i]
+    return line
+
+
+_label_re = re.compile(r"([A-Za-z_.$][\w.$]*):\s*(.*)")
+_assign_re = re.compile(r"([A-Za-z_.$][\w.$]*)\s*=\s*(.+)")
+
+
+def _parse_statement(line: str, items: list[_Item]) -> None:
+    while (m := _label_re.fullmatch(line)) is not None:
+        items.append(_Label(m[1]))
+        line = m[2]
+    if line == "":
+        return
+    if (m := _assign_re.fullmatch(line)) is not None:
+        items.append(_Assign(m[1], _parse_expr(m[2])))
+        return
+
+    parts = line.split(None, 1)
+    mnemonic = parts[0]
+    operands = _split_operands(parts[1]) if len(parts) > 1 else []
+
+    if mnemonic.startswith("."):
+        _parse_directive(mnemonic, operands, parts[1] if len(parts) > 1 else "", items)
+    elif mnemonic in ("jmp", "call", "callq") or (
+        mnemonic.startswith("j") and mnemonic[1:] in _CONDITIONS
+    ):
+        if len(operands) != 1 or not re.fullmatch(r"[A-Za-z_.$][\w.$]*", operands[0]):
+            raise UnsupportedAssembly("Unsupported jump target")
+        if mnemonic == "jmp":
+            items.append(_Branch(None, operands[0]))
+        elif mnemonic.startswith("call"):
+            items.append(
+                _Code(b"\xe8\0\0\0\0", [_Fixup(1, 4, [(1, operands[0])], True)])
+            )
+        else:
+            items.append(_Branch(_CONDITIONS[mnemonic[1:]], operands[0]))
+    else:
+        items.append(_encode(mnemonic, [_parse_operand(o) for o in operands]))
+
+
+def _parse_directive(
+    name: str, operands: list[str], rest: str, items: list[_Item]
+) -> None:
+    match name:
+        case ".global" | ".globl" | ".extern" | ".type" | ".size" | ".text":
+            pass
+        case ".section":
+            if operands[:1] != [".text"]:
+                raise UnsupportedAssembly("Unsupported section")
+        case ".set" | ".equ":
+            items.append(_Assign(operands[0], _parse_expr(operands[1])))
+        case ".ascii" | ".asciz" | ".string":
+            data = b"".join(_parse_string(s) for s in _split_operands(rest))
+            if name != ".ascii":
+                data += b"\0"
+            items.append(_Code(data))
+        case ".byte" | ".long" | ".quad":
+            size = {".byte": 1, ".long": 4, ".quad": 8}[name]
+            for operand in operands:
+                items.append(
+                    _Code(bytes(size), [_Fixup(0, size, _parse_expr(operand))])
+                )
+        case _:
+            raise UnsupportedAssembly("Unsupported directive")
+
+
+def _split_operands(text: str) -> list[str]:
+    operands: list[str] = []
+    depth = 0
+    in_string = False
+    start = 0
+    for i, c in enumerate(text):
+        if c == '"' and (i == 0 or text[i - 1] != "\\"):
+            in_string = not in_string
+        elif in_string:
+            continue
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "," and depth == 0:
+            operands.append(text[start:i].strip())
+            start = i + 1
+    operands.append(text[start:].strip())
+    return [o for o in operands if o != ""]
+
+
+def _parse_string(text: str) -> bytes:
+    if len(text) < 2 or text[0] != '"' or text[-1] != '"':
+        raise UnsupportedAssembly("Expected a string")
+    escapes = {"n": 10, "t": 9, "r": 13, "\\": 92, '"': 34, "b": 8, "f": 12}
+    result = bytearray()
+    body = text[1:-1]
+    i = 0
+    while i < len(body):
+        c = body[i]
+        if c != "\\":
+            result += c.encode()
+            i += 1
+        elif (m := re.match(r"[0-7]{1,3}", body[i + 1 :])) is not None:
+            result.append(int(m[0], 8) & 0xFF)
+            i += 1 + len(m[0])
+        elif (m := re.match(r"x([0-9a-fA-F]{1,2})", body[i + 1 :])) is not None:
+            result.append(int(m[1], 16))
+            i += 1 + len(m[0])
+        elif body[i + 1 : i + 2] in escapes:
+            result.append(escapes[body[i + 1]])
+            i += 2
+        else:
+            raise UnsupportedAssembly("Unsupported string escape")
+    return bytes(result)
+
+
+def _parse_expr(text: str) -> Expr:
+    tokens = re.findall(r"\s*([+-]|0[xX][0-9a-fA-F]+|\d+|[A-Za-z_.$][\w.$]*)", text)
+    if "".join(tokens) != re.sub(r"\s+", "", text) or not tokens:
+        raise UnsupportedAssembly("Unsupported expression")
+    expr: Expr = []
+    sign = 1
+    expect_term = True
+    for token in tokens:
+        if token in "+-":
+            if token == "-":
+                sign = -sign
+            expect_term = True
+        else:
+            if not expect_term:
+                raise UnsupportedAssembly("Unsupported expression")
+            term: int | str = int(token, 0) if token[0].isdigit() else token
+            expr.append((sign, term))
+            sign = 1
+            expect_term = False
+    if expect_term:
+        raise UnsupportedAssembly("Unsupported expression")
+    return expr
+
+
+def _constant(expr: Expr) -> int | None:
+    """Returns the value of an expression that doesn't depend on symbols."""
+    if all(isinstance(term, int) for _, term in expr):
+        return sum(sign * int(term) for sign, term in expr)
+    return None
+
+
+def _parse_register(text: str) -> Reg:
+    name = text.removeprefix("%")
+    for size, names in ((64, _REGS64), (32, _REGS32), (8, _REGS8)):
+        if name in names:
+            num = names.index(name)
+            return Reg(num, size, needs_rex=size == 8 and 4 <= num < 8)
+    raise UnsupportedAssembly(f"Unsupported register {text}")
+
+
+def _parse_operand(text: str) -> Operand:
+    if text.startswith("%"):
+        return _parse_register(text)
+    if text.startswith("$"):
+        return Imm(_parse_expr(text[1:]))
+    if (m := re.fullmatch(r"([^(]*)\((.*)\)", text)) is not None:
+        disp: Expr = _parse_expr(m[1]) if m[1].strip() != "" else [(1, 0)]
+        parts = [p.strip() for p in m[2].split(",")]
+        if parts[0] == "%rip":
+            if len(parts) != 1:
+                raise UnsupportedAssembly("Unsupported memory operand")
+            return Mem(disp, rip=True)
+        base = _parse_register(parts[0]) if parts[0] != "" else None
+        index = _parse_register(parts[1]) if len(parts) > 1 else None
+        scale = int(parts[2]) if len(parts) > 2 else 1
+        if (
+            (base is not None and base.size != 64)
+            or (index is not None and (index.size != 64 or index.num == 4))
+            or scale not in (1, 2, 4, 8)
+        ):
+            raise UnsupportedAssembly("Unsupported memory operand")
+        return Mem(disp, base, index, scale)
+    return Mem(_parse_expr(text))
+
+
+# === Encoding ===
+
+
+def _split_mnemonic(mnemonic: str, known: set[str]) -> tuple[str, int | None]:
+    """Splits a mnemonic like "addq" into "add" and its operand size."""
+    if mnemonic in known:
+        return mnemonic, None
+    if mnemonic[-1:] in _SIZE_SUFFIXES and mnemonic[:-1] in known:
+        return mnemonic[:-1], _SIZE_SUFFIXES[mnemonic[-1]]
+    raise UnsupportedAssembly("Unsupported instruction")
+
+
+_KNOWN_MNEMONICS = {
+    "mov", "movabs", "lea", "push", "pop", "test", "imul", "inc", "dec",
+    *_ALU_OPS, *_UNARY_OPS, *_SHIFT_OPS,
+}  # fmt: skip
+
+
+def _encode(mnemonic: str, operands: list[Operand]) -> _Code:
+    if mnemonic in _NO_OPERAND_OPS and not operands:
+        return _Code(_NO_OPERAND_OPS[mnemonic])
+    if mnemonic == "retq" and not operands:
+        return _Code(b"\xc3")
+
+    if (m := re.fullmatch(r"set(\w+)", mnemonic)) and m[1] in _CONDITIONS:
+        (dst,) = _expect(operands, 1)
+        if isinstance(dst, Reg) and dst.size != 8:
+            raise UnsupportedAssembly("setcc needs an 8-bit operand")
+        return _modrm(bytes([0x0F, 0x90 | _CONDITIONS[m[1]]]), 0, dst, 32)
+    if (m := re.fullmatch(r"cmov(\w+?)([lq]?)", mnemonic)) and m[1] in _CONDITIONS:
+        src, dst = _expect(operands, 2)
+        size = _operand_size(operands, _SIZE_SUFFIXES.get(m[2]))
+        return _modrm(bytes([0x0F, 0x40 | _CONDITIONS[m[1]]]), _reg(dst), src, size)
+    if (m := re.fullmatch(r"mov([zs])b([lq])", mnemonic)) is not None:
+        src, dst = _expect(operands, 2)
+        if isinstance(src, Reg) and src.size != 8:
+            raise UnsupportedAssembly("Expected an 8-bit source")
+        opcode = b"\x0f\xb6" if m[1] == "z" else b"\x0f\xbe"
+        return _modrm(opcode, _reg(dst), src, _SIZE_SUFFIXES[m[2]])
+    if mnemonic in ("movslq", "movsxd"):
+        src, dst = _expect(operands, 2)
+        return _modrm(b"\x63", _reg(dst), src, 64)
+
+    name, suffix_size = _split_mnemonic(mnemonic, _KNOWN_MNEMONICS)
+    size = _operand_size(operands, suffix_size)
+
+    if name in _ALU_OPS:
+        return _encode_alu(_ALU_OPS[name], operands, size)
+    if name in _UNARY_OPS:
+        (operand,) = _expect(operands, 1)
+        return _modrm(
+            b"\xf6" if size == 8 else b"\xf7", _UNARY_OPS[name], operand, size
+        )
+    if name in _SHIFT_OPS:
+        return _encode_shift(_SHIFT_OPS[name], operands, size)
+    if name in ("inc", "dec"):
+        (operand,) = _expect(operands, 1)
+        digit = 0 if name == "inc" else 1
+        return _modrm(b"\xfe" if size == 8 else b"\xff", digit, operand, size)
+
+    match name:
+        case "mov":
+            return _encode_mov(operands, size)
+        case "movabs":
+            src, dst = _expect(operands, 2)
+            if not isinstance(src, Imm) or not isinstance(dst, Reg) or size != 64:
+                raise UnsupportedAssembly("Unsupported operands")
+            return _with_immediate(_opcode_plus_register(0xB8, dst, 64), src.expr, 8)
+        case "lea":
+            src, dst = _expect(operands, 2)
+            if not isinstance(src, Mem):
+                raise UnsupportedAssembly("lea needs a memory operand")
+            return _modrm(b"\x8d", _reg(dst), src, size)
+        case "test":
+            src, dst = _expect(operands, 2)
+            if isinstance(src, Imm) and _is_accumulator(dst):
+                prefix = b"\x48" if size == 64 else b""
+                code = _Code(prefix + (b"\xa8" if size == 8 else b"\xa9"))
+                return _with_immediate(code, src.expr, min(size // 8, 4))
+            if isinstance(src, Imm):
+                code = _modrm(b"\xf6" if size == 8 else b"\xf7", 0, dst, size)
+                return _with_immediate(code, src.expr, min(size // 8, 4))
+            return _modrm(b"\x84" if size == 8 else b"\x85", _reg(src), dst, size)
+        case "imul":
+            return _encode_imul(operands, size)
+        case "push":
+            (operand,) = _expect(operands, 1)
+            if isinstance(operand, Reg):
+                return _opcode_plus_register(0x50, operand, 32)
+            if isinstance(operand, Imm):
+                value = _constant(operand.expr)
+                if value is not None and -128 <= value < 128:
+                    return _with_immediate(_Code(b"\x6a"), operand.expr, 1)
+                return _with_immediate(_Code(b"\x68"), operand.expr, 4)
+            return _modrm(b"\xff", 6, operand, 32)
+        case "pop":
+            (operand,) = _expect(operands, 1)
+            if isinstance(operand, Reg):
+                return _opcode_plus_register(0x58, operand, 32)
+            return _modrm(b"\x8f", 0, operand, 32)
+    raise UnsupportedAssembly("Unsupported instruction")
+
+
+def _expect(operands: list[Operand], count: int) -> list[Operand]:
+    if len(operands) != count:
+        raise UnsupportedAssembly(f"Expected {count} operands")
+    return operands
+
+
+def _reg(operand: Operand) -> Reg:
+    if not isinstance(operand, Reg):
+        raise UnsupportedAssembly("Expected a register operand")
+    return operand
+
+
+def _is_accumulator(operand: Operand) -> bool:
+    return isinstance(operand, Reg) and operand.num == 0
+
+
+def _operand_size(operands: list[Operand], suffix_size: int | None) -> int:
+    """Returns the operand size given by the suffix
+    or else by the last register operand."""
+    if suffix_size is not None:
+        return suffix_size
+    for operand in reversed(operands):
+        if isinstance(operand, Reg):
+            return operand.size
+    raise UnsupportedAssembly("Operand size is ambiguous")
+
+
+def _fits(value: int, bits: int) -> bool:
+    return -(1 << (bits - 1)) <= value < (1 << (bits - 1))
+
+
+def _with_immediate(code: _Code, expr: Expr, size: int) -> _Code:
+    fixup = _Fixup(len(code.data), size, expr)
+    return _Code(code.data + bytes(size), [*code.fixups, fixup])
+
+
+def _opcode_plus_register(opcode: int, reg: Reg, size: int) -> _Code:
+    rex = 0x40 | (0x08 if size == 64 else 0) | (reg.num >> 3)
+    prefix = bytes([rex]) if rex != 0x40 or reg.needs_rex else b""
+    return _Code(prefix + bytes([opcode | (reg.num & 7)]))
+
+
+def _modrm(opcode: bytes, reg_field: int | Reg, rm: Operand, size: int) -> _Code:
+    """Encodes an instruction with a ModRM byte.
+
+    `reg_field` is either a register or an opcode extension,
+    and `rm` is a register or memory operand."""
+    if size == 16:
+        raise UnsupportedAssembly("16-bit operands are not supported")
+    force_rex = any(isinstance(o, Reg) and o.needs_rex for o in (reg_field, rm))
+    if isinstance(reg_field, Reg):
+        reg_field = reg_field.num
+    rex = 0x40 | (0x08 if size == 64 else 0) | ((reg_field >> 3) << 2)
+    fixups: list[_Fixup] = []
+
+    if isinstance(rm, Reg):
+        rex |= rm.num >> 3
+        tail = bytes([0xC0 | ((reg_field & 7) << 3) | (rm.num & 7)])
+    elif isinstance(rm, Mem):
+        tail, rex_bits, fixup = _memory_operand(reg_field, rm)
+        rex |= rex_bits
+        if fixup is not None:
+            fixups.append(fixup)
+    else:
+        raise UnsupportedAssembly("Expected a register or memory operand")
+
+    prefix = bytes([rex]) if rex != 0x40 or force_rex else b""
+    head = prefix + opcode
+    for fixup in fixups:
+        fixup.offset += len(head)
+    return _Code(head + tail, fixups)
+
+
+def _memory_operand(reg_field: int, m: Mem) -> tuple[bytes, int, _Fixup | None]:
+    """Returns the ModRM, SIB and displacement bytes, the REX bits
+    and the fixup of the displacement for a memory operand."""
+    reg_bits = (reg_field & 7) << 3
+    if m.rip:
+        fixup = _Fixup(1, 4, m.disp, pc_relative=True)
+        return bytes([reg_bits | 0x05]) + bytes(4), 0, fixup
+
+    disp = _constant(m.disp)
+    rex_bits = 0
+    if m.index is not None:
+        rex_bits |= (m.index.num >> 3) << 1
+    if m.base is not None:
+        rex_bits |= m.base.num >> 3
+
+    if m.base is None:
+        # Absolute address, or index with a 32-bit displacement only.
+        index = m.index.num & 7 if m.index is not None else 4
+        sib = (_scale_bits(m.scale) << 6) | (index << 3) | 5
+        data = bytes([reg_bits | 0x04, sib]) + _disp_bytes(disp, 4)
+        return data, rex_bits, _Fixup(2, 4, m.disp) if disp is None else None
+
+    if disp is None:
+        mod, disp_size = 0x80, 4
+    elif disp == 0 and m.base.num & 7 != 5:
+        mod, disp_size = 0x00, 0
+    elif _fits(disp, 8):
+        mod, disp_size = 0x40, 1
+    elif _fits(disp, 32):
+        mod, disp_size = 0x80, 4
+    else:
+        raise UnsupportedAssembly("Displacement out of range")
+
+    if m.index is None and m.base.num & 7 != 4:
+        data = bytes([mod | reg_bits | (m.base.num & 7)])
+    else:
+        index = m.index.num & 7 if m.index is not None else 4
+        sib = (_scale_bits(m.scale) << 6) | (index << 3) | (m.base.num & 7)
+        data = bytes([mod | reg_bits | 0x04, sib])
+    disp_fixup = _Fixup(len(data), 4, m.disp) if disp is None else None
+    return data + _disp_bytes(disp, disp_size), rex_bits, disp_fixup
+
+
+def _scale_bits(scale: int) -> int:
+    return {1: 0, 2: 1, 4: 2, 8: 3}[scale]
+
+
+def _disp_bytes(disp: int | None, size: int) -> bytes:
+    if disp is None or size == 0:
+        return bytes(size)
+    return disp.to_bytes(size, "little", signed=True)
+
+
+def _encode_alu(digit: int, operands: list[Operand], size: int) -> _Code:
+    src, dst = _expect(operands, 2)
+    if isinstance(src, Imm):
+        value = _constant(src.expr)
+        if _is_accumulator(dst) and (size == 8 or value is None or not _fits(value, 8)):
+            # The shorter forms that implicitly operate on %al, %eax or %rax.
+            opcode = bytes([digit * 8 + (4 if size == 8 else 5)])
+            prefix = b"\x48" if size == 64 else b""
+            return _with_immediate(_Code(prefix + opcode), src.expr, min(size // 8, 4))
+        if size == 8:
+            return _with_immediate(_modrm(b"\x80", digit, dst, 8), src.expr, 1)
+        if value is not None and _fits(value, 8):
+            return _with_immediate(_modrm(b"\x83", digit, dst, size), src.expr, 1)
+        return _with_immediate(_modrm(b"\x81", digit, dst, size), src.expr, 4)
+    byte_op = 0 if size == 8 else 1
+    if isinstance(src, Reg):
+        return _modrm(bytes([digit * 8 + byte_op]), src, dst, size)
+    return _modrm(bytes([digit * 8 + 2 + byte_op]), _reg(dst), src, size)
+
+
+def _encode_mov(operands: list[Operand], size: int) -> _Code:
+    src, dst = _expect(operands, 2)
+    if isinstance(src, Imm):
+        if size == 8:
+            return _with_immediate(_modrm(b"\xc6", 0, dst, 8), src.expr, 1)
+        if size == 32 and isinstance(dst, Reg):
+            return _with_immediate(_opcode_plus_register(0xB8, dst, 32), src.expr, 4)
+        value = _constant(src.expr)
+        if value is not None and not _fits(value, 32):
+            raise UnsupportedAssembly("Immediate out of range")
+        return _with_immediate(_modrm(b"\xc7", 0, dst, size), src.expr, 4)
+    if isinstance(src, Reg):
+        return _modrm(b"\x88" if size == 8 else b"\x89", src, dst, size)
+    return _modrm(b"\x8a" if size == 8 else b"\x8b", _reg(dst), src, size)
+
+
+def _encode_shift(digit: int, operands: list[Operand], size: int) -> _Code:
+    if len(operands) == 1:
+        return _modrm(b"\xd0" if size == 8 else b"\xd1", digit, operands[0], size)
+    src, dst = _expect(operands, 2)
+    if isinstance(src, Reg):
+        if src.num != 1 or src.size != 8:
+            raise UnsupportedAssembly("Shift count must be %cl")
+        return _modrm(b"\xd2" if size == 8 else b"\xd3", digit, dst, size)
+    if not isinstance(src, Imm):
+        raise UnsupportedAssembly("Unsupported shift count")
+    if _constant(src.expr) == 1:
+        return _modrm(b"\xd0" if size == 8 else b"\xd1", digit, dst, size)
+    return _with_immediate(
+        _modrm(b"\xc0" if size == 8 else b"\xc1", digit, dst, size), src.expr, 1
+    )
+
+
+def _encode_imul(operands: list[Operand], size: int) -> _Code:
+    if size == 8:
+        raise UnsupportedAssembly("8-bit imul is not supported")
+    if len(operands) == 1:
+        return _modrm(b"\xf7", 5, operands[0], size)
+    if len(operands) == 2:
+        src, dst = operands
+        if not isinstance(src, Imm):
+            return _modrm(b"\x0f\xaf", _reg(dst), src, size)
+        operands = [src, dst, dst]
+    imm, src, dst = _expect(operands, 3)
+    if not isinstance(imm, Imm):
+        raise UnsupportedAssembly("Expected an immediate operand")
+    value = _constant(imm.expr)
+    if value is not None and _fits(value, 8):
+        return _with_immediate(_modrm(b"\x6b", _reg(dst), src, size), imm.expr, 1)
+    return _with_immediate(_modrm(b"\x69", _reg(dst), src, size), imm.expr, 4)
+
+
+# === Layout and linking ===
+
+
+def _layout(items: list[_Item], start: int) -> tuple[bytes, dict[str, int]]:
+    """Places all items starting at the given address, choosing the shortest
+    encoding for each jump, and returns the final code and symbol values."""
+    # Jumps start out short and are made long until all offsets fit.
+    long = [False] * len(items)
+    while True:
+        symbols: dict[str, int] = {}
+        addresses: list[int] = []
+        address = start
+        for i, item in enumerate(items):
+            addresses.append(address)
+            if isinstance(item, _Label):
+                if item.name in symbols:
+                    raise Exception(f"Symbol defined twice: {item.name}")
+                symbols[item.name] = address
+            elif isinstance(item, _Code):
+                address += len(item.data)
+            elif isinstance(item, _Branch):
+                address += item.size(long[i])
+        for item, address in zip(items, addresses):
+            if isinstance(item, _Assign):
+                symbols[item.name] = _evaluate(item.expr, symbols, address)
+
+        grew = False
+        for i, item in enumerate(items):
+            if isinstance(item, _Branch) and not long[i]:
+                end = addresses[i] + item.size(False)
+                if not _fits(_symbol(symbols, item.target) - end, 8):
+                    long[i] = True
+                    grew = True
+        if not grew:
+            break
+
+    text = bytearray()
+    for i, item in enumerate(items):
+        address = addresses[i]
+        if isinstance(item, _Code):
+            if not item.fixups:
+                text += item.data
+                continue
+            data = bytearray(item.data)
+            for fixup in item.fixups:
+                value = _evaluate(fixup.expr, symbols, address)
+                if fixup.pc_relative:
+                    value -= address + len(item.data)
+                _patch(data, fixup, value)
+            text += data
+        elif isinstance(item, _Branch):
+            offset = _symbol(symbols, item.target) - (address + item.size(long[i]))
+            if not long[i]:
+                opcode = [0xEB] if item.cond is None else [0x70 | item.cond]
+                text += bytes(opcode) + offset.to_bytes(1, "little", signed=True)
+            else:
+                opcode = [0xE9] if item.cond is None else [0x0F, 0x80 | item.cond]
+                text += bytes(opcode) + offset.to_bytes(4, "little", signed=True)
+    return bytes(text), symbols
+
+
+def _symbol(symbols: dict[str, int], name: str) -> int:
+    if name not in symbols:
+        raise Exception(f"Undefined reference to `{name}'")
+    return symbols[name]
+
+
+def _evaluate(expr: Expr, symbols: dict[str, int], here: int) -> int:
+    total = 0
+    for sign, term in expr:
+        if isinstance(term, int):
+            total += sign * term
+        elif term == ".":
+            total += sign * here
+        else:
+            total += sign * _symbol(symbols, term)
+    return total
+
+
+def _patch(data: bytearray, fixup: _Fixup, value: int) -> None:
+    bits = fixup.size * 8
+    if fixup.size == 8:
+        value &= (1 << 64) - 1
+    elif not (_fits(value, bits) or 0 <= value < (1 << bits)):
+        raise Exception(f"Value {value} doesn't fit in {bits} bits")
+    data[fixup.offset : fixup.offset + fixup.size] = (
+        value & ((1 << bits) - 1)
+    ).to_bytes(fixup.size, "little")
+
+
+# === ELF output ===
+
+_ELF_HEADER = struct.Struct("<16sHHIQQQIHHHHHH")
+_PROGRAM_HEADER = struct.Struct("<IIQQQQQQ")
+_HEADERS_SIZE = _ELF_HEADER.size + 2 * _PROGRAM_HEADER.size
+
+_PT_LOAD = 1
+_PT_GNU_STACK = 0x6474E551
+_PF_X, _PF_W, _PF_R = 1, 2, 4
+
+
+def _elf_executable(text: bytes, entry: int) -> bytes:
+    """Builds a static executable that maps the whole file, headers and all,
+    as one read-only and executable segment at `BASE_ADDRESS`."""
+    file_size = _HEADERS_SIZE + len(text)
+    header = _ELF_HEADER.pack(
+        b"\x7fELF\x02\x01\x01" + bytes(9),  # 64-bit, little-endian, version 1
+        2,  # e_type: executable
+        0x3E,  # e_machine: x86-64
+        1,  # e_version
+        entry,
+        _ELF_HEADER.size,  # e_phoff
+        0,  # e_shoff: no section headers
+        0,  # e_flags
+        _ELF_HEADER.size,
+        _PROGRAM_HEADER.size,
+        2,  # e_phnum
+        64,  # e_shentsize
+        0,  # e_shnum
+        0,  # e_shstrndx
+    )
+    load = _PROGRAM_HEADER.pack(
+        _PT_LOAD,
+        _PF_R | _PF_X,
+        0,  # p_offset
+        BASE_ADDRESS,
+        BASE_ADDRESS,
+        file_size,
+        file_size,
+        0x1000,
+    )
+    # Without this the kernel would make the stack executable.
+    stack = _PROGRAM_HEADER.pack(_PT_GNU_STACK, _PF_R | _PF_W, 0, 0, 0, 0, 0, 16)
+    return header + load + stack + text
@@ -0,0 +1,170 @@
+import re
+from functools import lru_cache
+from typing import Callable
+
+# A rule looks at the lines starting at the given index and either returns
+# how many of them to replace and what to replace them with, or None.
+Rule = Callable[[list[str], int], tuple[int, list[str]] | None]
+
+all_rules: dict[str, Rule] = {}
+
+
+def _rule(name: str) -> Callable[[Rule], Rule]:
+    """Function decorator that registers that function as a peephole rule."""
+
+    def wrapper(f: Rule) -> Rule:
+        assert name not in all_rules
+        all_rules[name] = f
+        return f
+
+    return wrapper
+
+
+def optimize(
+    assembly_code: str,
+    rules: dict[str, Rule] | None = None,
+    hits: dict[str, int] | None = None,
+) -> str:
+    """Rewrites short sequences of instructions into cheaper ones
+    until no rule applies anymore.
+
+    If `hits` is given, the number of times each rule was applied
+    is added to it."""
+    if rules is None:
+        rules = all_rules
+    lines = assembly_code.split("\n")
+    i = 0
+    while i < len(lines):
+        for name, rule in rules.items():
+            rewrite = rule(lines, i)
+            if rewrite is not None:
+                count, replacement = rewrite
+                lines[i : i + count] = replacement
+                if hits is not None:
+                    hits[name] = hits.get(name, 0) + 1
+                # The rewrite may let a rule match the line before it.
+                i = max(i - 1, 0)
+                break
+        else:
+            i += 1
+    return "\n".join(lines)
+
+
+@lru_cache(maxsize=4096)
+def _split(line: str) -> tuple[str, tuple[str, ...]]:
+    """Splits an instruction into its mnemonic and operands."""
+    mnemonic, _, rest = line.strip().partition(" ")
+    operands = re.split(r",(?![^()]*\))", rest) if rest else []
+    return mnemonic, tuple(op.strip() for op in operands)
+
+
+def _is_register(operand: str) -> bool:
+    return operand.startswith("%")
+
+
+def _is_memory(operand: str) -> bool:
+    return operand.endswith(")")
+
+
+def _line(lines: list[str], i: int) -> tuple[str, tuple[str, ...]]:
+    return _split(lines[i]) if i < len(lines) else ("", ())
+
+
+@_rule("self_move")
+def _self_move(lines: list[str], i: int) -> tuple[int, list[str]] | None:
+    """`movq %rcx, %rcx` does nothing."""
+    mnemonic, ops = _line(lines, i)
+    if mnemonic == "movq" and len(ops) == 2 and ops[0] == ops[1]:
+        return 1, []
+    return None
+
+
+@_rule("store_load")
+def _store_load(lines: list[str], i: int) -> tuple[int, list[str]] | None:
+    """A value just moved from one place to another needn't be read
+    back from the second place:
+
+        movq %rax, -16(%rbp)        movq %rax, -16(%rbp)
+        movq -16(%rbp), %rax   =>
+        movq -16(%rbp), %rcx        movq %rax, %rcx
+    """
+    mnemonic, ops = _line(lines, i)
+    next_mnemonic, next_ops = _line(lines, i + 1)
+    if mnemonic != "movq" or next_mnemonic != "movq":
+        return None
+    if len(ops) != 2 or len(next_ops) != 2 or next_ops[0] != ops[1]:
+        return None
+    src, dest = ops
+    if _is_memory(src) and dest in src:
+        return None
+    if next_ops[1] == src:
+        return 2, [lines[i]]
+    # Copying a register from memory is cheaper than loading it.
+    if _is_register(src) and _is_memory(dest) and _is_register(next_ops[1]):
+        return 2, [lines[i], f"movq {src}, {next_ops[1]}"]
+    return None
+
+
+@_rule("jump_to_next")
+def _jump_to_next(lines: list[str], i: int) -> tuple[int, list[str]] | None:
+    """A jump to the label right after it does nothing."""
+    mnemonic, ops = _line(lines, i)
+    if mnemonic.startswith("j") and len(ops) == 1 and i + 1 < len(lines):
+        if lines[i + 1] == f"{ops[0]}:":
+            return 1, []
+    return None
+
+
+_registers_32 = {
+    "%rax": "%eax",
+    "%rbx": "%ebx",
+    "%rcx": "%ecx",
+    "%rdx": "%edx",
+    "%rsi": "%esi",
+    "%rdi": "%edi",
+    **{f"%r{n}": f"%r{n}d" for n in range(8, 16)},
+}
+
+# Instructions that set the flags without reading them.
+_flag_writers = {
+    "cmpq",
+    "testq",
+    "addq",
+    "subq",
+    "imulq",
+    "negq",
+    "xor",
+    "xorq",
+    "xorl",
+}
+# Instructions after which the flags are no longer needed.
+_flag_clobbers = {"callq", "call", "ret", "jmp"}
+
+
+def _flags_dead_after(lines: list[str], i: int) -> bool:
+    """Tells whether no instruction reads the flags as they are after line `i`
+    before they are overwritten. The generated code never reads flags set
+    before a label or a jump."""
+    for j in range(i + 1, len(lines)):
+        mnemonic, _ = _split(lines[j])
+        if mnemonic in _flag_writers or mnemonic in _flag_clobbers:
+            return True
+        if mnemonic.endswith(":") or mnemonic == "":
+            return True
+        if mnemonic.startswith(("j", "set", "cmov", "adc", "sbb")):
+            return False
+        if mnemonic not in ("movq", "movabsq", "pushq", "popq", "cqto", "idivq"):
+            return False
+    return True
+
+
+@_rule("zero_with_xor")
+def _zero_with_xor(lines: list[str], i: int) -> tuple[int, list[str]] | None:
+    """`xorl %ecx, %ecx` also zeroes all of %rcx and is shorter than
+    `movq $0, %rcx`, but it changes the flags."""
+    mnemonic, ops = _line(lines, i)
+    if mnemonic == "movq" and len(ops) == 2 and ops[0] == "$0":
+        register = _registers_32.get(ops[1])
+        if register is not None and _flags_dead_after(lines, i):
+            return 1, [f"xorl {register}, {register}"]
+    return None
@@ -0,0 +1,109 @@
+from dataclasses import dataclass, fields, is_dataclass
+from compiler import ast
+from compiler.admission import check_deadline
+from compiler.tokenizer import tokenize
+from compiler.parser import parse
+from compiler.type_checker import typecheck
+from compiler.ir_generator import generate_ir
+from compiler.assembly_generator import generate_assembly
+from compiler.assembler import assemble_and_get_executable
+from compiler.compile_stats import CompileStats
+from compiler.native_assembler import UnsupportedAssembly, assemble_native
+from compiler import peephole
+from compiler.constant_propagation import propagate_constants
+from compiler.dead_code import eliminate_dead_code
+from compiler.ssa import from_ssa, to_ssa
+
+
+@dataclass(frozen=True)
+class CompileOptions:
+    # "native" assembles and links in-process, falling back to `as` and `ld`
+    # for code it doesn't support, while "gnu" always uses `as` and `ld`.
+    assembler: str = "native"
+    # "linear-scan" keeps variables in registers where possible,
+    # "graph-coloring" also removes copies between variables but is slower,
+    # and "stack" gives every variable its own stack slot.
+    register_allocator: str = "linear-scan"
+    # Whether to rewrite the generated assembly with `peephole.optimize`.
+    peephole: bool = True
+    # Whether to fold constants and remove branches that can't be taken
+    # with `constant_propagation.propagate_constants`. Together with the
+    # SSA round trip it needs, this can make compiling several times slower.
+    constant_propagation: bool = False
+    # Whether to remove IR instructions whose results aren't used
+    # with `dead_code.eliminate_dead_code`.
+    dead_code_elimination: bool = False
+
+
+def call_compiler(
+    source_code: str,
+    input_file_name: str,
+    stats: CompileStats | None = None,
+    deadline: float | None = None,
+    options: CompileOptions = CompileOptions(),
+) -> bytes:
+    """Compiles source code into an executable.
+
+    If a `time.monotonic()` deadline is given, compilation is abandoned
+    between stages once it has passed, and `as` and `ld` are killed
+    if they are still running at the deadline."""
+    if stats is None:
+        stats = CompileStats()
+    with stats.stage("tokenize"):
+        tokens = tokenize(source_code)
+    check_deadline(deadline)
+    with stats.stage("parse"):
+        ast_node = parse(tokens)
+    check_deadline(deadline)
+    with stats.stage("typecheck"):
+        typecheck(ast_node)
+    check_deadline(deadline)
+    with stats.stage("generate_ir"):
+        ir = generate_ir(ast_node)
+    if options.constant_propagation:
+        with stats.stage("constant_propagation"):
+            ir = {
+                name: from_ssa(propagate_constants(to_ssa(fun)))
+                for name, fun in ir.items()
+            }
+    if options.dead_code_elimination:
+        with stats.stage("dead_code_elimination"):
+            ir = {
+                name: eliminate_dead_code(fun, removed=stats.dead_code_removed)
+                for name, fun in ir.items()
+            }
+    check_deadline(deadline)
+    with stats.stage("generate_assembly"):
+        asm_code = generate_assembly(ir, options.register_allocator)
+    if options.peephole:
+        with stats.stage("peephole"):
+            asm_code = peephole.optimize(asm_code, hits=stats.peephole_hits)
+    check_deadline(deadline)
+    executable: bytes | None = None
+    if options.assembler == "native":
+        try:
+            with stats.stage("native_assemble"):
+                executable = assemble_native(asm_code)
+        except UnsupportedAssembly:
+            executable = None
+    if executable is None:
+        executable = assemble_and_get_executable(
+            asm_code, stats=stats, deadline=deadline
+        )
+
+    stats.sizes["tokens"] = len(tokens)
+    stats.sizes["ast_nodes"] = count_ast_nodes(ast_node)
+    stats.sizes["ir_instructions"] = sum(len(fun.instructions) for fun in ir.values())
+    stats.sizes["asm_lines"] = asm_code.count("\n")
+    stats.sizes["asm_bytes"] = len(asm_code)
+    stats.sizes["executable_bytes"] = len(executable)
+    return executable
+
+
+def count_ast_nodes(node: object) -> int:
+    if isinstance(node, list):
+        return sum(count_ast_nodes(n) for n in node)
+    if not isinstance(node, (ast.Expression, ast.FunDef, ast.Module)):
+        return 0
+    assert is_dataclass(node)
+    return 1 + sum(count_ast_nodes(getattr(node, f.name)) for f in fields(node))
@@ -0,0 +1,422 @@
+from dataclasses import dataclass, field
+from itertools import chain
+from compiler import ir
+from compiler.dataflow import defs, live_variables, uses
+from compiler.intrinsics import all_intrinsics
+
+# Registers that calls may overwrite and that don't preserve their values.
+# %rax and %rdx are left out, since intrinsics use them as scratch registers.
+caller_saved_registers = ["%rcx", "%rsi", "%rdi", "%r8", "%r9", "%r10", "%r11"]
+# Registers that functions must restore before returning.
+callee_saved_registers = ["%rbx", "%r12", "%r13", "%r14", "%r15"]
+all_registers = caller_saved_registers + callee_saved_registers
+
+# The location of variables that are used but never assigned,
+# which only happens for Unit values.
+undefined_location = "$0"
+
+
+@dataclass
+class Allocation:
+    """Where each variable of a function lives."""
+
+    # A register like "%rbx" or a stack slot like "-16(%rbp)".
+    locations: dict[ir.IRVar, str]
+    # Bytes of stack needed for spilled variables and saved registers.
+    stack_used: int
+    # The callee-saved registers that the function uses,
+    # and the stack slots their original values are saved in.
+    saved_registers: dict[str, str] = field(default_factory=dict)
+    # Parameters whose incoming values are never read.
+    unused_params: set[ir.IRVar] = field(default_factory=set)
+
+
+def is_function_call(insn: ir.Instruction) -> bool:
+    """Tells whether the instruction calls a real function,
+    which may overwrite caller-saved registers."""
+    return isinstance(insn, ir.Call) and insn.fun.name not in all_intrinsics
+
+
+def liveness(
+    instructions: list[ir.Instruction], params: list[ir.IRVar] | None = None
+) -> tuple[list[set[ir.IRVar]], list[set[ir.IRVar]]]:
+    """Returns the variables live before and after each instruction.
+
+    If `params` is given, only they and assigned variables are included.
+    The rest hold no values, yet would be live from the start of the
+    function to wherever they are used."""
+    tracked = None
+    if params is not None:
+        tracked = params + [v for insn in instructions for v in defs(insn)]
+    return live_variables(instructions, tracked=tracked).instruction_sets()
+
+
+@dataclass
+class Interval:
+    """The positions where a variable is live. Instruction `i` reads its
+    operands at position `2 * i` and writes its result at `2 * i + 1`."""
+
+    var: ir.IRVar
+    start: int
+    end: int
+    # Whether the variable must survive a function call.
+    crosses_call: bool = False
+
+
+def live_intervals(
+    instructions: list[ir.Instruction], params: list[ir.IRVar]
+) -> list[Interval]:
+    """Returns an interval covering all positions where each variable
+    is live, sorted by start. Parameters start at position -1."""
+    live_in, live_out = liveness(instructions, params)
+    intervals: dict[ir.IRVar, Interval] = {}
+    defined = set(params)
+
+    def extend(v: ir.IRVar, position: int) -> None:
+        interval = intervals.get(v)
+        if interval is None:
+            intervals[v] = Interval(v, position, position)
+        else:
+            interval.start = min(interval.start, position)
+            interval.end = max(interval.end, position)
+
+    for p in params:
+        if instructions and p in live_in[0]:
+            extend(p, -1)
+    for i, insn in enumerate(instructions):
+        for v in live_in[i]:
+            extend(v, 2 * i)
+        for v in live_out[i]:
+            extend(v, 2 * i + 1)
+        for v in defs(insn):
+            extend(v, 2 * i + 1)
+            defined.add(v)
+        if is_function_call(insn):
+            for v in live_out[i] - set(defs(insn)):
+                intervals[v].crosses_call = True
+
+    return sorted(
+        (interval for interval in intervals.values() if interval.var in defined),
+        key=lambda interval: interval.start,
+    )
+
+
+def all_stack_allocation(variables: list[ir.IRVar]) -> Allocation:
+    """Gives every variable its own stack slot."""
+    locations: dict[ir.IRVar, str] = {}
+    for v in variables:
+        if v not in locations:
+            locations[v] = f"-{8 * (len(locations) + 1)}(%rbp)"
+    # Keep the stack pointer 16-byte aligned.
+    return Allocation(locations, (8 * len(locations) + 15) // 16 * 16)
+
+
+class _StackSlots:
+    """Hands out stack slots, reusing ones whose variables are no longer live."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        # Freed slots and the position where their last variable died.
+        self.free: list[tuple[str, int]] = []
+
+    def take(self, start: int) -> str:
+        """Returns a slot that is unused from the given position on."""
+        for i, (slot, end) in enumerate(self.free):
+            if end < start:
+                del self.free[i]
+                return slot
+        self.count += 1
+        return f"-{8 * self.count}(%rbp)"
+
+    def release(self, slot: str, end: int) -> None:
+        self.free.append((slot, end))
+
+    def stack_used(self) -> int:
+        # Keep the stack pointer 16-byte aligned.
+        return (8 * self.count + 15) // 16 * 16
+
+
+def linear_scan_allocation(
+    instructions: list[ir.Instruction], params: list[ir.IRVar]
+) -> Allocation:
+    """Assigns registers to variables by linear scan over their live intervals.
+
+    Variables that live across calls only get callee-saved registers.
+    When there are no registers left, the variable whose interval ends last
+    is spilled to a stack slot, and slots are reused once their variable
+    is no longer live."""
+    intervals = live_intervals(instructions, params)
+    param_registers = dict(zip(params, ["%rdi", "%rsi", "%rdx", "%rcx", "%r8", "%r9"]))
+    slots = _StackSlots()
+    locations: dict[ir.IRVar, str] = {}
+    free_registers = list(all_registers)
+    active: list[Interval] = []  # Intervals in registers, sorted by end.
+    spilled: list[Interval] = []  # Intervals in stack slots.
+    used_callee_saved: set[str] = set()
+
+    def assign(interval: Interval, location: str) -> None:
+        locations[interval.var] = location
+        if location.startswith("%"):
+            active.append(interval)
+            active.sort(key=lambda a: a.end)
+            if location in callee_saved_registers:
+                used_callee_saved.add(location)
+        else:
+            spilled.append(interval)
+
+    for interval in intervals:
+        # Intervals that have ended give back their locations.
+        for old in [a for a in active if a.end < interval.start]:
+            active.remove(old)
+            free_registers.append(locations[old.var])
+        for old in [s for s in spilled if s.end < interval.start]:
+            spilled.remove(old)
+            slots.release(locations[old.var], old.end)
+
+        allowed = callee_saved_registers if interval.crosses_call else None
+        candidates = [r for r in free_registers if allowed is None or r in allowed]
+        if candidates:
+            # Prefer leaving parameters in the registers they arrive in,
+            # then caller-saved registers, which needn't be saved.
+            hint = param_registers.get(interval.var)
+            if hint in candidates:
+                register = hint
+            else:
+                register = min(candidates, key=all_registers.index)
+            free_registers.remove(register)
+            assign(interval, register)
+            continue
+
+        victims = [a for a in active if allowed is None or locations[a.var] in allowed]
+        if victims and victims[-1].end > interval.end:
+            victim = victims[-1]
+            register = locations[victim.var]
+            active.remove(victim)
+            assign(victim, slots.take(victim.start))
+            assign(interval, register)
+        else:
+            assign(interval, slots.take(interval.start))
+
+    # Saved registers need their slots for the whole function.
+    saved_registers = {
+        r: slots.take(-1) for r in callee_saved_registers if r in used_callee_saved
+    }
+    for insn in instructions:
+        for v in uses(insn):
+            locations.setdefault(v, undefined_location)
+    live_params = {i.var for i in intervals if i.start == -1}
+    return Allocation(
+        locations,
+        slots.stack_used(),
+        saved_registers,
+        unused_params=set(params) - live_params,
+    )
+
+
+def interference_graph(
+    instructions: list[ir.Instruction],
+    params: list[ir.IRVar],
+    live_in: list[set[ir.IRVar]],
+    live_out: list[set[ir.IRVar]],
+) -> tuple[dict[ir.IRVar, set[ir.IRVar]], set[ir.IRVar]]:
+    """Returns the variables that are live at the same time as each variable,
+    and the variables that must survive a function call.
+
+    Only assigned variables and parameters whose incoming values are read
+    are included. The source and destination of a `Copy` don't interfere
+    because of it, so that they may be coalesced."""
+    entry_live = live_in[0] if instructions else set()
+    graph: dict[ir.IRVar, set[ir.IRVar]] = {p: set() for p in params if p in entry_live}
+    for insn in instructions:
+        for v in defs(insn):
+            graph.setdefault(v, set())
+    crosses_call: set[ir.IRVar] = set()
+
+    def interfere(a: ir.IRVar, live: set[ir.IRVar]) -> None:
+        for b in live:
+            if a != b and b in graph:
+                graph[a].add(b)
+                graph[b].add(a)
+
+    # Parameters are all written on entry.
+    for p in params:
+        if p in entry_live:
+            interfere(p, entry_live)
+    for i, insn in enumerate(instructions):
+        ignored = {insn.src} if isinstance(insn, ir.Copy) else set()
+        for d in defs(insn):
+            interfere(d, live_out[i] - ignored)
+        if is_function_call(insn):
+            crosses_call |= live_out[i] - set(defs(insn))
+    return graph, crosses_call & set(graph)
+
+
+def graph_coloring_allocation(
+    instructions: list[ir.Instruction], params: list[ir.IRVar]
+) -> Allocation:
+    """Assigns registers to variables by coloring their interference graph,
+    Chaitin/Briggs style.
+
+    First the source and destination of each `Copy` are merged whenever
+    George's or Briggs' conservative test says that can't make the graph
+    harder to color, so the copy disappears. Then variables are removed from the graph,
+    preferring ones with fewer neighbors than registers they may use,
+    and given registers in reverse order. Variables left without a register
+    are spilled to stack slots, which spilled variables share when they
+    don't interfere."""
+    live_in, live_out = liveness(instructions, params)
+    graph, crosses_call = interference_graph(instructions, params, live_in, live_out)
+    received_params = {p for p in params if instructions and p in live_in[0]}
+    param_registers = dict(zip(params, ["%rdi", "%rsi", "%rdx", "%rcx", "%r8", "%r9"]))
+
+    def allowed(v: ir.IRVar) -> list[str]:
+        return callee_saved_registers if v in crosses_call else all_registers
+
+    # === Coalescing ===
+    alias: dict[ir.IRVar, ir.IRVar] = {}
+
+    def find(v: ir.IRVar) -> ir.IRVar:
+        while v in alias:
+            v = alias[v]
+        return v
+
+    def significant(v: ir.IRVar) -> bool:
+        return len(graph[v]) >= len(allowed(v))
+
+    def briggs(a: ir.IRVar, b: ir.IRVar) -> bool:
+        # The merged variable will have fewer neighbors that can't be
+        # removed from the graph than registers.
+        k = len(callee_saved_registers if {a, b} & crosses_call else all_registers)
+        count = 0
+        for n in chain(graph[a], (n for n in graph[b] if n not in graph[a])):
+            degree = len(graph[n]) - (n in graph[a] and n in graph[b])
+            if degree >= len(allowed(n)):
+                count += 1
+                if count >= k:
+                    return False
+        return True
+
+    def george(a: ir.IRVar, b: ir.IRVar) -> bool:
+        # Every neighbor of b that can't be removed from the graph is
+        # already a neighbor of a. Only checks b's neighbors, so it's cheap
+        # when b has few, even if a has many.
+        if b in crosses_call and a not in crosses_call:
+            return False
+        return all(n in graph[a] or not significant(n) for n in graph[b])
+
+    # Each pair of variables copied between is tested once, and again only
+    # when one of their neighbors loses enough neighbors of its own
+    # to make the tests pass.
+    moves = list(
+        dict.fromkeys(
+            (insn.dest, insn.src) for insn in instructions if isinstance(insn, ir.Copy)
+        )
+    )
+    moves_of: dict[ir.IRVar, list[int]] = {}
+    for i, move in enumerate(moves):
+        for v in move:
+            moves_of.setdefault(v, []).append(i)
+    worklist = list(reversed(range(len(moves))))
+    waiting: set[int] = set()
+
+    def enable_moves(v: ir.IRVar) -> None:
+        for i in moves_of.get(v, []):
+            if i in waiting:
+                waiting.remove(i)
+                worklist.append(i)
+
+    while worklist:
+        i = worklist.pop()
+        a, b = find(moves[i][0]), find(moves[i][1])
+        if a == b or a not in graph or b not in graph or b in graph[a]:
+            continue
+        # Keep a parameter as the merged variable, so that it's still
+        # hinted towards the register it arrives in. Otherwise merge
+        # the variable with fewer neighbors into the other.
+        if b in param_registers or (
+            a not in param_registers and len(graph[b]) > len(graph[a])
+        ):
+            a, b = b, a
+        if not (george(a, b) or briggs(a, b)):
+            waiting.add(i)
+            continue
+        for n in graph.pop(b):
+            graph[n].discard(b)
+            if n not in graph[a]:
+                graph[n].add(a)
+                graph[a].add(n)
+            elif len(graph[n]) == len(allowed(n)) - 1:
+                # n now has few enough neighbors to be removed.
+                enable_moves(n)
+                for m in graph[n]:
+                    enable_moves(m)
+        if b in crosses_call:
+            crosses_call.add(a)
+        alias[b] = a
+        moves_of.setdefault(a, []).extend(moves_of.pop(b, []))
+
+    # === Simplification ===
+    spill_costs = {v: 0 for v in graph}
+    for insn in instructions:
+        for v in uses(insn) + defs(insn):
+            if find(v) in spill_costs:
+                spill_costs[find(v)] += 1
+    degrees = {v: len(neighbors) for v, neighbors in graph.items()}
+    removed: list[ir.IRVar] = []
+    remaining = set(graph)
+    low_degree = [v for v in graph if degrees[v] < len(allowed(v))]
+    while remaining:
+        if low_degree:
+            v = low_degree.pop()
+            if v not in remaining:
+                continue
+        else:
+            # Remove the variable that's cheapest to spill per neighbor,
+            # optimistically hoping it still gets a register.
+            v = min(remaining, key=lambda v: spill_costs[v] / (degrees[v] + 1))
+        remaining.remove(v)
+        removed.append(v)
+        for n in graph[v]:
+            if n in remaining:
+                degrees[n] -= 1
+                if degrees[n] == len(allowed(n)) - 1:
+                    low_degree.append(n)
+
+    # === Selection ===
+    slots = _StackSlots()
+    colors: dict[ir.IRVar, str] = {}
+    spilled: list[ir.IRVar] = []
+    for v in reversed(removed):
+        taken = {colors[n] for n in graph[v] if n in colors}
+        candidates = [r for r in allowed(v) if r not in taken]
+        if not candidates:
+            spilled.append(v)
+            continue
+        hint = param_registers.get(v)
+        if hint in candidates:
+            colors[v] = hint
+        else:
+            colors[v] = min(candidates, key=all_registers.index)
+    slot_list: list[str] = []
+    for v in spilled:
+        taken = {colors[n] for n in graph[v] if n in colors}
+        free = [slot for slot in slot_list if slot not in taken]
+        if free:
+            colors[v] = free[0]
+        else:
+            colors[v] = slots.take(0)
+            slot_list.append(colors[v])
+
+    locations: dict[ir.IRVar, str] = {}
+    for insn in instructions:
+        for v in uses(insn) + defs(insn):
+            locations[v] = colors.get(find(v), undefined_location)
+    saved_registers = {
+        r: slots.take(0) for r in callee_saved_registers if r in colors.values()
+    }
+    return Allocation(
+        locations,
+        slots.stack_used(),
+        saved_registers,
+        unused_params=set(params) - received_params,
+    )
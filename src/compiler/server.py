@@ -0,0 +1,448 @@
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+import sys
+import time
+from base64 import b64encode
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from socketserver import StreamRequestHandler, TCPServer
+from traceback import format_exception, print_exc
+from typing import Any
+from compiler.admission import AdmissionControl, OverloadedError
+from compiler.compile_cache import CompileCache, cache_key, compiler_fingerprint
+from compiler.compile_stats import CompileStats, StatsAggregator
+from compiler.pipeline import CompileOptions, call_compiler
+
+
+class Server(TCPServer):
+    allow_reuse_address = True
+    request_queue_size = 32
+
+
+compile_cache: CompileCache | None = None
+server_stats: StatsAggregator | None = None
+admission: AdmissionControl | None = None
+request_deadline: float | None = None
+compile_options = CompileOptions()
+
+
+def configure_worker(
+    cache_entries: int,
+    cache_dir: str | None,
+    stats: StatsAggregator | None,
+    admission_control: AdmissionControl | None,
+    deadline: float | None,
+    options: CompileOptions = CompileOptions(),
+) -> None:
+    """Sets up the compile cache, statistics, load limits
+    and compiler options of this process.
+
+    The cache is disabled if it may hold no entries and has no directory.
+    `deadline` is the number of seconds a request may take, if limited."""
+    global compile_cache, server_stats, admission, request_deadline, compile_options
+    if cache_entries > 0 or cache_dir is not None:
+        compile_cache = CompileCache(cache_entries, cache_dir)
+        compiler_fingerprint()
+    else:
+        compile_cache = None
+    server_stats = stats
+    admission = admission_control
+    request_deadline = deadline
+    compile_options = options
+
+
+def new_deadline() -> float | None:
+    """Returns the deadline of a request arriving now."""
+    if request_deadline is None:
+        return None
+    return time.monotonic() + request_deadline
+
+
+def _compile(source_code: str, stats: CompileStats, deadline: float | None) -> bytes:
+    if admission is None:
+        return call_compiler(
+            source_code, "(source code)", stats, deadline, compile_options
+        )
+    with admission.compilation(deadline):
+        return call_compiler(
+            source_code, "(source code)", stats, deadline, compile_options
+        )
+
+
+def compile_cached(
+    source_code: str,
+    stats: CompileStats,
+    deadline: float | None,
+    cached: bytes | None = None,
+) -> bytes:
+    with stats.stage("total"):
+        if cached is not None:
+            stats.cache = "hit"
+            return cached
+        if compile_cache is None:
+            return _compile(source_code, stats, deadline)
+        key = cache_key(source_code, asdict(compile_options))
+        executable = compile_cache.get(key)
+        if executable is None:
+            stats.cache = "miss"
+            executable = _compile(source_code, stats, deadline)
+            compile_cache.put(key, executable)
+        else:
+            stats.cache = "hit"
+        return executable
+
+
+def compile_with_stats(
+    source_code: str,
+    include_stats: bool,
+    deadline: float | None,
+    cached: bytes | None = None,
+) -> dict[str, Any]:
+    """Compiles a program into a response with the executable in "program"
+    and, if requested, the statistics of this compilation in "stats".
+
+    `cached` is the executable if the caller has already found it
+    in the compile cache."""
+    stats = CompileStats()
+    try:
+        result: dict[str, Any] = {
+            "program": compile_cached(source_code, stats, deadline, cached)
+        }
+    except Exception:
+        if server_stats is not None:
+            server_stats.record(stats, error=True)
+        raise
+    if server_stats is not None:
+        server_stats.record(stats, error=False)
+    if include_stats:
+        result["stats"] = stats.to_json()
+    return result
+
+
+# Binary responses and framed responses start with a 4-byte big-endian
+# length of the JSON that follows.
+_length_prefix = struct.Struct("!I")
+
+
+def compile_program(
+    source_code: str, include_stats: bool = False, deadline: float | None = None
+) -> dict[str, Any]:
+    """Compiles one program of a batch,
+    reporting failure in "error" instead of raising."""
+    try:
+        return compile_with_stats(source_code, include_stats, deadline)
+    except Exception as e:
+        return {"error": "".join(format_exception(e))}
+
+
+_batch_pool: ProcessPoolExecutor | None = None
+
+
+def _start_batch_process() -> None:
+    global compile_cache
+    # The process that owns the pool caches what the pool compiles, since
+    # entries added here would be lost. Every lookup still counts as a miss.
+    compile_cache = CompileCache(0)
+
+
+def compile_batch(
+    programs: list[str], include_stats: bool, deadline: float | None
+) -> list[dict[str, Any]]:
+    """Compiles a batch of programs concurrently in a pool of processes
+    forked from this one, which is created on the first batch and
+    stopped by `shutdown_batch_pool`.
+
+    Programs in this process's compile cache are taken from it,
+    and the rest are added to it once the pool has compiled them."""
+    global _batch_pool
+    if not isinstance(programs, list) or not all(isinstance(p, str) for p in programs):
+        raise Exception("Expected a list of programs")
+    if len(programs) <= 1:
+        return [compile_program(p, include_stats, deadline) for p in programs]
+    results: list[dict[str, Any] | None] = [None] * len(programs)
+    keys = [cache_key(p, asdict(compile_options)) for p in programs]
+    for i, program in enumerate(programs):
+        cached = compile_cache.get(keys[i]) if compile_cache is not None else None
+        if cached is not None:
+            results[i] = compile_with_stats(program, include_stats, deadline, cached)
+    misses = [i for i, r in enumerate(results) if r is None]
+    if misses and _batch_pool is None:
+        # Only this many programs may be compiled at once anyway.
+        _batch_pool = ProcessPoolExecutor(
+            max_workers=(
+                admission.max_concurrency
+                if admission is not None
+                else os.cpu_count() or 1
+            ),
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_start_batch_process,
+        )
+    if misses:
+        assert _batch_pool is not None
+        compiled = _batch_pool.map(
+            compile_program,
+            [programs[i] for i in misses],
+            [include_stats] * len(misses),
+            [deadline] * len(misses),
+        )
+        for i, result in zip(misses, compiled):
+            if compile_cache is not None and "program" in result:
+                compile_cache.put(keys[i], result["program"])
+            results[i] = result
+    return [r for r in results if r is not None]
+
+
+def shutdown_batch_pool() -> None:
+    """Stops the processes of the batch pool, if there are any,
+    so that they don't outlive this process."""
+    global _batch_pool
+    if _batch_pool is not None:
+        _batch_pool.shutdown(wait=True, cancel_futures=True)
+        _batch_pool = None
+
+
+def handle_request(input: dict[str, Any], deadline: float | None) -> dict[str, Any]:
+    """Executes a single decoded protocol request and returns the response.
+
+    A compiled executable is returned as bytes in "program"."""
+    result: dict[str, Any] = {}
+    include_stats = input.get("stats", False) is True
+    if input["command"] == "compile":
+        source_code = input["code"]
+        result = compile_with_stats(source_code, include_stats, deadline)
+    elif input["command"] == "compile_batch":
+        result["results"] = compile_batch(input["programs"], include_stats, deadline)
+    elif input["command"] == "stats":
+        if server_stats is None:
+            raise Exception("Statistics are not collected")
+        result["stats"] = server_stats.to_json()
+    elif input["command"] == "ping":
+        pass
+    else:
+        result["error"] = "Unknown command: " + input["command"]
+    return result
+
+
+def encode_response(result: dict[str, Any], binary: bool, framed: bool) -> list[bytes]:
+    """Encodes a response as a list of chunks to send one after another.
+
+    Normally the response is JSON with executables base64-encoded,
+    preceded by its length if `framed` is set.
+    In binary mode the response is the length of a JSON header,
+    the header with each executable's size in "program_size",
+    and then the raw executables in order."""
+    programs: list[bytes] = []
+
+    def take_program(r: dict[str, Any]) -> None:
+        program: bytes | None = r.pop("program", None)
+        if program is None:
+            return
+        if binary:
+            r["program_size"] = len(program)
+            programs.append(program)
+        else:
+            r["program"] = b64encode(program).decode()
+
+    take_program(result)
+    for r in result.get("results", []):
+        take_program(r)
+
+    payload = str.encode(json.dumps(result))
+    if binary:
+        return [_length_prefix.pack(len(payload)), payload, *programs]
+    if framed:
+        return [_length_prefix.pack(len(payload)), payload]
+    return [payload]
+
+
+def overloaded_response(e: OverloadedError) -> dict[str, Any]:
+    return {"error": str(e), "overloaded": True}
+
+
+def handle_raw_request(
+    data: bytes,
+    framed: bool = False,
+    deadline: float | None = None,
+    admitted: bool = False,
+) -> list[bytes]:
+    """Decodes a JSON request and handles it with `handle_decoded_request`."""
+    try:
+        input = json.loads(data.decode())
+    except Exception as e:
+        result = {"error": "".join(format_exception(e))}
+        return encode_response(result, binary=False, framed=framed)
+    return handle_decoded_request(input, framed, deadline, admitted)
+
+
+def handle_decoded_request(
+    input: Any,
+    framed: bool = False,
+    deadline: float | None = None,
+    admitted: bool = False,
+) -> list[bytes]:
+    """Executes a decoded JSON request and encodes the response.
+
+    Unless the caller has already `admitted` the request,
+    it is first checked against the server's load limits.
+    Errors are reported in the "error" field of the response."""
+    if deadline is None:
+        deadline = new_deadline()
+    binary = False
+    try:
+        binary = input.get("binary", False) is True
+        if admitted or admission is None:
+            result = handle_request(input, deadline)
+        else:
+            with admission.request():
+                result = handle_request(input, deadline)
+    except OverloadedError as e:
+        result = overloaded_response(e)
+    except Exception as e:
+        result = {"error": "".join(format_exception(e))}
+    return encode_response(result, binary, framed)
+
+
+def send_chunks(sock: socket.socket, chunks: list[bytes]) -> None:
+    """Sends all chunks with as few system calls as possible and without
+    joining them into one buffer first."""
+    views = [memoryview(chunk) for chunk in chunks if chunk]
+    while views:
+        sent = sock.sendmsg(views)
+        while views and sent >= len(views[0]):
+            sent -= len(views[0])
+            views.pop(0)
+        if views:
+            views[0] = views[0][sent:]
+
+
+class Handler(StreamRequestHandler):
+    def handle(self) -> None:
+        send_chunks(self.request, handle_raw_request(self.rfile.read()))
+
+
+class WorkerPool:
+    """Keeps a fixed number of forked worker processes accepting
+    connections from the listening socket of a shared server.
+
+    Workers are forked once up front instead of once per request, so the
+    already imported compiler is reused by every request a worker handles.
+    A worker exits after `max_requests` requests (0 means never)
+    and is replaced by a fresh one.
+    """
+
+    def __init__(self, server: TCPServer, workers: int, max_requests: int) -> None:
+        if workers < 1:
+            raise Exception(f"Invalid number of workers: {workers}")
+        self.server = server
+        self.workers = workers
+        self.max_requests = max_requests
+        self._children: set[int] = set()
+        self._stopping = False
+
+    def run(self) -> None:
+        def terminate(signum: int, frame: object) -> None:
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            sys.exit(0)
+
+        signal.signal(signal.SIGTERM, terminate)
+        for _ in range(self.workers):
+            self._spawn()
+        try:
+            while self._children:
+                pid, status = os.wait()
+                if pid not in self._children:
+                    continue
+                self._children.remove(pid)
+                if os.waitstatus_to_exitcode(status) != 0:
+                    print(f"Worker {pid} exited abnormally", file=sys.stderr)
+                if not self._stopping:
+                    self._spawn()
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        self._stopping = True
+        for pid in self._children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in self._children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        self._children.clear()
+
+    def _spawn(self) -> None:
+        pid = os.fork()
+        if pid != 0:
+            self._children.add(pid)
+            return
+        exit_code = 0
+        try:
+            self._work()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        except BaseException:
+            print_exc()
+            exit_code = 1
+        finally:
+            try:
+                shutdown_batch_pool()
+            finally:
+                os._exit(exit_code)
+
+    def _work(self) -> None:
+        # Exit through `_spawn`, which stops the batch pool first.
+        def terminate(signum: int, frame: object) -> None:
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            sys.exit(0)
+
+        signal.signal(signal.SIGTERM, terminate)
+        handled = 0
+        while self.max_requests == 0 or handled < self.max_requests:
+            self.server.handle_request()
+            handled += 1
+
+
+def run_server(
+    host: str,
+    port: int,
+    workers: int | None = None,
+    max_requests: int = 0,
+    request_queue_size: int = Server.request_queue_size,
+    cache_entries: int = 1024,
+    cache_dir: str | None = None,
+    max_concurrency: int | None = None,
+    max_queue: int = 64,
+    deadline: float | None = 60,
+    options: CompileOptions = CompileOptions(),
+) -> None:
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_concurrency is None:
+        max_concurrency = workers
+    # A worker holds on to its request while it waits for a compile slot,
+    # so every request that may wait needs a worker of its own,
+    # and one more is needed to turn away the requests beyond that.
+    workers = max(workers, max_concurrency + max_queue + 1)
+    configure_worker(
+        cache_entries,
+        cache_dir,
+        StatsAggregator(),
+        AdmissionControl(max_concurrency, max_queue),
+        deadline,
+        options,
+    )
+
+    print(f"Starting TCP server at {host}:{port} with {workers} workers")
+    with Server((host, port), Handler, bind_and_activate=False) as server:
+        server.request_queue_size = request_queue_size
+        server.server_bind()
+        server.server_activate()
+        WorkerPool(server, workers, max_requests).run()
@@ -0,0 +1,318 @@
+from dataclasses import replace
+from typing import Callable
+from compiler import ir
+from compiler.cfg import BasicBlock, ControlFlowGraph, control_flow_graph
+from compiler.dataflow import defs, live_variables, uses
+
+# Added to the start of a function whose first block can be jumped to,
+# since phis there would have no label for entering the function.
+entry_label_name = "ssa.entry"
+
+
+def dominance_frontiers(graph: ControlFlowGraph) -> list[set[int]]:
+    """Returns the blocks where each block's dominance ends: those that
+    have a predecessor dominated by the block but aren't strictly
+    dominated by it themselves."""
+    frontiers: list[set[int]] = [set() for _ in graph.blocks]
+    for b in graph.reverse_postorder:
+        preds = [p for p in graph.blocks[b].preds if graph.is_reachable(p)]
+        if len(preds) < 2:
+            continue
+        for p in preds:
+            runner: int | None = p
+            while runner is not None and runner != graph.idom[b]:
+                frontiers[runner].add(b)
+                runner = graph.idom[runner]
+    return frontiers
+
+
+def rename_vars(
+    insn: ir.Instruction,
+    use: Callable[[ir.IRVar], ir.IRVar],
+    define: Callable[[ir.IRVar], ir.IRVar] | None = None,
+) -> ir.Instruction:
+    """Returns the instruction with the variables it reads replaced by
+    `use` and the variable it assigns replaced by `define`."""
+    match insn:
+        case ir.Call() | ir.Phi():
+            insn = replace(insn, args=[use(v) for v in insn.args])
+        case ir.Copy():
+            insn = replace(insn, src=use(insn.src))
+        case ir.CondJump():
+            insn = replace(insn, cond=use(insn.cond))
+        case ir.Return():
+            insn = replace(insn, value=use(insn.value))
+    match insn:
+        case ir.Call() | ir.Copy() | ir.LoadIntConst() | ir.LoadBoolConst() | ir.Phi():
+            if define is not None:
+                insn = replace(insn, dest=define(insn.dest))
+    return insn
+
+
+def to_ssa(function: ir.Function) -> ir.Function:
+    """Returns the function in static single assignment form, where
+    every variable is assigned by exactly one instruction.
+
+    Assignments to a variable get the names "x.1", "x.2" and so on, and
+    phis join them where paths meet, but only where the variable is read
+    later on. Parameters keep their names for their incoming values,
+    and variables read without being assigned keep theirs everywhere.
+    Code that can't run is left out."""
+    instructions = function.instructions
+    first = instructions[0] if instructions else None
+    if not isinstance(first, ir.Label) or any(
+        first.name in _targets(insn) for insn in instructions
+    ):
+        instructions = [ir.Label(None, entry_label_name)] + instructions
+        function = replace(function, instructions=instructions, cfg_cache=None)
+    graph = control_flow_graph(function)
+    blocks = graph.blocks
+
+    variables = list(function.params)
+    def_blocks: dict[ir.IRVar, set[int]] = {p: {0} for p in function.params}
+    for b in graph.reverse_postorder:
+        for insn in blocks[b].instructions:
+            for v in defs(insn):
+                if v not in def_blocks:
+                    variables.append(v)
+                def_blocks.setdefault(v, set()).add(b)
+
+    # Place phis at the iterated dominance frontiers of the assignments.
+    liveness = live_variables(instructions, graph, tracked=variables)
+    var_index = {v: i for i, v in enumerate(variables)}
+    frontiers = dominance_frontiers(graph)
+    phi_vars: list[list[ir.IRVar]] = [[] for _ in blocks]
+    for v, sites in def_blocks.items():
+        work = list(sites)
+        placed: set[int] = set()
+        while work:
+            b = work.pop()
+            for f in frontiers[b]:
+                if f not in placed and liveness.block_in[f] >> var_index[v] & 1:
+                    placed.add(f)
+                    phi_vars[f].append(v)
+                    if f not in sites:
+                        work.append(f)
+
+    # Rename along the dominator tree, where the current name of each
+    # variable is the last one pushed onto its stack.
+    versions: dict[ir.IRVar, int] = {}
+    stacks: dict[ir.IRVar, list[ir.IRVar]] = {p: [p] for p in function.params}
+    phi_dests: list[list[ir.IRVar]] = [[] for _ in blocks]
+    # The arguments of the phis of each block, by predecessor.
+    phi_args: list[dict[int, list[ir.IRVar]]] = [{} for _ in blocks]
+    renamed: list[list[ir.Instruction]] = [[] for _ in blocks]
+    # The variables given new names in the block being renamed.
+    pushed: list[ir.IRVar] = []
+
+    def current(v: ir.IRVar) -> ir.IRVar:
+        stack = stacks.get(v)
+        return stack[-1] if stack else v
+
+    def new_name(v: ir.IRVar) -> ir.IRVar:
+        versions[v] = versions.get(v, 0) + 1
+        name = ir.IRVar(f"{v.name}.{versions[v]}")
+        stacks.setdefault(v, []).append(name)
+        pushed.append(v)
+        return name
+
+    work_stack: list[tuple[int, list[ir.IRVar] | None]] = [(0, None)]
+    while work_stack:
+        b, popped = work_stack.pop()
+        if popped is not None:
+            for v in popped:
+                stacks[v].pop()
+            continue
+        pushed = []
+        phi_dests[b] = [new_name(v) for v in phi_vars[b]]
+        for insn in blocks[b].instructions:
+            renamed[b].append(rename_vars(insn, current, new_name))
+        for s in blocks[b].succs:
+            phi_args[s][b] = [current(v) for v in phi_vars[s]]
+        work_stack.append((b, pushed))
+        work_stack.extend((c, None) for c in reversed(graph.dom_children[b]))
+
+    new_instructions: list[ir.Instruction] = []
+    for b in range(len(blocks)):
+        if not graph.is_reachable(b):
+            continue
+        code = renamed[b]
+        if phi_vars[b]:
+            preds = [p for p in blocks[b].preds if graph.is_reachable(p)]
+            labels = [_first_label(blocks[p]) for p in preds]
+            phis = [
+                ir.Phi(None, labels, [phi_args[b][p][i] for p in preds], dest)
+                for i, dest in enumerate(phi_dests[b])
+            ]
+            code = code[:1] + phis + code[1:]
+        new_instructions.extend(code)
+    return replace(function, instructions=new_instructions, cfg_cache=None)
+
+
+def _targets(insn: ir.Instruction) -> list[str]:
+    match insn:
+        case ir.Jump():
+            return [insn.label.name]
+        case ir.CondJump():
+            return [insn.then_label.name, insn.else_label.name]
+    return []
+
+
+def _first_label(block: BasicBlock) -> ir.Label:
+    label = block.instructions[0]
+    assert isinstance(label, ir.Label)
+    return label
+
+
+def from_ssa(function: ir.Function) -> ir.Function:
+    """Replaces the phis of a function in SSA form with copies at the end
+    of each predecessor. The copies for an edge from a block with several
+    successors go into a new block on that edge, so that they don't
+    happen on the other paths.
+
+    Afterwards the versions of a variable get its name back if no version
+    is live where another one is assigned, which makes the copies between
+    them unnecessary."""
+    graph = control_flow_graph(function)
+    blocks = graph.blocks
+    block_of = {b.label: b.index for b in blocks if b.label is not None}
+    taken_labels = set(block_of)
+    taken_vars = {v for insn in function.instructions for v in defs(insn)}
+
+    def fresh_label(base: str) -> str:
+        n = 1
+        while f"{base}.{n}" in taken_labels:
+            n += 1
+        taken_labels.add(f"{base}.{n}")
+        return f"{base}.{n}"
+
+    def fresh_var() -> ir.IRVar:
+        n = len(taken_vars)
+        while ir.IRVar(f"ssa.tmp.{n}") in taken_vars:
+            n += 1
+        taken_vars.add(ir.IRVar(f"ssa.tmp.{n}"))
+        return ir.IRVar(f"ssa.tmp.{n}")
+
+    # The copies to make at the end of each block, and the blocks
+    # to add after each block for its edges, as their label, the label
+    # they jump to and their copies.
+    end_copies: dict[int, list[ir.Instruction]] = {}
+    edge_blocks: dict[int, list[tuple[ir.Label, ir.Label, list[ir.Instruction]]]] = {}
+    for block in blocks:
+        by_pred: dict[str, list[tuple[ir.IRVar, ir.IRVar]]] = {}
+        for insn in block.instructions:
+            if isinstance(insn, ir.Phi):
+                for label, arg in zip(insn.labels, insn.args):
+                    by_pred.setdefault(label.name, []).append((arg, insn.dest))
+        for pred_label, moves in by_pred.items():
+            p = block_of[pred_label]
+            copies = _sequential_copies(moves, fresh_var)
+            if len(blocks[p].succs) == 1:
+                end_copies[p] = copies
+                continue
+            target = _first_label(block)
+            edge_label = ir.Label(None, fresh_label(target.name))
+            edge_blocks.setdefault(p, []).append((edge_label, target, copies))
+
+    new_instructions: list[ir.Instruction] = []
+    for block in blocks:
+        code = [insn for insn in block.instructions if not isinstance(insn, ir.Phi)]
+        if block.index in end_copies:
+            if code and isinstance(code[-1], (ir.Jump, ir.CondJump)):
+                code[-1:-1] = end_copies[block.index]
+            else:
+                code.extend(end_copies[block.index])
+        edges = edge_blocks.get(block.index, [])
+        for edge_label, target, _ in edges:
+            # Redirect the edge through the new block.
+            cond_jump = code[-1]
+            assert isinstance(cond_jump, ir.CondJump)
+            if cond_jump.then_label.name == target.name:
+                cond_jump = replace(cond_jump, then_label=edge_label)
+            if cond_jump.else_label.name == target.name:
+                cond_jump = replace(cond_jump, else_label=edge_label)
+            code[-1] = cond_jump
+        new_instructions.extend(code)
+        for edge_label, target, copies in edges:
+            new_instructions.extend([edge_label, *copies, ir.Jump(None, target)])
+    return _merge_versions(
+        replace(function, instructions=new_instructions, cfg_cache=None)
+    )
+
+
+def _merge_versions(function: ir.Function) -> ir.Function:
+    instructions = function.instructions
+    names = dict.fromkeys(v for insn in instructions for v in uses(insn) + defs(insn))
+    original: dict[ir.IRVar, ir.IRVar] = {}
+    for v in names:
+        base, dot, version = v.name.rpartition(".")
+        if dot and version.isdigit():
+            original[v] = ir.IRVar(base)
+    for v in list(original.values()):
+        # Parameters, for example, keep their names in SSA form.
+        if v in names:
+            original[v] = v
+
+    # A variable with one version can always have its name back.
+    groups: dict[ir.IRVar, list[ir.IRVar]] = {}
+    for v, var in original.items():
+        groups.setdefault(var, []).append(v)
+    shared = [v for group in groups.values() if len(group) > 1 for v in group]
+
+    graph = control_flow_graph(function)
+    liveness = live_variables(instructions, graph, tracked=shared)
+    index = {v: i for i, v in enumerate(shared)}
+    # The versions of a variable are next to each other in `shared`.
+    versions = {
+        var: (1 << len(group)) - 1 << index[group[0]]
+        for var, group in groups.items()
+        if len(group) > 1
+    }
+
+    conflicts: set[ir.IRVar] = set()
+    for i, _, live_after in liveness.each_instruction():
+        insn = instructions[i]
+        for v in defs(insn):
+            if v not in index or original[v] in conflicts:
+                continue
+            others = versions[original[v]] ^ 1 << index[v]
+            if isinstance(insn, ir.Copy) and original.get(insn.src) == original[v]:
+                # The source has the same value afterwards.
+                others ^= 1 << index[insn.src]
+            if live_after & others:
+                conflicts.add(original[v])
+
+    def merged(v: ir.IRVar) -> ir.IRVar:
+        var = original.get(v, v)
+        return v if var in conflicts else var
+
+    new_instructions = []
+    for insn in instructions:
+        if any(merged(v) != v for v in uses(insn) + defs(insn)):
+            insn = rename_vars(insn, merged, merged)
+        if not (isinstance(insn, ir.Copy) and insn.src == insn.dest):
+            new_instructions.append(insn)
+    return replace(function, instructions=new_instructions, cfg_cache=None)
+
+
+def _sequential_copies(
+    moves: list[tuple[ir.IRVar, ir.IRVar]], fresh_var: Callable[[], ir.IRVar]
+) -> list[ir.Instruction]:
+    """Returns copies that have the same effect as making all the moves
+    at once, like when phis swap the values of two variables."""
+    pending = [(src, dest) for src, dest in moves if src != dest]
+    copies: list[ir.Instruction] = []
+    while pending:
+        for i, (src, dest) in enumerate(pending):
+            if all(dest != other for j, (other, _) in enumerate(pending) if j != i):
+                copies.append(ir.Copy(None, src, dest))
+                del pending[i]
+                break
+        else:
+            # The remaining moves form cycles. Break one by saving
+            # a destination's current value.
+            blocked = pending[0][1]
+            temp = fresh_var()
+            copies.append(ir.Copy(None, blocked, temp))
+            pending = [(temp if src == blocked else src, dest) for src, dest in pending]
+    return copies
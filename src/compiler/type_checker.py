@@ -22,6 +22,8 @@ functions = {
     "read_int": FunType(params_type=[], return_type=Int),
 }
 
+builtin_functions = dict(functions)
+
 types = {"Int": Int, "Bool": Bool, "Unit": Unit}
 
 
@@ -207,6 +209,9 @@ def typecheck(
             node.type = o
 
         case ast.Module():
+            # Forget the functions of previously checked modules
+            functions.clear()
+            functions.update(builtin_functions)
             for fun in node.funs:
                 functions[fun.name] = FunType(
                     params_type=[types[arg.type.name] for arg in fun.params],
@@ -0,0 +1,34 @@
+import time
+import pytest
+from compiler.admission import AdmissionControl, OverloadedError, check_deadline
+
+
+def test_admission_rejects_beyond_queue() -> None:
+    admission = AdmissionControl(max_concurrency=1, max_queue=1)
+    with admission.request():
+        with admission.request():
+            with pytest.raises(OverloadedError):
+                with admission.request():
+                    pass
+        with admission.request():
+            pass
+    return None
+
+
+def test_admission_compilation_waits_until_deadline() -> None:
+    admission = AdmissionControl(max_concurrency=1, max_queue=0)
+    with admission.compilation(None):
+        with pytest.raises(Exception, match="deadline exceeded"):
+            with admission.compilation(time.monotonic() + 0.01):
+                pass
+    with admission.compilation(time.monotonic()):
+        pass
+    return None
+
+
+def test_admission_check_deadline() -> None:
+    check_deadline(None)
+    check_deadline(time.monotonic() + 60)
+    with pytest.raises(Exception, match="Compile deadline exceeded"):
+        check_deadline(time.monotonic() - 1)
+    return None
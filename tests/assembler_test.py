@@ -0,0 +1,98 @@
+import platform
+import shutil
+import subprocess
+import time
+from pathlib import Path
+import pytest
+from compiler.assembler import (
+    _stdlib_cache_dir,
+    assemble,
+    assemble_and_get_executable,
+    stdlib_object,
+)
+
+program = """
+    .global main
+    .section .text
+main:
+    movq $42, %rdi
+    call print_int
+    ret
+"""
+
+pytestmark = pytest.mark.skipif(
+    platform.system() != "Linux" or platform.machine() != "x86_64",
+    reason="needs x86-64 Linux",
+)
+
+
+def test_assemble_writes_executable(tmp_path: Path) -> None:
+    output = tmp_path / "program"
+    assemble(program, str(output))
+    output.chmod(0o755)
+    assert subprocess.run([output], capture_output=True).stdout == b"42\n"
+    return None
+
+
+def test_assemble_keeps_source_in_given_workdir(tmp_path: Path) -> None:
+    executable = assemble_and_get_executable(program, workdir=str(tmp_path))
+    assert executable.startswith(b"\x7fELF")
+    assert (tmp_path / "program.s").read_text() == program
+    return None
+
+
+def use_cache_home(monkeypatch: pytest.MonkeyPatch, cache_home: Path) -> Path:
+    monkeypatch.setenv("XDG_CACHE_HOME", str(cache_home))
+    _stdlib_cache_dir.cache_clear()
+    return cache_home / "compiler"
+
+
+def test_stdlib_object_is_built_once(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    cache = use_cache_home(monkeypatch, tmp_path / "cache")
+    try:
+        assemble(program, str(tmp_path / "first"))
+        (obj,) = cache.iterdir()
+        built = obj.stat()
+        assemble(program, str(tmp_path / "second"))
+        assert list(cache.iterdir()) == [obj]
+        assert (obj.stat().st_ino, obj.stat().st_mtime_ns) == (
+            built.st_ino,
+            built.st_mtime_ns,
+        )
+    finally:
+        _stdlib_cache_dir.cache_clear()
+    return None
+
+
+def test_failed_stdlib_build_leaves_no_temporary_file(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    cache = use_cache_home(monkeypatch, tmp_path / "cache")
+    sleep = shutil.which("sleep")
+    bin = tmp_path / "bin"
+    bin.mkdir()
+    monkeypatch.setenv("PATH", str(bin))
+    fake_as = bin / "as"
+    try:
+        # `as` can't be found.
+        with pytest.raises(FileNotFoundError):
+            stdlib_object(link_with_c=False)
+        assert list(cache.iterdir()) == []
+
+        # `as` fails.
+        fake_as.write_text("#!/bin/sh\nexit 1\n")
+        fake_as.chmod(0o755)
+        with pytest.raises(subprocess.CalledProcessError):
+            stdlib_object(link_with_c=False)
+        assert list(cache.iterdir()) == []
+
+        # `as` is killed when the program misses its deadline.
+        fake_as.write_text(f"#!/bin/sh\nexec {sleep} 10\n")
+        with pytest.raises(subprocess.TimeoutExpired):
+            assemble(program, str(tmp_path / "a.out"), deadline=time.monotonic() + 0.5)
+        assert list(cache.iterdir()) == []
+    finally:
+        _stdlib_cache_dir.cache_clear()
+    return None
@@ -0,0 +1,229 @@
+import platform
+import re
+import signal
+import subprocess
+from pathlib import Path
+import pytest
+from dataclasses import replace
+from compiler.assembly_generator import generate_assembly
+from compiler.ir import LoadIntConst
+from compiler.native_assembler import assemble_native
+from tests.helpers import ir_of
+
+
+def asm_of(code: str) -> list[str]:
+    return generate_assembly(ir_of(code)).splitlines()
+
+
+def test_comparison_fused_with_branch() -> None:
+    lines = asm_of("var n = read_int(); while n > 1 do { n = n - 1; } n")
+    header = lines.index(".main_L1:")
+    assert lines[header + 1].startswith("cmpq $1, ")
+    assert lines[header + 2] == "jle .main_L3"
+    assert lines[header + 3] == ".main_L2:"
+    assert not any(line.startswith("set") for line in lines)
+    return None
+
+
+def test_comparison_result_used_elsewhere_is_stored() -> None:
+    lines = asm_of("var b = read_int() < 3; if b then print_int(1); b")
+    assert "setl %al" in lines
+    assert any(line.startswith("cmpq $0, ") for line in lines)
+    return None
+
+
+def test_constants_as_immediate_operands() -> None:
+    lines = asm_of("var n = read_int(); print_int(n * 1000 + 5); n < 2")
+    assert any(line.startswith("imulq $1000, ") for line in lines)
+    assert any(line.startswith("addq $5, ") for line in lines)
+    assert any(line.startswith("cmpq $2, ") for line in lines)
+    assert not any(line.startswith("movq $1000") for line in lines)
+    return None
+
+
+def test_constant_condition_becomes_jump() -> None:
+    lines = asm_of("if true then print_int(1) else print_int(2);")
+    assert not any(line.startswith("cmpq") for line in lines)
+    # The then branch comes next and the else branch is never jumped to.
+    assert not any(line.endswith(" .main_L2") for line in lines)
+    return None
+
+
+def test_strength_reduction_instructions() -> None:
+    lines = asm_of("var n = read_int(); print_int(n * 6); print_int(n / 8); n % 7")
+    assert any(line.startswith("leaq ") for line in lines)
+    assert any(line.startswith("sarq $3, ") for line in lines)
+    assert not any(line.startswith("idivq") for line in lines)
+    assert not any(line.startswith("imulq $6") for line in lines)
+    return None
+
+
+@pytest.mark.skipif(
+    platform.system() != "Linux" or platform.machine() != "x86_64",
+    reason="needs x86-64 Linux",
+)
+def test_strength_reduction_results(tmp_path: Path) -> None:
+    numbers = [0, 1, -1, 7, -7, 100, -100, 12345, 2**62 + 3, -(2**63) + 1]
+    constants = [1, -1, 2, -2, 3, 5, 6, 7, -7, 8, 10, 16, -16, 1000003, 2**31 - 1]
+    # Negative constants in source code are negations evaluated at runtime,
+    # so put them into the IR directly.
+    placeholders = {10**9 + i: c for i, c in enumerate(constants)}
+    source = "var n = read_int();\n"
+    for p in placeholders:
+        source += f"print_int(n / {p}); print_int(n % {p}); print_int(n * {p});\n"
+    ir = ir_of(source)
+    ir["main"].instructions = [
+        (
+            replace(insn, value=placeholders[insn.value])
+            if isinstance(insn, LoadIntConst) and insn.value in placeholders
+            else insn
+        )
+        for insn in ir["main"].instructions
+    ]
+    executable = tmp_path / "program"
+    executable.write_bytes(assemble_native(generate_assembly(ir)))
+    executable.chmod(0o755)
+    for n in numbers:
+        result = subprocess.run(
+            [executable], input=f"{n}\n".encode(), capture_output=True, check=True
+        )
+        expected = []
+        for c in constants:
+            q = abs(n) // abs(c) * (1 if (n < 0) == (c < 0) else -1)
+            for value in (q, n - q * c, n * c):
+                value = (value + 2**63) % 2**64 - 2**63
+                expected.append(str(value))
+        assert result.stdout.decode().split() == expected, n
+    return None
+
+
+@pytest.mark.skipif(
+    platform.system() != "Linux" or platform.machine() != "x86_64",
+    reason="needs x86-64 Linux",
+)
+def test_dividing_smallest_number_by_minus_one_traps(tmp_path: Path) -> None:
+    for op in ("/", "%"):
+        ir = ir_of(f"var n = read_int(); print_int(n {op} 1000000007);")
+        ir["main"].instructions = [
+            (
+                replace(insn, value=-1)
+                if isinstance(insn, LoadIntConst) and insn.value == 1000000007
+                else insn
+            )
+            for insn in ir["main"].instructions
+        ]
+        executable = tmp_path / "program"
+        executable.write_bytes(assemble_native(generate_assembly(ir)))
+        executable.chmod(0o755)
+        result = subprocess.run([executable], input=b"-7\n", capture_output=True)
+        assert result.stdout == (b"7\n" if op == "/" else b"0\n")
+        result = subprocess.run(
+            [executable], input=f"{-(2**63)}\n".encode(), capture_output=True
+        )
+        assert result.returncode == -signal.SIGFPE, op
+    return None
+
+
+def test_functions_without_spills_have_no_frame() -> None:
+    lines = asm_of(
+        "fun sq(x: Int): Int { return x * x; }"
+        "fun g(a: Int): Int { var b = sq(a); return sq(b) + a; }"
+        "print_int(g(3));"
+    )
+    assert "pushq %rbp" not in lines
+    sq = lines[lines.index("sq:") : lines.index(".global g")]
+    assert not any("%rsp" in line for line in sq)
+    g = lines[lines.index("g:") : lines.index(".global main")]
+    assert g[1] == "pushq %rbx"
+    assert g[-2:] == ["popq %rbx", "ret"]
+    return None
+
+
+def test_functions_with_spills_have_frame() -> None:
+    names = [f"v{i}" for i in range(20)]
+    code = " ".join(f"var {n} = read_int();" for n in names)
+    code += " print_int(" + " + ".join(names) + ");"
+    lines = asm_of(code)
+    assert lines[lines.index("main:") + 1] == "pushq %rbp"
+    return None
+
+
+def test_stack_is_aligned_at_calls() -> None:
+    sources = [
+        "fun f(a: Int, b: Int, c: Int, d: Int, e: Int, g: Int, h: Int): Int"
+        " { print_int(h); return a + h; }"
+        " fun k(a: Int): Int { var x = read_int(); print_int(a); return x; }"
+        " print_int(f(1, 2, 3, 4, 5, 6, k(7)));",
+        " ".join(f"var v{i} = read_int();" for i in range(15))
+        + " print_int("
+        + " + ".join(f"v{i}" for i in range(15))
+        + ");",
+    ]
+    for source in sources:
+        for allocator in ("stack", "linear-scan", "graph-coloring"):
+            lines = generate_assembly(ir_of(source), allocator).splitlines()
+            # Bytes pushed since the caller's %rsp was aligned.
+            offset = 0
+            for line in lines:
+                if line.endswith(":") and not line.startswith("."):
+                    offset = 8
+                elif line.startswith("pushq "):
+                    offset += 8
+                elif line.startswith("popq "):
+                    offset -= 8
+                elif m := re.fullmatch(r"(sub|add)q \$(\d+), %rsp", line):
+                    offset += int(m[2]) if m[1] == "sub" else -int(m[2])
+                elif line.startswith("callq "):
+                    assert offset % 16 == 0, (allocator, line)
+    return None
+
+
+def test_more_than_six_arguments() -> None:
+    lines = asm_of(
+        "fun f(a: Int, b: Int, c: Int, d: Int, e: Int, g: Int, h: Int): Int"
+        " { return h; } print_int(f(1, 2, 3, 4, 5, 6, 7));"
+    )
+    assert any(line.startswith("movq 16(%rbp), ") for line in lines)
+    call = lines.index("callq f")
+    assert lines[call - 8 : call - 6] == ["subq $8, %rsp", "pushq $7"]
+    assert lines[call + 1] == "addq $16, %rsp"
+    return None
+
+
+def test_tail_calls_become_jumps() -> None:
+    lines = asm_of(
+        "fun loop(n: Int): Int { if n == 0 then { return 0; } return loop(n - 1); }"
+        " fun even(n: Int): Bool { if n == 0 then { return true; } return odd(n - 1); }"
+        " fun odd(n: Int): Bool { if n == 0 then { return false; } return even(n - 1); }"
+        " print_int(loop(10)); print_bool(even(10));"
+    )
+    assert "jmp .loop_start" in lines
+    assert "jmp odd" in lines
+    assert "jmp even" in lines
+    assert "callq loop" in lines
+    assert "callq even" in lines
+    assert "callq odd" not in lines
+    return None
+
+
+@pytest.mark.skipif(
+    platform.system() != "Linux" or platform.machine() != "x86_64",
+    reason="needs x86-64 Linux",
+)
+def test_values_live_across_read_int(tmp_path: Path) -> None:
+    # read_int must restore the callee-saved registers that hold a and b.
+    source = (
+        "var a = read_int(); var b = read_int(); var c = read_int();"
+        " print_int(a + b + c); var d = read_int(); print_int(a * 1000 + b * 100 + d);"
+    )
+    for allocator in ("stack", "linear-scan", "graph-coloring"):
+        executable = tmp_path / f"program-{allocator}"
+        executable.write_bytes(
+            assemble_native(generate_assembly(ir_of(source), allocator))
+        )
+        executable.chmod(0o755)
+        result = subprocess.run(
+            [executable], input=b"1\n2\n3\n4\n", capture_output=True, check=True
+        )
+        assert result.stdout.decode().split() == ["6", "1204"], allocator
+    return None
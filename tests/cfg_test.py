@@ -0,0 +1,84 @@
+from compiler import ir
+from compiler.cfg import build_control_flow_graph, control_flow_graph
+from tests.helpers import ir_of
+
+L = None
+
+
+def test_basic_blocks_and_edges() -> None:
+    x = ir.IRVar("x")
+    start, then, end = ir.Label(L, "start"), ir.Label(L, "then"), ir.Label(L, "end")
+    graph = build_control_flow_graph(
+        [
+            start,
+            ir.LoadBoolConst(L, True, x),
+            ir.CondJump(L, x, then, end),
+            then,
+            ir.Jump(L, end),
+            end,
+            ir.Return(L, x),
+        ]
+    )
+    assert [b.label for b in graph.blocks] == ["start", "then", "end"]
+    assert [b.start for b in graph.blocks] == [0, 3, 5]
+    assert graph.blocks[0].succs == [1, 2]
+    assert graph.blocks[2].preds == [0, 1]
+    assert graph.blocks[2].succs == []
+    assert graph.idom == [None, 0, 0]
+    assert graph.dominates(0, 2)
+    assert not graph.dominates(1, 2)
+    assert graph.loops == []
+    return None
+
+
+def test_unreachable_blocks() -> None:
+    x = ir.IRVar("x")
+    graph = build_control_flow_graph(
+        [ir.Label(L, "start"), ir.Return(L, x), ir.LoadIntConst(L, 1, x)]
+    )
+    assert len(graph.blocks) == 2
+    assert graph.reverse_postorder == [0]
+    assert not graph.is_reachable(1)
+    assert not graph.dominates(0, 1)
+    return None
+
+
+def test_nested_loops() -> None:
+    fun = ir_of(
+        "var i = 0; while i < 3 do { var j = 0; while j < 3 do { j = j + 1; }"
+        " i = i + 1; } print_int(i);"
+    )["main"]
+    graph = control_flow_graph(fun)
+    assert len(graph.loops) == 2
+    inner, outer = graph.loops
+    assert inner.parent is outer
+    assert outer.parent is None
+    assert inner.blocks < outer.blocks
+    assert (inner.depth, outer.depth) == (2, 1)
+    assert graph.loop_depth(inner.header) == 2
+    assert graph.loop_depth(0) == 0
+    for loop in graph.loops:
+        assert all(graph.dominates(loop.header, b) for b in loop.blocks)
+    return None
+
+
+def test_break_leaves_the_loop() -> None:
+    fun = ir_of(
+        "var i = 0; while true do { if i == 3 then break; i = i + 1; } print_int(i);"
+    )["main"]
+    graph = control_flow_graph(fun)
+    (loop,) = graph.loops
+    end = graph.blocks[-1].index
+    assert end not in loop.blocks
+    assert graph.dominates(loop.header, end)
+    return None
+
+
+def test_graph_is_cached_until_instructions_change() -> None:
+    fun = ir_of("var i = 0; while i < 3 do { i = i + 1; }")["main"]
+    graph = control_flow_graph(fun)
+    assert control_flow_graph(fun) is graph
+    fun.instructions = fun.instructions[:1]
+    assert control_flow_graph(fun) is not graph
+    assert len(control_flow_graph(fun).blocks) == 1
+    return None
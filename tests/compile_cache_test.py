@@ -0,0 +1,30 @@
+from pathlib import Path
+from compiler.compile_cache import CompileCache, cache_key
+
+
+def test_compile_cache_key() -> None:
+    assert cache_key("1 + 2", {}) == cache_key("1 + 2", {})
+    assert cache_key("1 + 2", {}) != cache_key("1 + 3", {})
+    assert cache_key("1 + 2", {}) != cache_key("1 + 2", {"optimize": 1})
+    return None
+
+
+def test_compile_cache_evicts_least_recently_used() -> None:
+    cache = CompileCache(max_entries=2)
+    cache.put("a", b"A")
+    cache.put("b", b"B")
+    assert cache.get("a") == b"A"
+    cache.put("c", b"C")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"A"
+    assert cache.get("c") == b"C"
+    return None
+
+
+def test_compile_cache_directory_is_shared(tmp_path: Path) -> None:
+    CompileCache(directory=str(tmp_path)).put("a", b"A")
+    other = CompileCache(max_entries=0, directory=str(tmp_path))
+    assert other.get("a") == b"A"
+    assert other.get("b") is None
+    assert [p.name for p in tmp_path.iterdir()] == ["a"]
+    return None
@@ -0,0 +1,40 @@
+from compiler.compile_stats import CompileStats, StageTime, StatsAggregator
+from compiler.pipeline import count_ast_nodes
+from compiler.parser import parse
+from compiler.tokenizer import tokenize
+
+
+def test_compile_stats_stage() -> None:
+    stats = CompileStats()
+    with stats.stage("parse"):
+        pass
+    with stats.stage("parse"):
+        pass
+    assert list(stats.stages) == ["parse"]
+    assert stats.stages["parse"].wall >= 0
+    assert stats.to_json()["cache"] is None
+    return None
+
+
+def test_compile_stats_aggregator() -> None:
+    stats = CompileStats()
+    stats.cache = "miss"
+    stats.stages["as"] = StageTime(wall=0.00015, cpu=0.0001)
+    aggregator = StatsAggregator()
+    aggregator.record(stats, error=False)
+    aggregator.record(CompileStats(), error=True)
+
+    result = aggregator.to_json()
+    assert result["requests"] == 2
+    assert result["errors"] == 1
+    assert result["cache_misses"] == 1
+    assert result["cache_hits"] == 0
+    assert result["stages"]["as"]["count"] == 1
+    assert result["stages"]["as"]["wall_histogram"][1] == {"le": 0.0002, "count": 1}
+    assert result["stages"]["ld"]["count"] == 0
+    return None
+
+
+def test_compile_stats_count_ast_nodes() -> None:
+    assert count_ast_nodes(parse(tokenize("1 + 2"))) == 5
+    return None
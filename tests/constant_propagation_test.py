@@ -0,0 +1,66 @@
+from compiler import ir
+from compiler.constant_propagation import propagate_constants
+from compiler.ssa import to_ssa
+from tests.helpers import ir_of
+
+
+def propagated(code: str, name: str = "main") -> list[ir.Instruction]:
+    return propagate_constants(to_ssa(ir_of(code)[name])).instructions
+
+
+def calls(instructions: list[ir.Instruction]) -> list[str]:
+    return [insn.fun.name for insn in instructions if isinstance(insn, ir.Call)]
+
+
+def int_constants(instructions: list[ir.Instruction]) -> list[int]:
+    return [insn.value for insn in instructions if isinstance(insn, ir.LoadIntConst)]
+
+
+def test_constant_branches_become_jumps() -> None:
+    result = propagated(
+        "var x = 2 * 3; if x > 5 then print_int(x) else print_int(read_int());"
+    )
+    assert calls(result) == ["print_int"]
+    assert not any(isinstance(insn, ir.CondJump) for insn in result)
+    assert 6 in int_constants(result)
+    return None
+
+
+def test_only_branches_that_are_taken_count() -> None:
+    # x = 2 never runs, so x stays 1 around the loop.
+    result = propagated(
+        "var x = 1; var c = false; while read_int() > 0 do { if c then x = 2; }"
+        " if x == 1 then print_int(x) else print_int(0);"
+    )
+    assert calls(result) == ["read_int", ">", "print_int"]
+    assert 2 not in int_constants(result)
+    return None
+
+
+def test_wraparound_and_truncating_division() -> None:
+    result = propagated(
+        "print_int(9223372036854775807 + 1); print_int(-7 / 2); print_int(-7 % 2);"
+        " print_int(3037000500 * 3037000500);"
+    )
+    assert calls(result) == ["print_int"] * 4
+    assert -(2**63) in int_constants(result)
+    assert {-3, -1, -9223372036709301616} <= set(int_constants(result))
+    return None
+
+
+def test_division_that_traps_is_kept() -> None:
+    result = propagated(
+        "print_int(1 / 0); print_int(1 % 0); var m = -9223372036854775807 - 1;"
+        " print_int(m / -1);"
+    )
+    assert calls(result).count("/") == 2
+    assert calls(result).count("%") == 1
+    return None
+
+
+def test_parameters_are_not_constant() -> None:
+    result = propagated(
+        "fun f(n: Int): Bool { var y = n + 0; return y == n; } print_bool(f(1));", "f"
+    )
+    assert calls(result) == ["+", "=="]
+    return None
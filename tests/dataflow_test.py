@@ -0,0 +1,96 @@
+from compiler import ir
+from compiler.dataflow import (
+    available_expressions,
+    live_variables,
+    reaching_definitions,
+)
+from tests.helpers import ir_of
+
+L = None
+x, y, c = ir.IRVar("x"), ir.IRVar("y"), ir.IRVar("c")
+start, loop, end = ir.Label(L, "start"), ir.Label(L, "loop"), ir.Label(L, "end")
+
+
+def test_live_variables_in_loop() -> None:
+    instructions: list[ir.Instruction] = [
+        start,
+        ir.LoadIntConst(L, 1, x),
+        loop,
+        ir.Call(L, ir.IRVar("<"), [x, y], c),
+        ir.CondJump(L, c, loop, end),
+        end,
+        ir.Return(L, x),
+    ]
+    solution = live_variables(instructions)
+    assert [solution.members(facts) for facts in solution.block_in] == [
+        {y},
+        {x, y},
+        {x},
+    ]
+    before, after = solution.instruction_sets()
+    assert before[1] == {y}
+    assert after[1] == {x, y}
+    assert after[4] == {x, y}
+    return None
+
+
+def test_live_variables_only_tracked() -> None:
+    instructions: list[ir.Instruction] = [start, ir.Copy(L, y, x), ir.Return(L, x)]
+    before, _ = live_variables(instructions, tracked=[x]).instruction_sets()
+    assert before[0] == set()
+    return None
+
+
+def test_reaching_definitions() -> None:
+    instructions: list[ir.Instruction] = [
+        start,
+        ir.LoadBoolConst(L, True, c),
+        ir.CondJump(L, c, loop, end),
+        loop,
+        ir.LoadIntConst(L, 1, x),
+        end,
+        ir.Return(L, x),
+    ]
+    solution = reaching_definitions(instructions, [x])
+    before, _ = solution.instruction_facts()
+    assert solution.members(before[6]) == {(None, x), (4, x), (1, c)}
+    assert solution.members(before[5]) == solution.members(solution.block_in[2])
+    return None
+
+
+def test_available_expressions() -> None:
+    plus = ir.IRVar("+")
+    instructions: list[ir.Instruction] = [
+        start,
+        ir.Call(L, plus, [x, y], c),
+        ir.CondJump(L, c, loop, end),
+        loop,
+        ir.LoadIntConst(L, 1, y),
+        ir.Call(L, plus, [x, y], c),
+        ir.Call(L, plus, [x, c], c),
+        end,
+        ir.Return(L, c),
+    ]
+    solution = available_expressions(instructions)
+    before, after = solution.instruction_facts()
+    assert solution.members(before[3]) == {("+", (x, y))}
+    # Assigning y makes x + y stale until it's computed again.
+    assert solution.members(after[4]) == set()
+    assert solution.members(after[5]) == {("+", (x, y))}
+    # x + c uses the variable it's assigned to.
+    assert solution.members(after[6]) == {("+", (x, y))}
+    assert solution.members(before[7]) == {("+", (x, y))}
+    return None
+
+
+def test_large_function() -> None:
+    code = " ".join(
+        f"var i{k} = 0; while i{k} < 3 do {{ i{k} = i{k} + 1; }}" for k in range(2000)
+    )
+    instructions = ir_of(code)["main"].instructions
+    assert len(instructions) > 20000
+    solution = live_variables(instructions)
+    assert solution.members(solution.block_in[0]) == set()
+    reaching_definitions(instructions, [])
+    available_expressions(instructions)
+    return None
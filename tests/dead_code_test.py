@@ -0,0 +1,70 @@
+from compiler import ir
+from compiler.dead_code import eliminate_dead_code
+from tests.helpers import ir_of
+
+
+def calls(fun: ir.Function) -> list[str]:
+    return [insn.fun.name for insn in fun.instructions if isinstance(insn, ir.Call)]
+
+
+def test_unused_values_are_removed() -> None:
+    fun = eliminate_dead_code(ir_of("var x = 1 + 2; print_int(3);")["main"])
+    assert calls(fun) == ["print_int"]
+    assert [
+        insn.value for insn in fun.instructions if isinstance(insn, ir.LoadIntConst)
+    ] == [3]
+    assert not any(isinstance(insn, ir.Copy) for insn in fun.instructions)
+    return None
+
+
+def test_calls_with_effects_are_kept() -> None:
+    fun = eliminate_dead_code(
+        ir_of("var x = read_int(); var y = 1 / 0; var z = x % 2; x + 1;")["main"]
+    )
+    assert calls(fun) == ["read_int", "/", "%"]
+    return None
+
+
+def test_dead_values_read_only_by_dead_code() -> None:
+    # The copy to b is dead, which makes the sum dead too.
+    fun = eliminate_dead_code(
+        ir_of(
+            "var a = 1 + 2; var b = 0; if read_int() > 0 then { b = a; } print_int(1);"
+        )["main"]
+    )
+    assert calls(fun) == ["read_int", ">", "print_int"]
+    # Variables read by the loop condition stay.
+    fun = eliminate_dead_code(ir_of("var i = 0; while i < 3 do i = i + 1;")["main"])
+    assert calls(fun) == ["<", "+"]
+    return None
+
+
+def test_unreachable_code_and_unused_labels_are_removed() -> None:
+    fun = ir_of(
+        "fun f(): Int { if true then { return 1; } print_int(2); return 3; } f()"
+    )["f"]
+    result = eliminate_dead_code(fun)
+    assert sum(isinstance(insn, ir.Return) for insn in result.instructions) == 2
+    # The jump past the else branch comes after a return.
+    assert not any(isinstance(insn, ir.Jump) for insn in result.instructions)
+    labels = [insn.name for insn in result.instructions if isinstance(insn, ir.Label)]
+    targets = [
+        label.name
+        for insn in result.instructions
+        if isinstance(insn, ir.CondJump)
+        for label in (insn.then_label, insn.else_label)
+    ]
+    # The first label stays for tail calls.
+    assert labels == ["start", *targets]
+    return None
+
+
+def test_removed_instructions_are_counted() -> None:
+    functions = ir_of("fun f(x: Int): Int { var y = x; return x; } var z = f(1);")
+    removed: dict[str, int] = {}
+    results = {name: eliminate_dead_code(f, removed) for name, f in functions.items()}
+    assert set(removed) == {"f", "main"}
+    for name, f in functions.items():
+        assert removed[name] == len(f.instructions) - len(results[name].instructions)
+    assert removed["f"] > 0
+    return None
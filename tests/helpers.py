@@ -0,0 +1,11 @@
+from compiler import ir
+from compiler.ir_generator import generate_ir
+from compiler.parser import parse
+from compiler.tokenizer import tokenize
+from compiler.type_checker import typecheck
+
+
+def ir_of(code: str) -> dict[str, ir.Function]:
+    node = parse(tokenize(code))
+    typecheck(node)
+    return generate_ir(node)
@@ -135,3 +135,15 @@ def test_interpreter_function_def() -> None:
         is None
     )
     return None
+
+
+def test_interpreter_tail_calls() -> None:
+    code = """
+    fun count(n: Int, acc: Int): Int {
+        if n == 0 then { return acc; }
+        return count(n - 1, acc + 1);
+    }
+    count(100000, 0)
+    """
+    assert interpret(node=parse(tokenize(code))) == 100000
+    return None
@@ -0,0 +1,16 @@
+from compiler import ir
+from compiler.types import Bool, Unit
+from tests.helpers import ir_of
+
+
+def test_generate_ir_functions() -> None:
+    functions = ir_of("fun f(a: Int, b: Int): Bool { return a < b; } f(1, 2)")
+    assert list(functions) == ["f", "main"]
+    f = functions["f"]
+    assert f.name == "f"
+    assert f.params == [ir.IRVar("a"), ir.IRVar("b")]
+    assert f.return_type == Bool
+    assert isinstance(f.instructions[-1], ir.Return)
+    assert functions["main"].params == []
+    assert functions["main"].return_type == Unit
+    return None
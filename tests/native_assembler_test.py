@@ -0,0 +1,76 @@
+import platform
+import subprocess
+from pathlib import Path
+import pytest
+from compiler.native_assembler import (
+    UnsupportedAssembly,
+    _layout,
+    _parse,
+    assemble_native,
+)
+from compiler.pipeline import CompileOptions, call_compiler
+
+
+def encode(code: str) -> bytes:
+    return _layout(_parse(code), 0)[0]
+
+
+def test_native_assembler_encodings() -> None:
+    assert encode("movq %rax, %rbx") == bytes.fromhex("4889c3")
+    assert encode("movq -8(%rbp), %r10") == bytes.fromhex("4c8b55f8")
+    assert encode("movq %rsi, (%rsp)") == bytes.fromhex("48893424")
+    assert encode("movq $-5, %rcx") == bytes.fromhex("48c7c1fbffffff")
+    assert encode("movabsq $1234567890123, %r14") == bytes.fromhex(
+        "49becb04fb711f010000"
+    )
+    assert encode("addq $1, %rax") == bytes.fromhex("4883c001")
+    assert encode("addq $1000, %rax") == bytes.fromhex("4805e8030000")
+    assert encode("imulq $10, %r10") == bytes.fromhex("4d6bd20a")
+    assert encode("idivq -32(%rbp)") == bytes.fromhex("48f77de0")
+    assert encode("setl %dil") == bytes.fromhex("400f9cc7")
+    assert encode("movb %dl, (%rsp)") == bytes.fromhex("881424")
+    assert encode("pushq %r12\npopq %rbp") == bytes.fromhex("41545d")
+    assert encode("cqto\nret") == bytes.fromhex("4899c3")
+    return None
+
+
+def test_native_assembler_jumps() -> None:
+    assert encode("a:\njmp a") == bytes.fromhex("ebfe")
+    assert encode("a:\nje a") == bytes.fromhex("74fe")
+    far = '.ascii "' + "x" * 200 + '"\n'
+    code = encode("jne b\n" + far + "b:\n")
+    assert code[:6] == bytes.fromhex("0f85c8000000")
+    return None
+
+
+def test_native_assembler_data_and_symbols() -> None:
+    code = encode('s:\n.ascii "ab\\n"\nlen = . - s\nmovq $len, %rdx')
+    assert code == b"ab\n" + bytes.fromhex("48c7c203000000")
+    return None
+
+
+def test_native_assembler_rejects_unsupported_code() -> None:
+    with pytest.raises(UnsupportedAssembly):
+        _parse("vaddps %ymm0, %ymm1, %ymm2")
+    with pytest.raises(UnsupportedAssembly):
+        _parse(".section .data")
+    with pytest.raises(Exception, match="Undefined reference"):
+        assemble_native("main:\njmp nowhere")
+    return None
+
+
+@pytest.mark.skipif(
+    platform.system() != "Linux" or platform.machine() != "x86_64",
+    reason="needs x86-64 Linux",
+)
+def test_native_assembler_executable(tmp_path: Path) -> None:
+    source = "fun square(x: Int): Int { return x * x; } print_int(square(-7));"
+    for assembler in ("native", "gnu"):
+        executable = tmp_path / assembler
+        executable.write_bytes(
+            call_compiler(source, "test", options=CompileOptions(assembler))
+        )
+        executable.chmod(0o755)
+        result = subprocess.run([executable], capture_output=True, check=True)
+        assert result.stdout == b"49\n"
+    return None
@@ -0,0 +1,31 @@
+from compiler.peephole import all_rules, optimize
+
+
+def test_peephole_store_load() -> None:
+    hits: dict[str, int] = {}
+    code = "movq %rax, -16(%rbp)\nmovq -16(%rbp), %rax\nmovq -16(%rbp), %rcx"
+    assert optimize(code, hits=hits) == "movq %rax, -16(%rbp)\nmovq %rax, %rcx"
+    assert hits == {"store_load": 2}
+    return None
+
+
+def test_peephole_jump_to_next_label() -> None:
+    code = "jmp .f_L1\n.f_L1:\njle .f_L2\n.f_L3:\n.f_L2:"
+    assert optimize(code) == ".f_L1:\njle .f_L2\n.f_L3:\n.f_L2:"
+    return None
+
+
+def test_peephole_zero_with_xor_keeps_live_flags() -> None:
+    assert optimize("movq $0, %r9\naddq %r8, %r9") == "xorl %r9d, %r9d\naddq %r8, %r9"
+    code = "cmpq %rsi, %rdi\nmovq $0, %rcx\njl .f_L1"
+    assert optimize(code) == code
+    assert optimize("movq $0, -8(%rbp)\nret") == "movq $0, -8(%rbp)\nret"
+    return None
+
+
+def test_peephole_rules_can_be_chosen() -> None:
+    code = "movq %rcx, %rcx\nmovq $0, %rax\nret"
+    assert optimize(code, rules={}) == code
+    rules = {"self_move": all_rules["self_move"]}
+    assert optimize(code, rules=rules) == "movq $0, %rax\nret"
+    return None
@@ -0,0 +1,196 @@
+import sys
+from types import FrameType
+from typing import Callable
+from compiler import ir, register_allocator
+from compiler.register_allocator import (
+    callee_saved_registers,
+    graph_coloring_allocation,
+    interference_graph,
+    linear_scan_allocation,
+    live_intervals,
+    liveness,
+    undefined_location,
+)
+from tests.helpers import ir_of
+
+L = None
+
+
+def test_liveness_in_loop() -> None:
+    x, y, c = ir.IRVar("x"), ir.IRVar("y"), ir.IRVar("c")
+    start, end = ir.Label(L, "start"), ir.Label(L, "end")
+    instructions: list[ir.Instruction] = [
+        ir.LoadIntConst(L, 1, x),
+        start,
+        ir.Call(L, ir.IRVar("<"), [x, x], c),
+        ir.CondJump(L, c, end, start),
+        end,
+        ir.Return(L, y),
+    ]
+    live_in, live_out = liveness(instructions)
+    assert live_in[0] == {y}
+    assert live_out[0] == {x, y}
+    assert live_in[1] == {x, y}
+    assert live_out[3] == {x, y}
+    assert live_in[5] == {y}
+    return None
+
+
+def test_live_intervals_cross_calls() -> None:
+    fun = ir_of("var a = 1; var b = 2; print_int(a); b")["main"].instructions
+    intervals = {i.var.name: i for i in live_intervals(fun, [])}
+    crossing = {name for name, i in intervals.items() if i.crosses_call}
+    # Only b's value is needed after the call.
+    assert crossing == {"x3"}
+    return None
+
+
+def test_linear_scan_uses_registers() -> None:
+    fun = ir_of("var a = 1; var b = a + 2; b * a")["main"].instructions
+    allocation = linear_scan_allocation(fun, [])
+    assert all(loc.startswith("%") for loc in allocation.locations.values())
+    assert allocation.stack_used == 0
+    assert allocation.saved_registers == {}
+    return None
+
+
+def test_linear_scan_keeps_values_across_calls_in_callee_saved_registers() -> None:
+    fun = ir_of("var a = read_int(); print_int(a); a")["main"].instructions
+    allocation = linear_scan_allocation(fun, [])
+    a = next(i.var for i in live_intervals(fun, []) if i.crosses_call)
+    assert allocation.locations[a] in callee_saved_registers
+    assert list(allocation.saved_registers) == [allocation.locations[a]]
+    return None
+
+
+def test_linear_scan_spills_and_reuses_slots() -> None:
+    names = [f"v{i}" for i in range(20)]
+    code = " ".join(f"var {n} = read_int();" for n in names)
+    code += " print_int(" + " + ".join(names) + ");"
+    code += " " + " ".join(f"var w{n} = read_int();" for n in names)
+    code += " print_int(" + " + ".join(f"w{n}" for n in names) + ");"
+    fun = ir_of(code)["main"].instructions
+    allocation = linear_scan_allocation(fun, [])
+    slots = {loc for loc in allocation.locations.values() if loc.endswith("(%rbp)")}
+    assert slots
+    # The second group of variables reuses the slots of the first group.
+    assert len(slots) < 30
+    assert allocation.stack_used % 16 == 0
+    return None
+
+
+def test_linear_scan_parameters() -> None:
+    funs = ir_of(
+        "fun f(a: Int, b: Int, c: Int): Int { b = 1; return a + b; } f(1, 2, 3)"
+    )
+    fun = funs["f"].instructions
+    params = funs["f"].params
+    allocation = linear_scan_allocation(fun, params)
+    assert allocation.locations[ir.IRVar("a")] == "%rdi"
+    assert allocation.unused_params == {ir.IRVar("b"), ir.IRVar("c")}
+    assert ir.IRVar("c") not in allocation.locations
+    return None
+
+
+def test_linear_scan_undefined_variables() -> None:
+    fun = ir_of("fun f(): Unit { print_int(1); } f()")["f"].instructions
+    allocation = linear_scan_allocation(fun, [])
+    assert allocation.locations[ir.IRVar("unit")] == undefined_location
+    return None
+
+
+def test_graph_coloring_coalesces_copies() -> None:
+    fun = ir_of("var a = 1; while a < 10 do { a = a + 1; } a")["main"].instructions
+    allocation = graph_coloring_allocation(fun, [])
+    for insn in fun:
+        if isinstance(insn, ir.Copy):
+            assert allocation.locations[insn.src] == allocation.locations[insn.dest]
+    return None
+
+
+def test_graph_coloring_coalesces_into_long_lived_variable() -> None:
+    code = "var s = read_int(); "
+    code += " ".join(f"var v{k} = read_int(); s = s + v{k} * {k};" for k in range(300))
+    fun = ir_of(code + " print_int(s);")["main"].instructions
+    allocation = graph_coloring_allocation(fun, [])
+    copies = [insn for insn in fun if isinstance(insn, ir.Copy)]
+    # The copies to s, which is the first variable assigned.
+    s = copies[0].dest
+    copies = [insn for insn in copies if insn.dest == s]
+    assert len(copies) == 301
+    location = allocation.locations[s]
+    assert all(allocation.locations[insn.src] == location for insn in copies)
+    return None
+
+
+def test_graph_coloring_keeps_interfering_variables_apart() -> None:
+    fun = ir_of("var a = read_int(); var b = read_int(); print_int(a - b); a + b")[
+        "main"
+    ].instructions
+    live_in, live_out = liveness(fun)
+    graph, crosses_call = interference_graph(fun, [], live_in, live_out)
+    allocation = graph_coloring_allocation(fun, [])
+    for v, neighbors in graph.items():
+        for n in neighbors:
+            assert allocation.locations[v] != allocation.locations[n]
+    for v in crosses_call:
+        assert allocation.locations[v] in callee_saved_registers
+    return None
+
+
+def test_graph_coloring_spills_and_shares_slots() -> None:
+    names = [f"v{i}" for i in range(20)]
+    code = " ".join(f"var {n} = read_int();" for n in names)
+    code += " print_int(" + " + ".join(names) + ");"
+    code += " " + " ".join(f"var w{n} = read_int();" for n in names)
+    code += " print_int(" + " + ".join(f"w{n}" for n in names) + ");"
+    fun = ir_of(code)["main"].instructions
+    allocation = graph_coloring_allocation(fun, [])
+    slots = {loc for loc in allocation.locations.values() if loc.endswith("(%rbp)")}
+    assert slots
+    assert len(slots) < 30
+    assert allocation.stack_used % 16 == 0
+    return None
+
+
+def test_graph_coloring_parameters() -> None:
+    funs = ir_of("fun f(a: Int, b: Int): Int { b = a; return a + b; } f(1, 2)")
+    fun = funs["f"].instructions
+    params = funs["f"].params
+    allocation = graph_coloring_allocation(fun, params)
+    assert allocation.locations[ir.IRVar("a")] == "%rdi"
+    assert allocation.unused_params == {ir.IRVar("b")}
+    return None
+
+
+def test_allocation_work_grows_linearly_with_long_lived_variable() -> None:
+    def calls(terms: int, allocate: Callable[..., object]) -> int:
+        code = "var s = read_int(); "
+        code += " ".join(
+            f"var v{k} = read_int(); s = s + v{k} * {k};" for k in range(terms)
+        )
+        fun = ir_of(code + " print_int(s);")["main"].instructions
+        # Count the calls into the allocator's code instead of timing it,
+        # which would depend on how busy the machine is.
+        count = 0
+
+        def profile(frame: FrameType, event: str, arg: object) -> None:
+            nonlocal count
+            if (
+                event == "call"
+                and frame.f_code.co_filename == register_allocator.__file__
+            ):
+                count += 1
+
+        sys.setprofile(profile)
+        try:
+            allocate(fun, [])
+        finally:
+            sys.setprofile(None)
+        return count
+
+    for allocate in (linear_scan_allocation, graph_coloring_allocation):
+        # Four times the code should take about four times the work,
+        # not sixteen times or more.
+        assert calls(400, allocate) < 6 * calls(100, allocate), allocate
+    return None
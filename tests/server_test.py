@@ -0,0 +1,233 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from socketserver import StreamRequestHandler
+from typing import Any
+import pytest
+from compiler import server
+from compiler.compile_cache import CompileCache
+from compiler.server import Server, WorkerPool, encode_response, handle_raw_request
+from compiler.async_server import read_frame
+
+
+def request(input: dict) -> dict:
+    return json.loads(b"".join(handle_raw_request(json.dumps(input).encode())))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port: int = sock.getsockname()[1]
+        return port
+
+
+def send(port: int, data: bytes) -> bytes:
+    """Sends a request to a prefork server and returns the whole response."""
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        sock.sendall(data)
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile("rb") as response:
+            return response.read()
+
+
+def wait_until_listening(port: int) -> None:
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return None
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    raise Exception(f"Nothing is listening on port {port}")
+
+
+def test_server_ping() -> None:
+    assert request({"command": "ping"}) == {}
+    return None
+
+
+def test_server_unknown_command() -> None:
+    assert request({"command": "foo"}) == {"error": "Unknown command: foo"}
+    return None
+
+
+def test_server_invalid_json() -> None:
+    result = json.loads(b"".join(handle_raw_request(b"{")))
+    assert "JSONDecodeError" in result["error"]
+    return None
+
+
+def test_server_compile_error() -> None:
+    result = request({"command": "compile", "code": "1 +"})
+    assert "Parsing error" in result["error"]
+    return None
+
+
+def test_server_compile_batch() -> None:
+    result = request({"command": "compile_batch", "programs": ["1 +"]})
+    assert len(result["results"]) == 1
+    assert "Parsing error" in result["results"][0]["error"]
+
+    result = request({"command": "compile_batch", "programs": "1 + 2"})
+    assert "Expected a list of programs" in result["error"]
+    return None
+
+
+class CountingCache(CompileCache):
+    lookups = 0
+
+    def get(self, key: str) -> bytes | None:
+        self.lookups += 1
+        return super().get(key)
+
+
+def test_server_compile_batch_uses_cache(tmp_path: Path) -> None:
+    server.configure_worker(0, str(tmp_path), None, None, None)
+    server.compile_cache = cache = CountingCache(0, str(tmp_path))
+    try:
+        programs = ["print_int(1);", "print_int(2);", "1 +"]
+        for cache_result in ["miss", "hit"]:
+            lookups = cache.lookups
+            results = server.compile_batch(programs, True, None)
+            assert [r["stats"]["cache"] for r in results[:2]] == [cache_result] * 2
+            assert "Parsing error" in results[2]["error"]
+            # Each program is looked up once, even when it is found.
+            assert cache.lookups - lookups == len(programs)
+    finally:
+        server.shutdown_batch_pool()
+        server.configure_worker(0, None, None, None, None)
+    return None
+
+
+def test_server_encode_response() -> None:
+    result = {"program": b"\x7fELF"}
+    assert encode_response(dict(result), binary=False, framed=False) == [
+        b'{"program": "f0VMRg=="}'
+    ]
+    assert encode_response(dict(result), binary=False, framed=True) == [
+        struct.pack("!I", 23),
+        b'{"program": "f0VMRg=="}',
+    ]
+    assert encode_response(dict(result), binary=True, framed=False) == [
+        struct.pack("!I", 19),
+        b'{"program_size": 4}',
+        b"\x7fELF",
+    ]
+    assert encode_response(
+        {"results": [{"program": b"ab"}, {"error": "x"}, {"program": b"c"}]},
+        binary=True,
+        framed=False,
+    ) == [
+        struct.pack("!I", 71),
+        b'{"results": [{"program_size": 2}, {"error": "x"}, {"program_size": 1}]}',
+        b"ab",
+        b"c",
+    ]
+    assert encode_response({"error": "x"}, binary=True, framed=True) == [
+        struct.pack("!I", 14),
+        b'{"error": "x"}',
+    ]
+    return None
+
+
+def test_async_server_read_frames() -> None:
+    async def read_all(data: bytes) -> list[bytes | None]:
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return [await read_frame(reader), await read_frame(reader)]
+
+    data = struct.pack("!I", 3) + b"abc"
+    assert asyncio.run(read_all(data)) == [b"abc", None]
+
+    with pytest.raises(asyncio.IncompleteReadError):
+        asyncio.run(read_all(data[:5]))
+    return None
+
+
+def slow_compiler(*args: Any, **kwargs: Any) -> bytes:
+    time.sleep(1)
+    return b""
+
+
+def slow_server(port: int) -> None:
+    # Every compilation takes a second, so requests pile up.
+    server.call_compiler = slow_compiler
+    server.run_server(
+        "127.0.0.1", port, workers=1, max_concurrency=1, max_queue=1, cache_entries=0
+    )
+
+
+def test_prefork_server_rejects_beyond_queue() -> None:
+    port = free_port()
+    process = multiprocessing.get_context("fork").Process(
+        target=slow_server, args=(port,)
+    )
+    process.start()
+
+    def compile(i: int) -> tuple[dict, float]:
+        start = time.monotonic()
+        request = {"command": "compile", "code": f"print_int({i});"}
+        response = json.loads(send(port, json.dumps(request).encode()))
+        return response, time.monotonic() - start
+
+    try:
+        wait_until_listening(port)
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(compile, range(4)))
+        # One request compiles and one waits for it, and the rest are
+        # turned away before either is done.
+        rejected = [seconds for r, seconds in results if r.get("overloaded")]
+        assert len(rejected) == 2
+        assert max(rejected) < 1
+        assert sum("program" in r for r, _ in results) == 2
+    finally:
+        assert process.pid is not None
+        os.kill(process.pid, signal.SIGTERM)
+        process.join()
+    return None
+
+
+class PidHandler(StreamRequestHandler):
+    def handle(self) -> None:
+        if self.rfile.read() == b"exit":
+            os._exit(1)
+        self.wfile.write(str(os.getpid()).encode())
+
+
+def run_worker_pool(tcp_server: Server) -> None:
+    # A process group of its own tells whether any worker outlives the pool.
+    os.setpgid(0, 0)
+    WorkerPool(tcp_server, workers=1, max_requests=1).run()
+
+
+def test_worker_pool_replaces_workers() -> None:
+    with Server(("127.0.0.1", 0), PidHandler) as tcp_server:
+        port = tcp_server.server_address[1]
+        process = multiprocessing.get_context("fork").Process(
+            target=run_worker_pool, args=(tcp_server,)
+        )
+        process.start()
+    assert process.pid is not None
+    try:
+        # Each worker exits after one request and a fresh one takes over.
+        pids = [int(send(port, b"ping")) for _ in range(3)]
+        assert len(set(pids)) == 3
+        assert process.pid not in pids
+        # So does a worker that dies.
+        assert send(port, b"exit") == b""
+        pids.append(int(send(port, b"ping")))
+        assert len(set(pids)) == 4
+    finally:
+        os.kill(process.pid, signal.SIGTERM)
+        process.join()
+    assert process.exitcode == 0
+    with pytest.raises(ProcessLookupError):
+        os.killpg(process.pid, 0)
+    return None
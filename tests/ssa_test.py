@@ -0,0 +1,120 @@
+import platform
+import subprocess
+from pathlib import Path
+import pytest
+from compiler import ir
+from compiler.assembly_generator import generate_assembly
+from compiler.dataflow import defs
+from compiler.native_assembler import assemble_native
+from compiler.ssa import from_ssa, to_ssa
+from compiler.types import Int
+from tests.helpers import ir_of
+
+L = None
+
+
+def assigned(function: ir.Function) -> list[ir.IRVar]:
+    return [v for insn in function.instructions for v in defs(insn)]
+
+
+def test_every_variable_is_assigned_once() -> None:
+    fun = ir_of(
+        "fun fib(n: Int): Int { var a = 0; var b = 1;"
+        " while n > 0 do { var t = a; a = b; b = t + b; n = n - 1; } return a; }"
+        " print_int(fib(10));"
+    )["fib"]
+    ssa = to_ssa(fun)
+    variables = assigned(ssa)
+    assert len(variables) == len(set(variables))
+    assert ir.IRVar("n") not in variables
+    phis = [insn for insn in ssa.instructions if isinstance(insn, ir.Phi)]
+    # One for each of n, a and b at the loop header.
+    assert len(phis) == 3
+    assert all([label.name for label in phi.labels] == ["start", "L2"] for phi in phis)
+    assert ir.IRVar("n") in {phi.args[0] for phi in phis}
+    return None
+
+
+def test_no_phis_for_dead_variables() -> None:
+    fun = ir_of("var x = 1; if read_int() > 0 then { x = 2; } print_int(1);")["main"]
+    ssa = to_ssa(fun)
+    assert not any(isinstance(insn, ir.Phi) for insn in ssa.instructions)
+    return None
+
+
+def test_unreachable_code_is_left_out() -> None:
+    fun = ir_of("fun f(): Int { return 1; print_int(2); return 3; } f()")["f"]
+    ssa = to_ssa(fun)
+    assert sum(isinstance(insn, ir.Return) for insn in ssa.instructions) == 1
+    return None
+
+
+def test_phis_that_swap_values() -> None:
+    a, b, c = ir.IRVar("a"), ir.IRVar("b"), ir.IRVar("c")
+    a1, b1 = ir.IRVar("a.1"), ir.IRVar("b.1")
+    start, loop, end = ir.Label(L, "start"), ir.Label(L, "loop"), ir.Label(L, "end")
+    fun = ir.Function(
+        "f",
+        [a, b, c],
+        Int,
+        [
+            start,
+            ir.Jump(L, loop),
+            loop,
+            ir.Phi(L, [start, loop], [a, b1], a1),
+            ir.Phi(L, [start, loop], [b, a1], b1),
+            ir.CondJump(L, c, loop, end),
+            end,
+            ir.Return(L, a1),
+        ],
+    )
+    result = from_ssa(fun).instructions
+    assert not any(isinstance(insn, ir.Phi) for insn in result)
+    # The back edge has a block of its own for the copies.
+    cond_jump = next(insn for insn in result if isinstance(insn, ir.CondJump))
+    assert cond_jump.then_label.name != "loop"
+    assert cond_jump.else_label.name == "end"
+    # It comes right after the loop, which can't fall through to it.
+    edge = result.index(cond_jump) + 1
+    assert result[edge] == ir.Label(L, cond_jump.then_label.name)
+    back = result.index(ir.Jump(L, loop), edge)
+    # The versions of a and b don't overlap, so they get their names back.
+    assert not any(a1 in defs(insn) or b1 in defs(insn) for insn in result)
+    values = {a: 1, b: 2}
+    for insn in result[edge + 1 : back]:
+        assert isinstance(insn, ir.Copy)
+        values[insn.dest] = values[insn.src]
+    assert (values[a], values[b]) == (2, 1)
+    return None
+
+
+@pytest.mark.skipif(
+    platform.system() != "Linux" or platform.machine() != "x86_64",
+    reason="needs x86-64 Linux",
+)
+def test_round_trip_keeps_behavior(tmp_path: Path) -> None:
+    functions = ir_of(
+        "fun fib(n: Int): Int { var a = 0; var b = 1;"
+        " while n > 0 do { var t = a; a = b; b = t + b; n = n - 1; } return a; }"
+        " fun collatz(n: Int): Int { var steps = 0;"
+        " while n != 1 do { if n % 2 == 0 then n = n / 2 else n = 3 * n + 1;"
+        " steps = steps + 1; } return steps; }"
+        " var i = 1; while i < 10 do { print_int(fib(i) + collatz(i)); i = i + 1; }"
+    )
+    functions = {name: from_ssa(to_ssa(f)) for name, f in functions.items()}
+    executable = tmp_path / "program"
+    executable.write_bytes(assemble_native(generate_assembly(functions)))
+    executable.chmod(0o755)
+    result = subprocess.run([executable], capture_output=True, check=True)
+    assert result.stdout.decode().split() == [
+        "1",
+        "2",
+        "9",
+        "5",
+        "10",
+        "16",
+        "29",
+        "24",
+        "53",
+    ]
+    return None